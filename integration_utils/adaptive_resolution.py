@@ -0,0 +1,85 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Picks the render resolution of the interactive viewer from frame latency.
+
+Render time is modeled as proportional to the number of pixels, i.e. to
+scale**2 for a resolution scale applied to both image sides. The controller
+keeps a running estimate of the full resolution frame time from the measured
+latencies and, while the camera moves, renders at the scale that fits the
+target frame time. Once the camera has been still for still_frames frames it
+renders at full resolution.
+
+Scales are rounded down to multiples of scale_step so the number of distinct
+resolutions, and with it the cached ray grids (see utils/ray_cache.py),
+stays small.
+"""
+
+import math
+from typing import *
+
+import numpy as np
+
+
+class ResolutionController:
+    def __init__(self,
+                 target_fps: float = 30.0,
+                 min_scale: float = 0.125,
+                 max_scale: float = 1.0,
+                 still_frames: int = 3,
+                 smoothing: float = 0.7,
+                 scale_step: float = 0.0625,
+                 pose_tolerance: float = 1e-6):
+        self.target_time = 1.0 / target_fps
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.still_frames = still_frames
+        self.smoothing = smoothing
+        self.scale_step = scale_step
+        self.pose_tolerance = pose_tolerance
+        # Estimated seconds per frame at full resolution.
+        self.full_frame_time = None
+        self.last_pose = None
+        self.num_still = 0
+        self.scale = max_scale
+
+    def moving_scale(self) -> float:
+        if self.full_frame_time is None:
+            return self.max_scale
+        scale = math.sqrt(self.target_time / max(self.full_frame_time, 1e-9))
+        scale = math.floor(scale / self.scale_step) * self.scale_step
+        return float(np.clip(scale, self.min_scale, self.max_scale))
+
+    def begin(self, pose) -> float:
+        """Returns the resolution scale for a frame rendered from pose (e.g. a view matrix)."""
+        pose = np.asarray(pose, dtype=np.float64)
+        still = (self.last_pose is not None and pose.shape == self.last_pose.shape
+                 and np.allclose(pose, self.last_pose, rtol=0, atol=self.pose_tolerance))
+        self.num_still = self.num_still + 1 if still else 0
+        self.last_pose = pose
+        self.scale = self.max_scale if self.num_still >= self.still_frames else self.moving_scale()
+        return self.scale
+
+    def end(self, latency: float):
+        """Records the latency (seconds) of the frame started by the last begin."""
+        full_frame_time = latency / self.scale**2
+        if self.full_frame_time is None:
+            self.full_frame_time = full_frame_time
+        else:
+            self.full_frame_time = (self.smoothing * self.full_frame_time
+                                    + (1 - self.smoothing) * full_frame_time)
+
+    @staticmethod
+    def scaled_size(width: int, height: int, scale: float) -> Tuple[int, int]:
+        return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
@@ -0,0 +1,148 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks FastRenderer on the train/test cameras of a trained scene.
+
+Every view is rendered --warmup times untimed and --repeats times timed.
+Each frame is split into the stages
+
+  ray_gen:  set_camera + get_rays,
+  color:    SH (and GLO) evaluation in get_color,
+  trace:    the forward trace,
+  readback: copying the image to the host,
+
+with a device synchronization at every stage boundary. The mean, p50, p90
+and p99 of the frame and stage latencies are printed and, with --output,
+written to JSON together with the scene, settings and git commit so runs can
+be compared. --chrome_trace additionally records the scopes and counters of
+FastRenderer and its trace launches (splinetracers/instrumentation.py) to a
+Chrome trace file.
+"""
+
+import torch
+import math
+import os
+from scene import Scene
+from argparse import ArgumentParser
+from arguments import ModelParams, PipelineParams, get_combined_args, OptimizationParams
+from gaussian_renderer import GaussianModel
+from gaussian_renderer.fast_renderer import FastRenderer
+from utils.general_utils import safe_state
+from ever.utils import timing
+from splinetracers import instrumentation
+
+STAGES = ("ray_gen", "color", "trace", "readback")
+
+def set_glo_vector(view, gaussians, camera_ind):
+    if gaussians.glo is not None:
+        view.glo_vector = torch.cat(
+            [gaussians.glo[camera_ind], torch.tensor([
+                    math.log(
+                    view.iso * view.exposure / 1000),
+                ], device=gaussians.glo.device)
+             ]
+        )
+
+def benchmark_set(views, gaussians, pipeline, warmup, repeats):
+    renderer = FastRenderer(views[0], gaussians, pipeline.enable_GLO)
+    # Built once, indexing it per view used to rebuild it for every view.
+    camera_inds = {view.uid: i for i, view in enumerate(views)}
+    for view in views:
+        set_glo_vector(view, gaussians, camera_inds[view.uid])
+
+    def render(view, timer):
+        with timer.stage("ray_gen"):
+            renderer.set_camera(view)
+            rays_o, rays_d = renderer.get_rays(view)
+        with timer.stage("color"):
+            color = renderer.get_color(view)
+        with timer.stage("trace"):
+            out = renderer.trace_features(rays_o, rays_d, color, gaussians.tmin, 1e7)
+        with timer.stage("readback"):
+            out['color'][:, :3].cpu()
+
+    timer = timing.run_benchmark(render, views, warmup, repeats, sync=torch.cuda.synchronize)
+    summary = timer.summary()
+    return dict(
+        num_views=len(views),
+        resolution=[views[0].image_width, views[0].image_height],
+        frame=summary.pop("frame"),
+        stages={name: summary[name] for name in STAGES if name in summary},
+    )
+
+def print_summary(name, result):
+    print(f"{name}: {result['num_views']} views at {result['resolution'][0]}x{result['resolution'][1]}")
+    rows = [("frame", result["frame"])] + list(result["stages"].items())
+    print(f"  {'stage':<10}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}  (ms)")
+    for stage, s in rows:
+        print(f"  {stage:<10}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}{s['p90_ms']:>10.3f}{s['p99_ms']:>10.3f}")
+    print(f"  {result['frame']['fps']:.1f} fps")
+
+def benchmark_sets(dataset : ModelParams, iteration : int, pipeline : PipelineParams, skip_train : bool, skip_test : bool, checkpoint, opt, warmup, repeats, output, chrome_trace=None):
+    with torch.no_grad():
+        gaussians = GaussianModel(dataset.sh_degree, dataset.use_neural_network, dataset.max_opacity)
+        scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False)
+        if checkpoint:
+            (model_params, first_iter) = torch.load(checkpoint)
+            gaussians.restore(model_params, opt)
+
+        results = dict(
+            model_path=dataset.model_path,
+            iteration=scene.loaded_iter,
+            warmup=warmup,
+            repeats=repeats,
+            environment=timing.environment(os.path.dirname(os.path.abspath(__file__))),
+            sets={},
+        )
+        sets = []
+        if not skip_train:
+            sets.append(("train", scene.getTrainCameras()))
+        if not skip_test:
+            sets.append(("test", scene.getTestCameras()))
+        recorder = instrumentation.enable() if chrome_trace is not None else None
+        for name, views in sets:
+            if len(views) == 0:
+                continue
+            results["sets"][name] = benchmark_set(views, gaussians, pipeline, warmup, repeats)
+            print_summary(name, results["sets"][name])
+        if recorder is not None:
+            instrumentation.disable()
+            results["instrumentation"] = recorder.to_dict()
+            recorder.write_chrome_trace(chrome_trace)
+
+        if output is not None:
+            timing.write_json(output, results)
+        return results
+
+if __name__ == "__main__":
+    # Set up command line argument parser
+    parser = ArgumentParser(description="Benchmark script parameters")
+    model = ModelParams(parser, sentinel=True)
+    op = OptimizationParams(parser)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--skip_train", action="store_true")
+    parser.add_argument("--skip_test", action="store_true")
+    parser.add_argument("--quiet", action="store_true")
+    parser.add_argument("--warmup", default=1, type=int, help="Untimed passes over the views")
+    parser.add_argument("--repeats", default=3, type=int, help="Timed passes over the views")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    parser.add_argument("--chrome_trace", default=None, help="Chrome trace JSON file for the renderer's stage timers and counters")
+    args = get_combined_args(parser)
+    print("Benchmarking " + args.model_path)
+
+    # Initialize system state (RNG)
+    safe_state(args.quiet)
+
+    benchmark_sets(model.extract(args), args.iteration, pipeline.extract(args), args.skip_train, args.skip_test, None, op.extract(args), args.warmup, args.repeats, args.output, args.chrome_trace)
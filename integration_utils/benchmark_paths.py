@@ -0,0 +1,117 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks camera path generation for path lengths of 100 to 100k frames.
+
+The keyframes are --n_keyframes synthetic cameras on a wobbly ring looking at
+the origin, recentered with transform_poses_pca like render_path.py does. For
+every --n_frames the script times
+
+  lookat_loop:  one viewmatrix call per frame, as the generators used to do,
+  lookat:       a single batched viewmatrix call,
+  ellipse:      generate_ellipse_path,
+  interpolated: generate_interpolated_path with n_interp_as_total,
+
+--warmup times untimed (the first calls compile stepfun's jax functions) and
+--repeats times timed. With --output the summaries are written to JSON.
+"""
+
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from ever.integration_utils.utils import camera_utils_zipnerf
+from ever.utils import camera_path
+from ever.utils import timing
+
+
+def ring_poses(n, seed=0):
+    """[n, 3, 4] OpenGL poses on a ring around the origin, looking at it."""
+    rng = np.random.default_rng(seed)
+    theta = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    positions = np.stack([4 * np.cos(theta), 3 * np.sin(theta), 0.3 * rng.normal(size=n)], axis=-1)
+    return camera_path.viewmatrix(positions, np.array([0.0, 0.0, 1.0]), positions)
+
+
+def lookat_inputs(n):
+    theta = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    positions = np.stack([np.cos(theta), np.sin(theta), 0.1 * np.sin(3 * theta)], axis=-1)
+    return positions, np.array([0.0, 0.0, 1.0])
+
+
+def lookat_loop(n):
+    positions, up = lookat_inputs(n)
+    return np.stack([camera_path.viewmatrix(p, up, p) for p in positions])
+
+
+def lookat(n):
+    positions, up = lookat_inputs(n)
+    return camera_path.viewmatrix(positions, up, positions)
+
+
+def benchmark_paths(n_frames, n_keyframes, warmup, repeats, skip_loop=False):
+    keyframes, _ = camera_utils_zipnerf.transform_poses_pca(ring_poses(n_keyframes))
+    stages = dict(
+        lookat_loop=lookat_loop,
+        lookat=lookat,
+        ellipse=lambda n: camera_utils_zipnerf.generate_ellipse_path(keyframes, n),
+        interpolated=lambda n: camera_utils_zipnerf.generate_interpolated_path(
+            keyframes, n, n_interp_as_total=True),
+    )
+    if skip_loop:
+        del stages["lookat_loop"]
+    results = {}
+    for n in n_frames:
+        results[n] = {}
+        for name, fn in stages.items():
+            for _ in range(warmup):
+                fn(n)
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn(n)
+                samples.append(time.perf_counter() - start)
+            results[n][name] = timing.summarize(samples)
+    return results
+
+
+def print_summary(results):
+    names = list(next(iter(results.values())))
+    print(f"{'frames':>8}" + "".join(f"{name:>14}" for name in names) + "  (mean ms)")
+    for n, stages in results.items():
+        print(f"{n:>8}" + "".join(f"{stages[name]['mean_ms']:>14.3f}" for name in names))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Camera path benchmark parameters")
+    parser.add_argument("--n_frames", nargs="+", type=int, default=[100, 1000, 10000, 100000])
+    parser.add_argument("--n_keyframes", default=30, type=int)
+    parser.add_argument("--warmup", default=1, type=int, help="Untimed calls per path length")
+    parser.add_argument("--repeats", default=3, type=int, help="Timed calls per path length")
+    parser.add_argument("--skip_loop", action="store_true", help="Skip the per frame lookat baseline")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    args = parser.parse_args()
+
+    results = benchmark_paths(args.n_frames, args.n_keyframes, args.warmup, args.repeats, args.skip_loop)
+    print_summary(results)
+    if args.output is not None:
+        timing.write_json(args.output, dict(
+            n_keyframes=args.n_keyframes,
+            warmup=args.warmup,
+            repeats=args.repeats,
+            environment=timing.environment(os.path.dirname(os.path.abspath(__file__))),
+            frames={str(n): stages for n, stages in results.items()},
+        ))
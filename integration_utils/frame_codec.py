@@ -0,0 +1,142 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Frame encodings for the render server.
+
+The client negotiates the encoding per request by adding to its JSON message
+
+  "encodings": encodings it can decode in order of preference, out of
+               "raw", "jpeg", "png", "webp" and "delta",
+  "quality":  0-100 for jpeg and webp, 0-9 compression for png,
+  "compressor": "zlib" | "lz4" for delta (default zlib).
+
+The server uses the first one it supports (cv2 and lz4 are optional) and
+falls back to raw. The reply is a 4 byte little endian length, followed by
+one byte with the ENCODING_IDS entry of the chosen encoding and the payload.
+Without "encodings" the frame is sent as bare HxWx3 uint8 bytes like
+network_gui does, so existing clients keep working.
+
+delta payloads start with a header byte (1 for a key frame, 0 for a delta),
+followed by the compressed frame, or the compressed XOR with the previous
+frame sent on the same connection. Static parts of the image XOR to zeros
+and compress to almost nothing. A key frame is sent for the first frame and
+whenever the frame size changes.
+"""
+
+import struct
+import zlib
+from typing import *
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+IMAGE_FORMATS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}
+ENCODING_IDS = dict(raw=0, jpeg=1, png=2, webp=3, delta=4)
+KEY_FRAME = 1
+DELTA_FRAME = 0
+
+
+def compressors() -> Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]]:
+    """Available (compress, decompress) pairs for delta frames."""
+    available = dict(zlib=(lambda b: zlib.compress(b, 1), zlib.decompress))
+    if lz4 is not None:
+        available["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+    return available
+
+
+def available_encodings() -> List[str]:
+    encodings = ["raw", "delta"]
+    if cv2 is not None:
+        encodings += list(IMAGE_FORMATS)
+    return encodings
+
+
+def encode_image(image: np.ndarray, fmt: str, quality: Optional[int] = None) -> bytes:
+    """Encodes an RGB image with cv2 as jpeg, png or webp."""
+    params = []
+    if quality is not None:
+        flag = dict(jpeg=cv2.IMWRITE_JPEG_QUALITY, png=cv2.IMWRITE_PNG_COMPRESSION,
+                    webp=cv2.IMWRITE_WEBP_QUALITY)[fmt]
+        params = [flag, int(quality)]
+    ok, buf = cv2.imencode(IMAGE_FORMATS[fmt], np.ascontiguousarray(image[..., ::-1]), params)
+    if not ok:
+        raise RuntimeError(f"cv2 could not encode a {fmt} frame")
+    return buf.tobytes()
+
+
+class FrameEncoder:
+    """Encodes the frames of one connection, following each request's encoding."""
+
+    def __init__(self):
+        self.previous = None
+        self.compressors = compressors()
+        self.encodings = available_encodings()
+
+    def encoding(self, message: Dict[str, Any]) -> str:
+        """Returns the first requested encoding this server supports."""
+        for encoding in message.get("encodings", []):
+            if encoding == "delta" and message.get("compressor", "zlib") not in self.compressors:
+                continue
+            if encoding in self.encodings:
+                return encoding
+        return "raw"
+
+    def encode_delta(self, image: np.ndarray, compressor: str) -> bytes:
+        compress, _ = self.compressors[compressor]
+        if self.previous is None or self.previous.shape != image.shape:
+            header, data = KEY_FRAME, image
+        else:
+            header, data = DELTA_FRAME, np.bitwise_xor(image, self.previous)
+        self.previous = image
+        return bytes([header]) + compress(data.tobytes())
+
+    def __call__(self, frame) -> bytes:
+        if frame.image is None:
+            return b""
+        image = np.ascontiguousarray(frame.image, dtype=np.uint8)
+        message = frame.request.message
+        if "encodings" not in message:
+            return image.tobytes()
+        encoding = self.encoding(message)
+        if encoding == "raw":
+            payload = image.tobytes()
+        elif encoding == "delta":
+            payload = self.encode_delta(image, message.get("compressor", "zlib"))
+        else:
+            payload = encode_image(image, encoding, message.get("quality"))
+        return struct.pack("<IB", len(payload) + 1, ENCODING_IDS[encoding]) + payload
+
+
+class DeltaDecoder:
+    """Client side decoder for delta frames."""
+
+    def __init__(self, compressor: str = "zlib"):
+        self.decompress = compressors()[compressor][1]
+        self.previous = None
+
+    def __call__(self, payload: bytes, height: int, width: int) -> np.ndarray:
+        data = np.frombuffer(self.decompress(payload[1:]), dtype=np.uint8).reshape(height, width, 3)
+        if payload[0] == DELTA_FRAME:
+            data = np.bitwise_xor(data, self.previous)
+        self.previous = data
+        return data
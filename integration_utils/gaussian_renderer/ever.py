@@ -12,11 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import torch
 import math
 
 from scene.gaussian_model import GaussianModel
 from ever.splinetracers.fast_ellipsoid_splinetracer import trace_rays
+from ever.splinetracers import iter_budget
+# Imported the way the tracer modules import it, so both share one recorder.
+from splinetracers import instrumentation
 MAX_ITERS = 400
 from ever.eval_sh import eval_sh as eval_sh2
 from third_party.sh_util import eval_sh, RGB2SH, SH2RGB
@@ -25,6 +29,9 @@ import numpy as np
 from icecream import ic
 from scene.dataset_readers import ProjectionType
 from ever.integration_utils.utils import camera_utils_zipnerf
+from ever.utils import ray_cache
+from ever.utils import distortion
+from ever.utils import ray_batch
 
 def get_ray_directions(H, W, focal, center=None, random=True):
     """
@@ -74,43 +81,86 @@ def get_rays(directions, c2w):
 
     return rays_o, rays_d
 
-def camera2rays_full(view, **kwargs):
-    w = view.image_width  # // 4
-    h = view.image_height  # // 4
-    device = torch.device('cuda')
-
+def pixel_directions(w, h, fx, fy, model, distortion_params, device):
+    """Normalized camera space directions of all pixels through pixels_to_rays, (h*w, 3)."""
     x, y = torch.meshgrid(torch.arange(w, device=device), torch.arange(h, device=device), indexing='xy')
 
-    fx = 0.5 * w / np.tan(0.5 * view.FoVx)  # original focal length
-    fy = 0.5 * h / np.tan(0.5 * view.FoVy)  # original focal length
     pixtocams = torch.eye(3, device=device)
     pixtocams[0, 0] = 1/fx
     pixtocams[1, 1] = 1/fy
     pixtocams[0, 2] = -w/2/fx
     pixtocams[1, 2] = -h/2/fy
 
-    T = torch.linalg.inv(view.world_view_transform.T).to(device)
-    origins, _, directions, _, _ = camera_utils_zipnerf.pixels_to_rays(
+    # The undistortion is solved once per camera and kept on disk.
+    undistortion_map = None if distortion_params is None else distortion.UndistortionMap.cached(
+        w, h, fx, fy, w/2, h/2, distortion_params)
+    _, _, directions, _, _ = camera_utils_zipnerf.pixels_to_rays(
         x.reshape(-1), y.reshape(-1),
         pixtocams.reshape(1, 3, 3),
-        T[:3].reshape(1, 3, 4),
-        camtype=view.model,
-        distortion_params=view.distortion_params,
-        xnp=torch
+        torch.eye(4, device=device)[:3].reshape(1, 3, 4),
+        camtype=model,
+        distortion_params=distortion_params,
+        xnp=torch,
+        undistortion_map=undistortion_map,
     )
-    origins = origins.float().cuda().contiguous()
-    directions = directions.float().cuda().contiguous()
-    return origins, directions
+    return directions.float().contiguous()
 
-def camera2rays(view, **kwargs):
+def camera_directions(view, full=None, device="cuda"):
+    """Normalized camera space ray directions of view, (h*w, 3).
+
+    Perspective cameras use the pinhole grid of get_ray_directions, other
+    models (or full=True) go through pixels_to_rays with distortion. The
+    result is kept in ray_cache.direction_cache.
+    """
     w = view.image_width
     h = view.image_height
-
     fx = 0.5 * w / math.tan(0.5 * view.FoVx)  # original focal length
     fy = 0.5 * h / math.tan(0.5 * view.FoVy)  # original focal length
+    if full is None:
+        full = view.model != ProjectionType.PERSPECTIVE
+    distortion_params = view.distortion_params if full else None
+    key = ray_cache.camera_key(
+        w, h, fx, fy, w / 2, h / 2, view.model if full else ProjectionType.PERSPECTIVE,
+        distortion_params, device)
 
-    directions = get_ray_directions(h, w, [fx, fy], **kwargs).cuda()  # (h, w, 3)
-    directions = (directions / torch.norm(directions, dim=-1, keepdim=True))
+    def build():
+        if full:
+            return pixel_directions(w, h, fx, fy, view.model, distortion_params, device)
+        directions = get_ray_directions(h, w, [fx, fy], random=False).to(device)  # (h, w, 3)
+        directions = directions / torch.norm(directions, dim=-1, keepdim=True)
+        return directions.reshape(-1, 3).contiguous()
+
+    return ray_cache.direction_cache.get(key, build)
+
+def camera2rays_full(view, **kwargs):
+    directions = camera_directions(view, full=True)
+    T = torch.linalg.inv(view.world_view_transform.T.cuda())
+    origins, directions = get_rays(directions, T)
+    return origins.contiguous(), directions.contiguous()
+
+def camera2rays_batch(views, pixel_inds=None, device="cuda"):
+    """Rays of several views in one contiguous buffer with per view offsets.
+
+    pixel_inds optionally selects flat pixel indices per view. Views with the
+    same intrinsics share one cached direction grid, see ray_batch.py.
+    """
+    grids = [camera_directions(view, device=device) for view in views]
+    c2ws = ray_batch.c2ws_from_world_views(
+        torch.stack([view.world_view_transform for view in views]).to(device).float())
+    return ray_batch.build_ray_batch(grids, c2ws, pixel_inds)
+
+def camera2rays(view, random=True, **kwargs):
+    w = view.image_width
+    h = view.image_height
+
+    if random:
+        fx = 0.5 * w / math.tan(0.5 * view.FoVx)  # original focal length
+        fy = 0.5 * h / math.tan(0.5 * view.FoVy)  # original focal length
+
+        directions = get_ray_directions(h, w, [fx, fy], random=True, **kwargs).cuda()  # (h, w, 3)
+        directions = (directions / torch.norm(directions, dim=-1, keepdim=True))
+    else:
+        directions = camera_directions(view, full=False)
 
     T = torch.linalg.inv(view.world_view_transform.T.cuda())
     rays_o, rays_d = get_rays(
@@ -130,12 +180,20 @@ def splinerender(
     random=False,
     tmin=None,
     tmax=1e7,
+    memory_budget=None,
+    max_iters_policy=None,
+    bounds=None,
 ):
+    """Renders view. max_iters_policy is an optional iter_budget.AdaptiveMaxIters
+    that replaces the fixed MAX_ITERS, re-tracing rays that overflow it. With
+    bounds (a scene_bounds.SceneBounds) tmin and tmax are clipped per ray to
+    it and rays that miss it are not traced."""
     device = pc.get_xyz.device
-    if view.model == ProjectionType.PERSPECTIVE:
-        rays_o, rays_d = camera2rays(view, random=random)
-    else:
-        rays_o, rays_d = camera2rays_full(view, random=False)
+    with instrumentation.scope("splinerender/rays"):
+        if view.model == ProjectionType.PERSPECTIVE:
+            rays_o, rays_d = camera2rays(view, random=random)
+        else:
+            rays_o, rays_d = camera2rays_full(view, random=False)
 
     means2D = torch.zeros_like(pc.get_xyz[..., :2])
     means2D.requires_grad = True
@@ -162,22 +220,23 @@ def splinerender(
     full_wct = torch.eye(4, device="cuda")
     full_wct[:, :3] = wct @ K.T
 
-    shs = pc.get_features
-    if pipe.enable_GLO:
-        if view.glo_vector is not None:
-            glo_vector = view.glo_vector
-        else:
-            glo_vector = torch.zeros((1, 64), device='cuda')
-        shs = pc.glo_network(
-            glo_vector.reshape(1, -1), shs.reshape(shs.shape[0], -1)
-        ).reshape(shs.shape)
-
-    cam_pos = view.camera_center.to(device)
-    T = torch.linalg.inv(wct.T)
-    v = T[:3, 2]
-    net_color = eval_sh2(pc.get_xyz, shs, cam_pos, pc.active_sh_degree)
-    net_color = torch.nn.functional.softplus(net_color, beta=10)
-    features = RGB2SH(net_color).reshape(-1, 1, 3)
+    with instrumentation.scope("splinerender/color"):
+        shs = pc.get_features
+        if pipe.enable_GLO:
+            if view.glo_vector is not None:
+                glo_vector = view.glo_vector
+            else:
+                glo_vector = torch.zeros((1, 64), device='cuda')
+            shs = pc.glo_network(
+                glo_vector.reshape(1, -1), shs.reshape(shs.shape[0], -1)
+            ).reshape(shs.shape)
+
+        cam_pos = view.camera_center.to(device)
+        T = torch.linalg.inv(wct.T)
+        v = T[:3, 2]
+        net_color = eval_sh2(pc.get_xyz, shs, cam_pos, pc.active_sh_degree)
+        net_color = torch.nn.functional.softplus(net_color, beta=10)
+        features = RGB2SH(net_color).reshape(-1, 1, 3)
 
     per_point_2d_filter_scale = torch.zeros(pc._xyz.shape[0], device=pc._xyz.device)
 
@@ -186,24 +245,38 @@ def splinerender(
     else:
         scales, density = pc.get_scale_and_opacity_for_rendering(per_point_2d_filter_scale, scaling_modifier)
     tmin = pc.tmin if tmin is None else tmin
-    out, extras = trace_rays(
-        pc.get_xyz,
-        scales,
-        pc.get_rotation,
-        density,
-        features,
-        rays_o,
-        rays_d,
-        tmin,
-        tmax,
-        100,
-        means2D,
-        full_wct.reshape(1, 4, 4),
-        max_iters=MAX_ITERS,
-        return_extras=True,
-    )
+    if bounds is not None:
+        tmin, tmax = bounds.clip(rays_o, rays_d, tmin, tmax)
+    if max_iters_policy is None:
+        trace_kwargs = dict(max_iters=MAX_ITERS)
+    else:
+        trace_kwargs = dict(
+            max_iters=max_iters_policy.max_iters,
+            retrace_max_iters=max_iters_policy.retrace_max_iters)
+    trace = trace_rays if max_iters_policy is None else functools.partial(
+        iter_budget.trace_rays_adaptive, trace_rays)
+    with instrumentation.scope("splinerender/trace"):
+        out, extras = trace(
+            pc.get_xyz,
+            scales,
+            pc.get_rotation,
+            density,
+            features,
+            rays_o,
+            rays_d,
+            tmin,
+            tmax,
+            100,
+            means2D,
+            full_wct.reshape(1, 4, 4),
+            **trace_kwargs,
+            return_extras=True,
+            memory_budget=memory_budget,
+        )
 
-    torch.cuda.synchronize()
+        torch.cuda.synchronize()
+    if max_iters_policy is not None:
+        max_iters_policy.update(extras['iters'])
     radii = torch.ones_like(means2D[..., 0])
 
     rendered_image = out[:, :3].T.reshape(3, view.image_height, view.image_width)
@@ -219,6 +292,8 @@ def splinerender(
         "touch_count": extras['touch_count'],
         "radii": radii, # match gaussian radius
         "iters": extras["iters"].reshape(view.image_height, view.image_width),
+        "overflow": extras["overflow"].reshape(view.image_height, view.image_width),
+        "num_overflow": extras["num_overflow"],
         "opacity": out[:, 3].reshape(-1, 1),
         "distortion_loss": out[:, 4].reshape(-1, 1),
     }
@@ -20,7 +20,7 @@ import os
 import math
 from tqdm import tqdm
 from os import makedirs
-from gaussian_renderer.ever import get_ray_directions, get_rays, camera2rays_full
+from gaussian_renderer.ever import get_rays, camera_directions
 import torchvision
 from utils.general_utils import safe_state
 from argparse import ArgumentParser
@@ -29,7 +29,13 @@ from gaussian_renderer import GaussianModel
 import time
 
 from third_party.sh_util import eval_sh, RGB2SH, SH2RGB
-from ever.splinetracers.fast_ellipsoid_splinetracer import sp
+from ever.splinetracers.fast_ellipsoid_splinetracer import sp, MIN_TRANSMITTANCE
+from ever.splinetracers import iter_budget
+from ever.splinetracers import multi_view
+from ever.splinetracers import ray_bounds
+# Imported the way the tracer modules import it, so both share one recorder.
+from splinetracers import instrumentation
+from ever.splinetracers.color_cache import ViewColorCache
 from ever.eval_sh import eval_sh as eval_sh2
 from utils.graphics_utils import in_screen_from_ndc, project_points, visible_depth_from_camspace, fov2focal
 from scene.dataset_readers import ProjectionType
@@ -38,17 +44,19 @@ from scene.dataset_readers import ProjectionType
 MAX_ITERS = 200
 
 class FastRenderer:
-    def __init__(self, view, pc, enable_GLO):
+    def __init__(self, view, pc, enable_GLO, adaptive_max_iters=False,
+                 color_angle_tolerance=0.0, color_position_tolerance=0.0):
         self.device = pc.get_xyz.device
         self.enable_GLO = enable_GLO
-        w = view.image_width
-        h = view.image_height
-
-        fx = 0.5 * w / math.tan(0.5 * view.FoVx)  # original focal length
-        fy = 0.5 * h / math.tan(0.5 * view.FoVy)  # original focal length
-
-        directions = get_ray_directions(h, w, [fx, fy], random=False).cuda()  # (h, w, 3)
-        self.directions = (directions / torch.norm(directions, dim=-1, keepdim=True))
+        # With adaptive_max_iters the cap follows the previous frame and
+        # overflowed rays are re-traced, see iter_budget.py.
+        self.max_iters_policy = iter_budget.AdaptiveMaxIters() if adaptive_max_iters else None
+        self.num_overflow = 0
+        # Colors are only evaluated again for primitives whose view direction
+        # turned by more than color_angle_tolerance (radians), and not at all
+        # while the camera stays within color_position_tolerance.
+        self.color_cache = ViewColorCache(color_angle_tolerance, color_position_tolerance)
+        self.set_camera(view)
         self.otx = sp.OptixContext(torch.device("cuda:0"))
         self.prims = sp.Primitives(self.device)
         self.mean = pc.get_xyz.contiguous()
@@ -66,23 +74,24 @@ class FastRenderer:
         self.forward = sp.Forward(self.otx, self.device, self.prims, False)
 
     def set_camera(self, view):
-        if view.model != ProjectionType.PERSPECTIVE:
-            rays_o, rays_d = camera2rays_full(view, random=False)
-            self.directions = rays_d
-        else:
-
-            w = view.image_width
-            h = view.image_height
-
-            fx = 0.5 * w / math.tan(0.5 * view.FoVx)  # original focal length
-            fy = 0.5 * h / math.tan(0.5 * view.FoVy)  # original focal length
-
-            directions = get_ray_directions(h, w, [fx, fy], random=False).cuda()  # (h, w, 3)
-            self.directions = (directions / torch.norm(directions, dim=-1, keepdim=True))
+        # Camera space directions, cached across cameras in ray_cache.direction_cache.
+        with instrumentation.scope("fast_renderer/set_camera"):
+            self.directions = camera_directions(view)
 
 
     def get_color(self, view):
+        cam_pos = view.camera_center.to(self.device)
+        with instrumentation.scope("fast_renderer/color"):
+            return self.color_cache.get(
+                self.mean, cam_pos, lambda inds: self.compute_color(view, inds),
+                (self.pc.active_sh_degree, self.glo_key(view)))
+
+    def compute_color(self, view, inds=None):
         shs = self.pc.get_features
+        means = self.pc.get_xyz
+        if inds is not None:
+            shs = shs[inds]
+            means = means[inds]
         if self.enable_GLO:
             if view.glo_vector is not None:
                 glo_vector = view.glo_vector
@@ -93,11 +102,23 @@ class FastRenderer:
             ).reshape(shs.shape)
 
         cam_pos = view.camera_center.to(self.device)
-        net_color = eval_sh2(self.pc.get_xyz, shs, cam_pos, self.pc.active_sh_degree)
+        net_color = eval_sh2(means, shs, cam_pos, self.pc.active_sh_degree)
         net_color = torch.nn.functional.softplus(net_color, beta=10)
         features = RGB2SH(net_color).reshape(-1, 1, 3)
         return features.contiguous()
 
+    def glo_key(self, view):
+        if self.enable_GLO and view.glo_vector is not None:
+            return tuple(view.glo_vector.reshape(-1).tolist())
+        return None
+
+    def feature_key(self, view):
+        """Views with equal keys get the same colors from get_color."""
+        glo = self.glo_key(view)
+        if self.pc.active_sh_degree == 0:
+            return (glo,)
+        return (tuple(view.camera_center.reshape(-1).tolist()), glo)
+
     def get_rays(self, view):
         T = torch.linalg.inv(view.world_view_transform.T.cuda())
         rays_o, rays_d = get_rays(
@@ -107,13 +128,53 @@ class FastRenderer:
         rays_o = (rays_o).contiguous()
         return rays_o, rays_d
 
-    def trace_rays(self, rayo, rayd, view, tmin, tmax):
+    def trace_rays(self, rayo, rayd, view, tmin, tmax, min_transmittance=MIN_TRANSMITTANCE):
         color = self.get_color(view)
+        return self.trace_features(rayo, rayd, color, tmin, tmax, min_transmittance)
 
+    def launch(self, rayo, rayd, tmin, tmax, max_iters, min_transmittance):
+        """One forward launch, recorded like SplineTracer.forward."""
+        with instrumentation.scope("forward/trace"):
+            out = self.forward.trace_rays(self.gas, rayo, rayd, tmin, tmax, max_iters, 1000, min_transmittance)
+        instrumentation.record_trace(rayo.shape[0], self.mean.shape[0], out['saved'])
+        return out
+
+    def trace_features(self, rayo, rayd, color, tmin, tmax, min_transmittance=MIN_TRANSMITTANCE):
+        """Traces rays with features from get_color.
+
+        tmin and tmax may be [R] tensors (e.g. from SceneBounds.clip); rays
+        with tmax <= 0 are skipped and come back transparent, see ray_bounds.py.
+        """
+        if ray_bounds.is_per_ray(tmin, tmax):
+            rays = ray_bounds.bound_rays(rayo, rayd, tmin, tmax)
+            out = None
+            if rays.num_traced > 0:
+                out = self.trace_features(
+                    rays.rayo, rays.rayd, color, rays.tmin, rays.max_tmax, min_transmittance)
+            out = ray_bounds.scatter_forward(out, rays)
+            self.num_overflow = int(out['overflow'].sum())
+            return out
         self.prims.set_features(color)
         self.forward.update_model(self.prims)
 
-        out = self.forward.trace_rays(self.gas, rayo, rayd, tmin, tmax, MAX_ITERS, 1000)
+        max_iters = MAX_ITERS if self.max_iters_policy is None else self.max_iters_policy.max_iters
+        out = self.launch(rayo, rayd, tmin, tmax, max_iters, min_transmittance)
+        overflow = iter_budget.overflow_mask(
+            out['saved'].iters, out['saved'].states, max_iters, min_transmittance)
+        if self.max_iters_policy is not None:
+            inds = overflow.nonzero()[:, 0]
+            if inds.numel() > 0:
+                retrace = self.launch(
+                    rayo[inds].contiguous(), rayd[inds].contiguous(), tmin, tmax,
+                    self.max_iters_policy.retrace_max_iters, min_transmittance)
+                out['color'][inds] = retrace['color']
+                out['saved'].iters[inds] = retrace['saved'].iters
+                overflow[inds] = iter_budget.overflow_mask(
+                    retrace['saved'].iters, retrace['saved'].states,
+                    self.max_iters_policy.retrace_max_iters, min_transmittance)
+            self.max_iters_policy.update(out['saved'].iters)
+        out['overflow'] = overflow
+        self.num_overflow = int(overflow.sum())
         return out
 
     def render(self,
@@ -121,11 +182,43 @@ class FastRenderer:
                pc,
                bg_color: torch.Tensor,
                tmin=None,
-               scaling_modifier=1.0):
+               scaling_modifier=1.0,
+               min_transmittance=MIN_TRANSMITTANCE,
+               bounds=None):
+        """Renders view; with bounds (a SceneBounds) only the rays that hit it are traced."""
         rays_o, rays_d = self.get_rays(view)
-        out = self.trace_rays(rays_o, rays_d, view, self.pc.tmin if tmin is None else tmin, 1e7)
+        tmin, tmax = self.pc.tmin if tmin is None else tmin, 1e7
+        if bounds is not None:
+            tmin, tmax = bounds.clip(rays_o, rays_d, tmin, tmax)
+        out = self.trace_rays(rays_o, rays_d, view, tmin, tmax, min_transmittance)
         iters = out['saved'].iters
         rendered_image = out['color'][:, :3].T.reshape(3, view.image_height, view.image_width)
         return rendered_image
 
-
+    def render_many(self,
+                    views,
+                    tmin=None,
+                    min_transmittance=MIN_TRANSMITTANCE,
+                    memory_budget=None):
+        """Renders views sharing the current camera (see set_camera) into [V, 3, H, W].
+
+        Views with the same colors are traced together in one launch, see
+        multi_view.render_many.
+        """
+        h, w = views[0].image_height, views[0].image_width
+        assert all((v.image_height, v.image_width) == (h, w) for v in views)
+        c2ws = torch.stack([torch.linalg.inv(v.world_view_transform.T.cuda()) for v in views])
+        policy = self.max_iters_policy
+        trace = multi_view.ForwardTrace(
+            self.prims, self.gas, self.forward,
+            self.pc.tmin if tmin is None else tmin, 1e7,
+            MAX_ITERS if policy is None else policy.max_iters,
+            1000, min_transmittance,
+            None if policy is None else policy.retrace_max_iters)
+        color = multi_view.render_many(
+            trace, self.directions, c2ws,
+            [self.feature_key(v) for v in views],
+            lambda i: self.get_color(views[i]),
+            memory_budget)
+        self.num_overflow = trace.num_overflow
+        return color[..., :3].permute(0, 2, 1).reshape(len(views), 3, h, w)
@@ -27,14 +27,17 @@ from arguments import ModelParams, PipelineParams, OptimizationParams
 from icecream import ic
 import random
 import math
-import cv2
 import json
 import traceback
 from utils.system_utils import searchForMaxIteration
 import time
 from gaussian_renderer.fast_renderer import FastRenderer
 from gaussian_renderer.ever import splinerender
-from gaussian_renderer import render, network_gui
+from gaussian_renderer import render
+from scene.cameras import MiniCam
+from ever.integration_utils.render_server import RenderServer
+from ever.utils import ray_cache
+from ever.integration_utils.adaptive_resolution import ResolutionController
 
 renderFunc = splinerender
 from scene.dataset_readers import ProjectionType
@@ -52,8 +55,6 @@ def convert_to_float(frac_str):
         frac = float(num) / float(denom)
         return whole - frac if whole < 0 else whole + frac
 
-PREVIEW_RES_FACTOR = 1
-
 try:
     from torch.utils.tensorboard import SummaryWriter
     TENSORBOARD_FOUND = True
@@ -70,87 +71,86 @@ def set_glo_vector(viewpoint_cam, gaussians, camera_inds):
          ]
     )
 
-def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoint_iterations, checkpoint, debug_from):
-    first_iter = 0
+def load_gaussians(dataset, opt, checkpoint):
     gaussians = GaussianModel(dataset.sh_degree, dataset.use_neural_network, dataset.max_opacity)
     if checkpoint:
         (model_params, first_iter) = torch.load(checkpoint)
         gaussians.restore(model_params, opt)
     else:
-        load_iteration = -1
-        if load_iteration == -1:
-            loaded_iter = searchForMaxIteration(os.path.join(dataset.model_path, "point_cloud"))
-        else:
-            loaded_iter = load_iteration
+        loaded_iter = searchForMaxIteration(os.path.join(dataset.model_path, "point_cloud"))
         print("Loading trained model at iteration {}".format(loaded_iter))
         gaussians.load_ply(os.path.join(dataset.model_path,
                                                        "point_cloud",
                                                        "iteration_" + str(loaded_iter),
                                                        "point_cloud.ply"))
-
-    if pipe.enable_GLO:
-        metadata_path = os.path.join(dataset.source_path, "metadata.json")
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
-
-        first_metadata = metadata[list(metadata.keys())[0]]
-
-    bg_color = [1, 1, 1] if dataset.white_background else [0, 0, 0]
-    background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
-
-    iter_start = torch.cuda.Event(enable_timing = True)
-    iter_end = torch.cuda.Event(enable_timing = True)
-
-
     gaussians.training_setup(opt)
     torch.cuda.empty_cache()
-    st = time.time()
-
-
-    renderer = None
-
-    while True:
-        if network_gui.conn == None:
-            network_gui.try_connect()
-        while network_gui.conn != None:
-            try:
-                net_image_bytes = None
-                custom_cam, do_training, _, _, keep_alive, scaling_modifer = network_gui.receive()
-                if custom_cam != None:
-                    if pipe.enable_GLO:
-                        custom_cam.glo_vector = torch.cat(
-                            [gaussians.glo[0], torch.tensor([
-                                    math.log(
-                                    float(first_metadata['iso']) * convert_to_float(first_metadata['exposure']) / 1000),
-                                ], device=gaussians.glo.device)
-                             ]
-                        )
-                    # custom_cam.model = viewpoint_cam.model
-                    # custom_cam.distortion_params = viewpoint_cam.distortion_params
-                    # custom_cam.model=ProjectionType.FISHEYE
-                    custom_cam.model=ProjectionType.PERSPECTIVE
-                    image_width = custom_cam.image_width
-                    image_height = custom_cam.image_height
-                    custom_cam.image_width = image_width // PREVIEW_RES_FACTOR
-                    custom_cam.image_height = image_height // PREVIEW_RES_FACTOR
-
-                    if renderer is None:
-                        renderer = FastRenderer(custom_cam, gaussians, pipe.enable_GLO)
-
-                    renderer.set_camera(custom_cam)
-
-                    st = time.time()
-                    net_image = renderer.render(custom_cam, pipe, background)
-
-                    net_image = (torch.clamp(net_image, min=0, max=1.0) * 255).byte().permute(1, 2, 0).contiguous().cpu().numpy()
-                    net_image = cv2.resize(net_image, (image_width, image_height))
-                    net_image_bytes = memoryview(net_image)
-                network_gui.send(net_image_bytes, dataset.source_path)
-                torch.cuda.empty_cache()
-            except Exception as e:
-                print(traceback.format_exc())
-                network_gui.conn = None
-
+    return gaussians
+
+def camera_from_message(message):
+    """Parses a network_gui request into a MiniCam, like network_gui.receive."""
+    width = message["resolution_x"]
+    height = message["resolution_y"]
+    if width == 0 or height == 0:
+        return None
+    world_view_transform = torch.reshape(torch.tensor(message["view_matrix"]), (4, 4)).cuda()
+    world_view_transform[:,1] = -world_view_transform[:,1]
+    world_view_transform[:,2] = -world_view_transform[:,2]
+    full_proj_transform = torch.reshape(torch.tensor(message["view_projection_matrix"]), (4, 4)).cuda()
+    full_proj_transform[:,1] = -full_proj_transform[:,1]
+    return MiniCam(width, height, message["fov_y"], message["fov_x"], message["z_near"], message["z_far"],
+                   world_view_transform, full_proj_transform)
+
+class HostRenderer:
+    """Renders network_gui cameras with FastRenderer for render_server.RenderServer."""
+
+    def __init__(self, dataset, pipe, gaussians, resolution=None):
+        self.pipe = pipe
+        self.resolution = ResolutionController() if resolution is None else resolution
+        self.gaussians = gaussians
+        self.renderer = None
+        bg_color = [1, 1, 1] if dataset.white_background else [0, 0, 0]
+        self.background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
+        self.glo_vector = None
+        if pipe.enable_GLO:
+            metadata_path = os.path.join(dataset.source_path, "metadata.json")
+            with open(metadata_path, "r") as f:
+                metadata = json.load(f)
+            first_metadata = metadata[list(metadata.keys())[0]]
+            self.glo_vector = torch.cat(
+                [gaussians.glo[0], torch.tensor([
+                        math.log(
+                        float(first_metadata['iso']) * convert_to_float(first_metadata['exposure']) / 1000),
+                    ], device=gaussians.glo.device)
+                 ]
+            )
+
+    def __call__(self, custom_cam):
+        if self.pipe.enable_GLO:
+            custom_cam.glo_vector = self.glo_vector
+        # custom_cam.model = viewpoint_cam.model
+        # custom_cam.distortion_params = viewpoint_cam.distortion_params
+        # custom_cam.model=ProjectionType.FISHEYE
+        custom_cam.model=ProjectionType.PERSPECTIVE
+        image_width = custom_cam.image_width
+        image_height = custom_cam.image_height
+        st = time.perf_counter()
+        scale = self.resolution.begin(custom_cam.world_view_transform.cpu().numpy())
+        custom_cam.image_width, custom_cam.image_height = ResolutionController.scaled_size(
+            image_width, image_height, scale)
+
+        with torch.no_grad():
+            if self.renderer is None:
+                self.renderer = FastRenderer(custom_cam, self.gaussians, self.pipe.enable_GLO)
+            self.renderer.set_camera(custom_cam)
+            net_image = self.renderer.render(custom_cam, self.pipe, self.background)
+            if net_image.shape[1:] != (image_height, image_width):
+                # Upscale on the GPU before the copy instead of cv2.resize on the host.
+                net_image = torch.nn.functional.interpolate(
+                    net_image[None], size=(image_height, image_width), mode='bilinear', align_corners=False)[0]
+            net_image = (torch.clamp(net_image, min=0, max=1.0) * 255).byte().permute(1, 2, 0).contiguous().cpu().numpy()
+        self.resolution.end(time.perf_counter() - st)
+        return net_image
 
 if __name__ == "__main__":
     # Set up command line argument parser
@@ -160,6 +160,16 @@ if __name__ == "__main__":
     pp = PipelineParams(parser)
     parser.add_argument('--ip', type=str, default="127.0.0.1")
     parser.add_argument('--port', type=int, default=6009)
+    parser.add_argument('--target_fps', type=float, default=30.0,
+                        help="Frame rate the preview resolution is adapted to while the camera moves")
+    parser.add_argument('--min_res_scale', type=float, default=0.125,
+                        help="Lowest preview resolution, as a fraction of the requested size")
+    parser.add_argument('--still_frames', type=int, default=3,
+                        help="Frames without camera motion after which full resolution is rendered")
+    parser.add_argument('--encode_threads', type=int, default=2,
+                        help="Threads encoding frames for clients that negotiate compression")
+    parser.add_argument('--ray_cache_mb', type=int, default=ray_cache.DEFAULT_MAX_BYTES // 2**20,
+                        help="Memory for cached camera ray directions, shared by all renderers")
     parser.add_argument('--debug_from', type=int, default=-1)
     parser.add_argument('--detect_anomaly', action='store_true', default=False)
     parser.add_argument("--test_iterations", nargs="+", type=int, default=[7_000, 30_000])
@@ -172,9 +182,19 @@ if __name__ == "__main__":
     
     # Initialize system state (RNG)
     safe_state(args.quiet)
+    ray_cache.direction_cache.resize(args.ray_cache_mb * 2**20)
 
-    # Start GUI server, configure and run training
-    network_gui.init(args.ip, args.port)
+    # Load the model and serve renders to the GUI
     torch.autograd.set_detect_anomaly(args.detect_anomaly)
-    training(lp.extract(args), op.extract(args), pp.extract(args), args.save_iterations, args.save_iterations, args.checkpoint_iterations, args.start_checkpoint, args.debug_from)
+    dataset, opt, pipe = lp.extract(args), op.extract(args), pp.extract(args)
+    gaussians = load_gaussians(dataset, opt, args.start_checkpoint)
+    server = RenderServer(
+        HostRenderer(dataset, pipe, gaussians, ResolutionController(
+            target_fps=args.target_fps, min_scale=args.min_res_scale, still_frames=args.still_frames)),
+        parse_request=camera_from_message,
+        verify=dataset.source_path,
+        host=args.ip,
+        port=args.port,
+        num_encode_threads=args.encode_threads)
+    server.run()
 
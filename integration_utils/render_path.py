@@ -0,0 +1,143 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Renders a camera path of a trained scene to images and/or a video.
+
+The path is one of
+
+  ellipse:      generate_ellipse_path around the training cameras,
+  interpolated: generate_interpolated_path through every --keyframe_stride-th
+                training camera (sorted by image name),
+  sibr:         the poses of a SIBR .path file (--sibr_path).
+
+All frames are rendered with one FastRenderer at the resolution and field of
+view of the first training camera (scaled by --resolution_scale). Encoding
+and writing happens on a thread pool (utils/frame_writer.py), so the GPU
+keeps rendering while frames are written; at most --max_pending frames are
+held in memory.
+"""
+
+import math
+import os
+
+import numpy as np
+import torch
+from argparse import ArgumentParser
+from tqdm import tqdm
+
+from arguments import ModelParams, PipelineParams, get_combined_args
+from gaussian_renderer import GaussianModel
+from gaussian_renderer.fast_renderer import FastRenderer
+from scene import Scene
+from scene.cameras import MiniCam
+from scene.dataset_readers import ProjectionType
+from utils.general_utils import safe_state
+from ever.integration_utils.utils import camera_utils_zipnerf
+from ever.utils import camera_path
+from ever.utils import sibr_path as sibr
+from ever.utils.frame_writer import FrameWriter, WRITERS
+
+PATHS = ("ellipse", "interpolated", "sibr")
+
+
+def path_poses(path, cameras, n_frames, keyframe_stride=1, sibr_path=None):
+    """OpenGL camera to world poses [N, 3, 4] of the requested path."""
+    if path == "sibr":
+        return sibr.records_to_c2w(sibr.read(sibr_path))
+    cameras = sorted(cameras, key=lambda c: c.image_name)
+    c2w = camera_path.c2w_from_world_view(
+        np.stack([c.world_view_transform.cpu().numpy() for c in cameras]).astype(np.float64))
+    # The path generators expect poses recentered with transform_poses_pca.
+    poses, transform = camera_utils_zipnerf.transform_poses_pca(c2w)
+    if path == "ellipse":
+        poses = camera_utils_zipnerf.generate_ellipse_path(poses, n_frames)
+    else:
+        poses, _, _ = camera_utils_zipnerf.generate_interpolated_path(
+            poses[::keyframe_stride], n_frames, n_interp_as_total=True)
+    return camera_path.undo_transform(poses, transform)
+
+
+def make_views(c2w, refcam, resolution_scale=1.0, glo_vector=None):
+    width = int(round(refcam.image_width * resolution_scale))
+    height = int(round(refcam.image_height * resolution_scale))
+    # Converted and uploaded in one batch, the views share slices of it.
+    world_views = torch.as_tensor(camera_path.world_view_from_c2w(c2w)).float().cuda()
+    views = []
+    for world_view_transform in world_views:
+        view = MiniCam(width, height, refcam.FoVy, refcam.FoVx, refcam.znear, refcam.zfar,
+                       world_view_transform, world_view_transform)
+        view.model = ProjectionType.PERSPECTIVE
+        view.glo_vector = glo_vector
+        views.append(view)
+    return views
+
+
+def render_views(renderer, views, pipeline, background, writer):
+    for i, view in enumerate(tqdm(views, desc="Rendering path")):
+        renderer.set_camera(view)
+        image = renderer.render(view, pipeline, background)
+        # Only the copy to the host waits here, encoding and disk writes run on the writer's threads.
+        writer.submit(i, image.clamp(0, 1).permute(1, 2, 0).cpu().numpy())
+
+
+def render_path(dataset : ModelParams, iteration : int, pipeline : PipelineParams, args):
+    with torch.no_grad():
+        gaussians = GaussianModel(dataset.sh_degree, dataset.use_neural_network, dataset.max_opacity)
+        scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False)
+        cameras = scene.getTrainCameras()
+        refcam = cameras[0]
+        glo_vector = None
+        if pipeline.enable_GLO:
+            glo_vector = torch.cat([gaussians.glo[0], torch.tensor(
+                [math.log(refcam.iso * refcam.exposure / 1000)], device=gaussians.glo.device)])
+
+        c2w = path_poses(args.path, cameras, args.n_frames, args.keyframe_stride, args.sibr_path)
+        views = make_views(c2w, refcam, args.resolution_scale, glo_vector)
+        bg_color = [1, 1, 1] if dataset.white_background else [0, 0, 0]
+        background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
+        output_dir = args.output_dir or os.path.join(dataset.model_path, "paths", args.path)
+        renderer = FastRenderer(views[0], gaussians, pipeline.enable_GLO)
+        video_path = os.path.join(output_dir, f"{args.path}.mp4") if args.video else None
+        if video_path is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        with FrameWriter(output_dir if args.formats else None, args.formats, video_path, args.fps,
+                         args.write_threads, args.max_pending) as writer:
+            render_views(renderer, views, pipeline, background, writer)
+        print(f"Wrote {len(views)} frames to {output_dir}")
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Camera path rendering parameters")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--path", choices=PATHS, default="ellipse")
+    parser.add_argument("--sibr_path", default=None, help="SIBR .path file for --path sibr")
+    parser.add_argument("--n_frames", default=480, type=int, help="Frames of the ellipse and interpolated paths")
+    parser.add_argument("--keyframe_stride", default=1, type=int, help="Training cameras between keyframes of the interpolated path")
+    parser.add_argument("--resolution_scale", default=1.0, type=float)
+    parser.add_argument("--output_dir", default=None, help="Defaults to <model_path>/paths/<path>")
+    parser.add_argument("--formats", nargs="*", choices=list(WRITERS), default=["png"], help="Image files written per frame")
+    parser.add_argument("--video", action="store_true", help="Also write <path>.mp4")
+    parser.add_argument("--fps", default=30, type=float)
+    parser.add_argument("--write_threads", default=4, type=int)
+    parser.add_argument("--max_pending", default=8, type=int, help="Rendered frames waiting to be written before rendering blocks")
+    parser.add_argument("--quiet", action="store_true")
+    args = get_combined_args(parser)
+    if args.path == "sibr" and args.sibr_path is None:
+        parser.error("--path sibr requires --sibr_path")
+    print("Rendering " + args.model_path)
+
+    safe_state(args.quiet)
+
+    render_path(model.extract(args), args.iteration, pipeline.extract(args), args)
@@ -0,0 +1,240 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asyncio server for the network_gui (SIBR remote viewer) protocol.
+
+Each connection runs three stages connected by single slot mailboxes:
+
+  receive: reads camera requests as they arrive,
+  render:  renders the newest request on a single render thread,
+  send:    encodes the newest frame on a thread pool and writes it out.
+
+A request that is still waiting when a newer one arrives is dropped, and so
+is a rendered frame that was not sent yet, so a slow client never queues up
+stale work and slow rendering never blocks reads. A client that waits for
+every reply before sending the next request gets exactly one reply per
+request.
+
+Wire format, as in network_gui: a request is a 4 byte little endian length
+followed by that many bytes of JSON. A reply is the raw frame bytes (none
+for requests without a camera) followed by the length prefixed verify
+string.
+
+Clients can negotiate a compressed encoding instead, see frame_codec.py.
+
+A request whose render raises is logged and answered with a black frame of
+the requested resolution, and the connection keeps being served.
+
+The renderer is any callable taking the parsed request and returning an
+HxWx3 uint8 array, so the server can be run with StandInRenderer instead of
+the CUDA tracer (python -m integration_utils.render_server).
+"""
+
+import argparse
+import asyncio
+import json
+import struct
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import *
+
+import numpy as np
+
+from .frame_codec import FrameEncoder
+
+CLOSED = object()
+
+
+class LatestSlot:
+    """Single item mailbox where put replaces an item that was not taken yet."""
+
+    def __init__(self):
+        self.item = None
+        self.full = False
+        self.closed = False
+        self.num_dropped = 0
+        self.event = asyncio.Event()
+
+    def put(self, item):
+        if self.full:
+            self.num_dropped += 1
+        self.item = item
+        self.full = True
+        self.event.set()
+
+    def close(self):
+        self.closed = True
+        self.event.set()
+
+    async def get(self):
+        """Returns the newest item, or CLOSED once closed and empty."""
+        while not self.full:
+            if self.closed:
+                return CLOSED
+            self.event.clear()
+            await self.event.wait()
+        item = self.item
+        self.item = None
+        self.full = False
+        return item
+
+
+@dataclass
+class Request:
+    seq: int
+    message: Dict[str, Any]
+    camera: Any
+    received: float
+
+
+@dataclass
+class Frame:
+    request: Request
+    image: Optional[np.ndarray]
+    rendered: float
+
+
+def parse_message(message: Dict[str, Any]):
+    """Default request parser: the message itself, or None without a resolution."""
+    if message.get("resolution_x", 0) == 0 or message.get("resolution_y", 0) == 0:
+        return None
+    return message
+
+
+class StandInRenderer:
+    """CPU renderer for load testing: a frame filled with the request's frame_id."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def __call__(self, message):
+        if self.delay > 0:
+            time.sleep(self.delay)
+        w = message["resolution_x"]
+        h = message["resolution_y"]
+        return np.full((h, w, 3), message.get("frame_id", 0) % 256, dtype=np.uint8)
+
+
+class RenderServer:
+    def __init__(self,
+                 renderer: Callable[[Any], np.ndarray],
+                 parse_request: Callable[[Dict[str, Any]], Any] = parse_message,
+                 make_encoder: Callable[[], Callable[[Frame], bytes]] = FrameEncoder,
+                 verify: str = "",
+                 host: str = "127.0.0.1",
+                 port: int = 6009,
+                 num_encode_threads: int = 2):
+        self.renderer = renderer
+        self.parse_request = parse_request
+        # Called once per connection, so encoders can keep state such as the previous frame.
+        self.make_encoder = make_encoder
+        self.verify = verify
+        self.host = host
+        self.port = port
+        # Rendering is serialized on one thread, encoding overlaps with it.
+        self.render_executor = ThreadPoolExecutor(max_workers=1)
+        self.encode_executor = ThreadPoolExecutor(max_workers=num_encode_threads)
+        self.stats = dict(received=0, rendered=0, render_errors=0, sent=0, sent_bytes=0,
+                          dropped_requests=0, dropped_frames=0)
+        self.server = None
+
+    async def receive(self, reader: asyncio.StreamReader, requests: LatestSlot):
+        loop = asyncio.get_running_loop()
+        seq = 0
+        try:
+            while True:
+                length, = struct.unpack("<I", await reader.readexactly(4))
+                message = json.loads((await reader.readexactly(length)).decode("utf-8"))
+                camera = await loop.run_in_executor(None, self.parse_request, message)
+                self.stats["received"] += 1
+                requests.put(Request(seq, message, camera, time.perf_counter()))
+                seq += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            requests.close()
+
+    async def render(self, requests: LatestSlot, frames: LatestSlot):
+        loop = asyncio.get_running_loop()
+        try:
+            while (request := await requests.get()) is not CLOSED:
+                image = None
+                if request.camera is not None:
+                    try:
+                        image = await loop.run_in_executor(self.render_executor, self.renderer, request.camera)
+                        self.stats["rendered"] += 1
+                    except Exception:
+                        print(traceback.format_exc())
+                        self.stats["render_errors"] += 1
+                        image = np.zeros((request.message["resolution_y"], request.message["resolution_x"], 3),
+                                         dtype=np.uint8)
+                frames.put(Frame(request, image, time.perf_counter()))
+        finally:
+            frames.close()
+
+    async def send(self, writer: asyncio.StreamWriter, frames: LatestSlot):
+        loop = asyncio.get_running_loop()
+        verify = self.verify.encode("ascii")
+        encode = self.make_encoder()
+        while (frame := await frames.get()) is not CLOSED:
+            # Encoding runs on the pool while the next frame renders.
+            payload = await loop.run_in_executor(self.encode_executor, encode, frame)
+            writer.write(payload)
+            writer.write(struct.pack("<I", len(verify)) + verify)
+            await writer.drain()
+            self.stats["sent"] += 1
+            self.stats["sent_bytes"] += len(payload)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        requests = LatestSlot()
+        frames = LatestSlot()
+        stages = [
+            asyncio.create_task(self.receive(reader, requests)),
+            asyncio.create_task(self.render(requests, frames)),
+            asyncio.create_task(self.send(writer, frames)),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            for task in stages:
+                task.cancel()
+            self.stats["dropped_requests"] += requests.num_dropped
+            self.stats["dropped_frames"] += frames.num_dropped
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve_forever())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render server with a CPU stand-in renderer, for load testing")
+    parser.add_argument('--ip', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=6009)
+    parser.add_argument('--delay', type=float, default=0.02, help="Seconds per rendered frame")
+    args = parser.parse_args()
+    RenderServer(StandInRenderer(args.delay), host=args.ip, port=args.port).run()
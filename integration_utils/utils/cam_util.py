@@ -15,6 +15,7 @@
 import numpy as np
 from utils import stepfun
 from icecream import ic
+from ever.utils import camera_path
 
 def rotation_about_axis(degrees, axis=0):
   """Creates rotation matrix about one of the coordinate axes."""
@@ -49,17 +50,9 @@ def viewmatrix(
     position,
     lock_up = False,
 ):
-  """Construct lookat view matrix."""
-  orthogonal_dir = lambda a, b: normalize(np.cross(a, b))
-  vecs = [None, normalize(up), normalize(lookdir)]
-  # x-axis is always the normalized cross product of `lookdir` and `up`.
-  vecs[0] = orthogonal_dir(vecs[1], vecs[2])
+  """Construct lookat view matrices, [..., 3] inputs give [..., 3, 4] poses."""
   # Default is to lock `lookdir` vector, if lock_up is True lock `up` instead.
-  ax = 2 if lock_up else 1
-  # Set the not-locked axis to be orthogonal to the other two.
-  vecs[ax] = orthogonal_dir(vecs[(ax + 1) % 3], vecs[(ax + 2) % 3])
-  m = np.stack(vecs + [position], axis=1)
-  return m
+  return camera_path.viewmatrix(lookdir, up, position, lock_up=lock_up)
 
 
 def generate_ellipse_path(
@@ -142,7 +135,7 @@ def generate_ellipse_path(
   ind_up = np.argmax(np.abs(avg_up))
   up = np.eye(3)[ind_up] * np.sign(avg_up[ind_up])
 
-  poses = np.stack([viewmatrix(p - center, up, p, lock_up) for p in positions])
+  poses = viewmatrix(positions - center, up, positions, lock_up)
 
   poses = poses @ rotation_about_axis(-render_rotate_yaxis, axis=1)
   poses = poses @ rotation_about_axis(render_rotate_xaxis, axis=0)
@@ -30,6 +30,10 @@ import scipy
 from icecream import ic
 
 from scene.dataset_readers import ProjectionType
+from utils import stepfun
+from ever.utils import camera_path
+from ever.utils import distortion
+from ever.utils import scene_bounds
 
 _Array: TypeAlias = np.ndarray | jnp.ndarray
 _ScalarArray: TypeAlias = float | _Array
@@ -143,17 +147,9 @@ def viewmatrix(
     position,
     lock_up = False,
 ):
-  """Construct lookat view matrix."""
-  orthogonal_dir = lambda a, b: normalize(np.cross(a, b))
-  vecs = [None, normalize(up), normalize(lookdir)]
-  # x-axis is always the normalized cross product of `lookdir` and `up`.
-  vecs[0] = orthogonal_dir(vecs[1], vecs[2])
+  """Construct lookat view matrices, [..., 3] inputs give [..., 3, 4] poses."""
   # Default is to lock `lookdir` vector, if lock_up is True lock `up` instead.
-  ax = 2 if lock_up else 1
-  # Set the not-locked axis to be orthogonal to the other two.
-  vecs[ax] = orthogonal_dir(vecs[(ax + 1) % 3], vecs[(ax + 2) % 3])
-  m = np.stack(vecs + [position], axis=1)
-  return m
+  return camera_path.viewmatrix(lookdir, up, position, lock_up=lock_up)
 
 
 def rotation_about_axis(degrees, axis=0):
@@ -211,16 +207,16 @@ def generate_spiral_path(
   radii = np.concatenate([radii, [1.0]])
 
   # Generate poses for spiral path.
-  render_poses = []
   cam2world = average_pose(poses)
   up = poses[:, :3, 1].mean(0)
-  for theta in np.linspace(0.0, 2.0 * np.pi * n_rots, n_frames, endpoint=False):
-    t = radii * [np.cos(theta), -np.sin(theta), -np.sin(theta * zrate), 1.0]
-    position = cam2world @ t
-    lookat = cam2world @ [0, 0, -focal, 1.0]
-    z_axis = position - lookat
-    render_poses.append(viewmatrix(z_axis, up, position))
-  render_poses = np.stack(render_poses, axis=0)
+  theta = np.linspace(0.0, 2.0 * np.pi * n_rots, n_frames, endpoint=False)
+  t = radii * np.stack(
+      [np.cos(theta), -np.sin(theta), -np.sin(theta * zrate), np.ones_like(theta)],
+      axis=-1,
+  )
+  positions = t @ cam2world.T
+  lookat = cam2world @ [0, 0, -focal, 1.0]
+  render_poses = viewmatrix(positions - lookat, up, positions)
   return render_poses
 
 
@@ -375,7 +371,7 @@ def generate_ellipse_path(
   ind_up = np.argmax(np.abs(avg_up))
   up = np.eye(3)[ind_up] * np.sign(avg_up[ind_up])
 
-  poses = np.stack([viewmatrix(p - center, up, p, lock_up) for p in positions])
+  poses = viewmatrix(positions - center, up, positions, lock_up)
 
   poses = poses @ rotation_about_axis(-render_rotate_yaxis, axis=1)
   poses = poses @ rotation_about_axis(render_rotate_xaxis, axis=0)
@@ -432,17 +428,21 @@ def generate_interpolated_path(
 
   def points_to_poses(points):
     """Converts from (position, lookat, up) format to pose matrices."""
-    poses = []
-    for i in range(len(points)):
-      pos, lookat_point, up_point = points[i]
-      if lookahead_i is not None:
-        if i + lookahead_i < len(points):
-          lookat = pos - points[i + lookahead_i][0]
-      else:
-        lookat = pos - lookat_point
-      up = (up_point - pos) if fixed_up_vector is None else fixed_up_vector
-      poses.append(viewmatrix(lookat, up, pos, lock_up=lock_up))
-    return np.array(poses)
+    pos, lookat_point, up_point = points[:, 0], points[:, 1], points[:, 2]
+    if lookahead_i is not None:
+      last = len(points) - lookahead_i - 1
+      if last < 0:
+        raise ValueError(
+            f'lookahead_i={lookahead_i} needs more than {len(points)} poses.'
+        )
+      # The last `lookahead_i` poses keep the look direction of the last pose
+      # that has a pose `lookahead_i` frames ahead.
+      i = np.minimum(np.arange(len(points)), last)
+      lookat = pos[i] - pos[i + lookahead_i]
+    else:
+      lookat = pos - lookat_point
+    up = (up_point - pos) if fixed_up_vector is None else fixed_up_vector
+    return viewmatrix(lookat, up, pos, lock_up=lock_up)
 
   def insert_buffer_poses(poses, n_buffer):
     """Insert extra poses at the start and end of the path."""
@@ -790,120 +790,11 @@ def pixel_coordinates(
   return xnp.meshgrid(xnp.arange(width), xnp.arange(height), indexing='xy')
 
 
-def _radial_and_tangential_distort(
-    x,
-    y,
-    k1 = 0,
-    k2 = 0,
-    k3 = 0,
-    k4 = 0,
-    p1 = 0,
-    p2 = 0,
-):
-  """Computes the distorted pixel positions."""
-  r2 = x * x + y * y
-
-  radial_distortion = r2 * (k1 + r2 * (k2 + r2 * (k3 + r2 * k4)))
-  dx_radial = x * radial_distortion
-  dy_radial = y * radial_distortion
-
-  dx_tangential = 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
-  dy_tangential = 2 * p2 * x * y + p1 * (r2 + 2 * y * y)
-
-  return x + dx_radial + dx_tangential, y + dy_radial + dy_tangential
-
-
-def _compute_residual_and_jacobian(
-    x,
-    y,
-    xd,
-    yd,
-    k1 = 0.0,
-    k2 = 0.0,
-    k3 = 0.0,
-    k4 = 0.0,
-    p1 = 0.0,
-    p2 = 0.0,
-):
-  """Auxiliary function of radial_and_tangential_undistort()."""
-  # Adapted from https://github.com/google/nerfies/blob/main/nerfies/camera.py
-  # let r(x, y) = x^2 + y^2;
-  #     d(x, y) = 1 + k1 * r(x, y) + k2 * r(x, y) ^2 + k3 * r(x, y)^3 +
-  #                   k4 * r(x, y)^4;
-  r = x * x + y * y
-  d = 1.0 + r * (k1 + r * (k2 + r * (k3 + r * k4)))
-
-  # The perfect projection is:
-  # xd = x * d(x, y) + 2 * p1 * x * y + p2 * (r(x, y) + 2 * x^2);
-  # yd = y * d(x, y) + 2 * p2 * x * y + p1 * (r(x, y) + 2 * y^2);
-  #
-  # Let's define
-  #
-  # fx(x, y) = x * d(x, y) + 2 * p1 * x * y + p2 * (r(x, y) + 2 * x^2) - xd;
-  # fy(x, y) = y * d(x, y) + 2 * p2 * x * y + p1 * (r(x, y) + 2 * y^2) - yd;
-  #
-  # We are looking for a solution that satisfies
-  # fx(x, y) = fy(x, y) = 0;
-  fx = d * x + 2 * p1 * x * y + p2 * (r + 2 * x * x) - xd
-  fy = d * y + 2 * p2 * x * y + p1 * (r + 2 * y * y) - yd
-
-  # Compute derivative of d over [x, y]
-  d_r = k1 + r * (2.0 * k2 + r * (3.0 * k3 + r * 4.0 * k4))
-  d_x = 2.0 * x * d_r
-  d_y = 2.0 * y * d_r
-
-  # Compute derivative of fx over x and y.
-  fx_x = d + d_x * x + 2.0 * p1 * y + 6.0 * p2 * x
-  fx_y = d_y * x + 2.0 * p1 * x + 2.0 * p2 * y
-
-  # Compute derivative of fy over x and y.
-  fy_x = d_x * y + 2.0 * p2 * y + 2.0 * p1 * x
-  fy_y = d + d_y * y + 2.0 * p2 * x + 6.0 * p1 * y
-
-  return fx, fy, fx_x, fx_y, fy_x, fy_y
-
-
-def _radial_and_tangential_undistort(
-    xd,
-    yd,
-    k1 = 0,
-    k2 = 0,
-    k3 = 0,
-    k4 = 0,
-    p1 = 0,
-    p2 = 0,
-    eps = 1e-9,
-    max_iterations=10,
-    xnp = np,
-):
-  """Computes undistorted (x, y) from (xd, yd)."""
-  # From https://github.com/google/nerfies/blob/main/nerfies/camera.py
-  # Initialize from the distorted point.
-  x = xd.clone()
-  y = yd.clone()
-
-  for _ in range(max_iterations):
-    fx, fy, fx_x, fx_y, fy_x, fy_y = _compute_residual_and_jacobian(
-        x=x, y=y, xd=xd, yd=yd, k1=k1, k2=k2, k3=k3, k4=k4, p1=p1, p2=p2
-    )
-    denominator = fy_x * fx_y - fx_x * fy_y
-    x_numerator = fx * fy_y - fy * fx_y
-    y_numerator = fy * fx_x - fx * fy_x
-    step_x = xnp.where(
-        xnp.abs(denominator) > eps,
-        x_numerator / denominator,
-        xnp.zeros_like(denominator),
-    )
-    step_y = xnp.where(
-        xnp.abs(denominator) > eps,
-        y_numerator / denominator,
-        xnp.zeros_like(denominator),
-    )
-
-    x = x + step_x
-    y = y + step_y
-
-  return x, y
+# The distortion model lives in utils/distortion.py, next to the cached
+# undistortion maps pixels_to_rays can use instead of the iterative solve.
+_radial_and_tangential_distort = distortion.radial_and_tangential_distort
+_compute_residual_and_jacobian = distortion.compute_residual_and_jacobian
+_radial_and_tangential_undistort = distortion.radial_and_tangential_undistort
 
 
 def pixels_to_rays(
@@ -915,7 +806,8 @@ def pixels_to_rays(
     pixtocam_ndc = None,
     camtype = ProjectionType.PERSPECTIVE,
     xnp = np,
-    correct_coordinates=False
+    correct_coordinates=False,
+    undistortion_map = None,
 ):
   """Calculates rays given pixel coordinates, intrinisics, and extrinsics.
 
@@ -935,6 +827,9 @@ def pixels_to_rays(
     pixtocam_ndc: float array, [3, 3], optional inverse intrinsics for NDC.
     camtype: camera_utils.ProjectionType, fisheye or perspective camera.
     xnp: either numpy or jax.numpy.
+    undistortion_map: optional distortion.UndistortionMap built for pixtocams
+      and distortion_params, replaces applying pixtocams and the iterative
+      undistortion by a table lookup.
 
   Returns:
     origins: float array, shape SH + [3], ray origin points.
@@ -965,10 +860,17 @@ def pixels_to_rays(
   matmul = math.matmul if xnp == jnp else xnp.matmul
   mat_vec_mul = lambda A, b: matmul(A, b[Ellipsis, None])[Ellipsis, 0]
 
-  # Apply inverse intrinsic matrices.
-  camera_dirs_stacked = mat_vec_mul(pixtocams, pixel_dirs_stacked)
+  if undistortion_map is not None:
+    # Inverse intrinsics and undistortion in one lookup.
+    x, y = undistortion_map.lookup(
+        pixel_dirs_stacked[Ellipsis, 0], pixel_dirs_stacked[Ellipsis, 1], xnp=xnp
+    )
+    camera_dirs_stacked = xnp.stack([x, y, xnp.ones_like(x)], -1)
+  else:
+    # Apply inverse intrinsic matrices.
+    camera_dirs_stacked = mat_vec_mul(pixtocams, pixel_dirs_stacked)
 
-  if distortion_params is not None:
+  if distortion_params is not None and undistortion_map is None:
     # Correct for distortion.
     x, y = _radial_and_tangential_undistort(
         camera_dirs_stacked[Ellipsis, 0],
@@ -1160,15 +1062,9 @@ def _intersect_ranges(
   return (start, end)
 
 
-def ray_box_intersection(
-    ray_o, ray_d, corners, xnp = np
-):
-  """Returns enter/exit distances along the ray for box defined by `corners`."""
-  t1 = (corners[0] - ray_o) / ray_d
-  t2 = (corners[1] - ray_o) / ray_d
-  t_min = xnp.minimum(t1, t2).max(axis=-1)
-  t_max = xnp.maximum(t1, t2).min(axis=-1)
-  return t_min, t_max
+# The ray/bounds intersections live in utils/scene_bounds.py, which also
+# computes per ray tracing bounds from them.
+ray_box_intersection = scene_bounds.ray_box_intersection
 
 
 def modify_rays_with_bbox(
@@ -1199,42 +1095,7 @@ def modify_rays_with_bbox(
   return rays.replace(lossmult=lossmult, near=near, far=far)
 
 
-def ray_sphere_intersection(
-    ray_o,
-    ray_d,
-    center,
-    radius,
-    xnp = np,
-):
-  """Calculates distance to hit a sphere for a ray.
-
-  Args:
-    ray_o: Ray origin (..., 3)
-    ray_d: Ray direction (..., 3)
-    center: Sphere center (..., 3)
-    radius: Sphere radius (..., 1)
-    xnp: Numpy or Jax module
-
-  Returns:
-    t_min, t_max, hit. When no hit is found, t_min = t_max = 0.
-  """
-  oc = ray_o - center
-
-  a = (ray_d**2).sum(axis=-1)
-  b = 2 * (oc * ray_d).sum(axis=-1)
-  c = (oc * oc).sum(axis=-1) - radius**2
-
-  det = b**2 - 4.0 * a * c
-
-  hit = (det >= 0) * (a > 0)
-
-  # Nb: Results are 'wrong' if valid = false, this is just to make jax
-  # not freak out.
-  det = xnp.where(hit, det, 0.0)
-  a = xnp.where(hit, a, 1.0)
-  t_min = xnp.where(hit, (-b - xnp.sqrt(det)) / (2.0 * a), 0.0)
-  t_max = xnp.where(hit, (-b + xnp.sqrt(det)) / (2.0 * a), 0.0)
-  return t_min, t_max, hit
+ray_sphere_intersection = scene_bounds.ray_sphere_intersection
 
 
 def gather_cameras(cameras, cam_idx, xnp=np):
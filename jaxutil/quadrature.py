@@ -27,9 +27,8 @@ def assert_valid_stepfun(t, y):
         f'Invalid shapes ({t.shape}, {y.shape}) for a step function.'
     )
 
-@jax.jit
-def lossfun_distortion(t, w):
-  """Compute iint w[i] w[j] |t[i] - t[j]| di dj."""
+def lossfun_distortion_pairwise(t, w):
+  """Compute iint w[i] w[j] |t[i] - t[j]| di dj with an O(n^2) pairwise matrix."""
   assert_valid_stepfun(t, w)
 
   # The loss incurred between all pairs of intervals.
@@ -43,6 +42,51 @@ def lossfun_distortion(t, w):
   return loss_inter + loss_intra
 
 
+@jax.jit
+def lossfun_distortion(t, w):
+  """Compute iint w[i] w[j] |t[i] - t[j]| di dj in O(n log n) time and O(n) memory.
+
+  Once the interval midpoints are sorted, the pairwise term for interval i
+  against all earlier intervals is w[i] * (ut[i] * sum(w[:i]) - sum(w[:i] * ut[:i])),
+  so it can be accumulated with prefix sums. Works on [..., n] step functions.
+  """
+  assert_valid_stepfun(t, w)
+  batch_shape = jnp.broadcast_shapes(t.shape[:-1], w.shape[:-1])
+  t = jnp.broadcast_to(t, batch_shape + t.shape[-1:])
+  w = jnp.broadcast_to(w, batch_shape + w.shape[-1:])
+
+  ut = (t[Ellipsis, 1:] + t[Ellipsis, :-1]) / 2
+  order = jnp.argsort(ut, axis=-1)
+  ut_sorted = jnp.take_along_axis(ut, order, axis=-1)
+  w_sorted = jnp.take_along_axis(w, order, axis=-1)
+
+  # Exclusive prefix sums of the weights and weighted midpoints.
+  w_cumsum = jnp.cumsum(w_sorted, axis=-1) - w_sorted
+  wt_cumsum = jnp.cumsum(w_sorted * ut_sorted, axis=-1) - w_sorted * ut_sorted
+  loss_inter = 2 * jnp.sum(w_sorted * (ut_sorted * w_cumsum - wt_cumsum), axis=-1)
+
+  # The loss incurred within each individual interval with itself.
+  loss_intra = jnp.sum(w**2 * jnp.diff(t), axis=-1) / 3
+
+  return loss_inter + loss_intra
+
+
+def lossfun_distortion_batched(t, w, batch_size=4096):
+  """lossfun_distortion over [..., n] step functions, evaluated batch_size rows at a time.
+
+  The leading dimensions of t and w are broadcast against each other, which
+  lets many rays share a single tdist.
+  """
+  batch_shape = jnp.broadcast_shapes(t.shape[:-1], w.shape[:-1])
+  t = jnp.broadcast_to(t, batch_shape + t.shape[-1:]).reshape(-1, t.shape[-1])
+  w = jnp.broadcast_to(w, batch_shape + w.shape[-1:]).reshape(-1, w.shape[-1])
+  loss = jnp.concatenate([
+      lossfun_distortion(t[i:i + batch_size], w[i:i + batch_size])
+      for i in range(0, max(t.shape[0], 1), batch_size)
+  ])
+  return loss.reshape(batch_shape)
+
+
 def log1mexp(x):
     """Accurate computation of log(1 - exp(-x)) for x > 0, thanks watsondaniel."""
     # https://cran.r-project.org/web/packages/Rmpfr/vignettes/log1mexp-note.pdf
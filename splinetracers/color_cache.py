@@ -0,0 +1,86 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Caches view dependent primitive colors between frames.
+
+The color of a primitive depends on the camera only through the direction
+from the camera center to its mean. The cache remembers the direction each
+cached color was evaluated for:
+
+  * if the camera center moved by at most position_tolerance, the cached
+    colors are returned as they are;
+  * otherwise only primitives whose view direction turned by more than
+    angle_tolerance (radians) are evaluated again.
+
+Everything else the colors depend on (SH degree, GLO vector, the features
+themselves) goes into key; a different key recomputes all primitives.
+"""
+
+import math
+from typing import *
+
+import torch
+
+
+class ViewColorCache:
+    def __init__(self, angle_tolerance: float = 0.0, position_tolerance: float = 0.0):
+        self.angle_tolerance = angle_tolerance
+        self.position_tolerance = position_tolerance
+        self.invalidate()
+
+    def invalidate(self):
+        self.key = None
+        self.colors = None
+        self.dirs = None
+        self.cam_pos = None
+        self.num_evaluated = 0
+
+    def view_dirs(self, means: torch.Tensor, cam_pos: torch.Tensor) -> torch.Tensor:
+        dirs = means - cam_pos.reshape(1, 3)
+        return dirs / dirs.norm(dim=-1, keepdim=True).clip(min=1e-12)
+
+    def get(self,
+            means: torch.Tensor,
+            cam_pos: torch.Tensor,
+            compute: Callable[[Optional[torch.Tensor]], torch.Tensor],
+            key: Hashable = None) -> torch.Tensor:
+        """Returns the colors of all primitives seen from cam_pos.
+
+        compute(inds) evaluates the colors of the primitives in inds (all
+        of them for None) for cam_pos.
+        """
+        cam_pos = cam_pos.reshape(3).to(means.device)
+        stale = (self.colors is None or key != self.key
+                 or self.colors.shape[0] != means.shape[0])
+        if stale:
+            self.colors = compute(None)
+            self.dirs = self.view_dirs(means, cam_pos)
+            self.num_evaluated += means.shape[0]
+        elif (cam_pos - self.cam_pos).norm() > self.position_tolerance:
+            dirs = self.view_dirs(means, cam_pos)
+            changed = (dirs * self.dirs).sum(dim=-1) < math.cos(self.angle_tolerance)
+            inds = changed.nonzero()[:, 0]
+            if inds.numel() == means.shape[0]:
+                self.colors = compute(None)
+                self.dirs = dirs
+            elif inds.numel() > 0:
+                self.colors = self.colors.clone()
+                self.colors[inds] = compute(inds)
+                self.dirs[inds] = dirs[inds]
+            self.num_evaluated += inds.numel()
+        else:
+            return self.colors
+        self.key = key
+        self.cam_pos = cam_pos
+        return self.colors
@@ -0,0 +1,326 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""CPU implementation of fast_ellipsoid_splinetracer.trace_rays.
+
+Rays are intersected analytically with every ellipsoid, the entry and exit
+control points are sorted along each ray and the `update` step of
+`spline-machine.slang` is run over them, vectorized across a tile of rays.
+Tiles are traced on a thread pool. Everything is plain torch, so it runs on
+any device and autograd flows through it.
+"""
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import torch
+
+from splinetracers import tiling
+from splinetracers import iter_budget
+from splinetracers import instrumentation
+from splinetracers import ray_bounds
+
+# Constants shared with slang/safe-math.slang, spline-machine.slang and
+# fast_ellipsoid_splinetracer/slang/shaders.slang.
+TINY_VAL = 1.0754944e-20
+MIN_VAL = -1e20
+MAX_VAL = 1e20
+PRE_MULTI = 1000
+LADDER_P = -0.1
+LOG_CUTOFF = 5.54
+MIN_TRANSMITTANCE = math.exp(-LOG_CUTOFF)
+SH_C0 = 0.28209479177387814
+NUM_FLOAT_PER_STATE = 16
+
+
+def safe_div(a, b):
+    b = torch.where(b.abs() < TINY_VAL, torch.full_like(b, TINY_VAL), b)
+    return (a / b).clip(MIN_VAL, MAX_VAL)
+
+
+def safe_exp(v):
+    return torch.exp(v.clip(MIN_VAL, math.log(MAX_VAL)))
+
+
+def tukey_power_ladder(x, p):
+    # Compute sign(x) * |p - 1|/p * ((|x|/|p-1| + 1)^p - 1)
+    xs = x.abs() / max(TINY_VAL, abs(p - 1))
+    return torch.sign(x) * abs(p - 1) / p * ((xs + 1) ** p - 1)
+
+
+def rotate_vector(v, q):
+    """Rotates v by the conjugate of the (w, x, y, z) quaternion q."""
+    qv = -q[..., 1:]
+    t = 2 * torch.cross(qv, v, dim=-1)
+    return v + q[..., :1] * t + torch.cross(qv, t, dim=-1)
+
+
+def ray_intersect_ellipsoid(rayo, rayd, scales, quat):
+    """Entry and exit distances of rays with ellipsoids centered at the origin.
+
+    Misses return (-1, -1), like eliIntersect in tri-intersect.slang.
+    """
+    ocn = rotate_vector(rayo, quat) / scales
+    rdn = rotate_vector(rayd, quat) / scales
+    a = (rdn * rdn).sum(dim=-1)
+    bp = -(ocn * rdn).sum(dim=-1)
+    l = ocn + (bp / a)[..., None] * rdn
+    h = a * (1 - (l * l).sum(dim=-1))
+    c = (ocn * ocn).sum(dim=-1) - 1
+    q = bp + torch.sign(bp) * torch.sqrt(h.clip(min=0))
+    t0 = c / q
+    t1 = q / a
+    hit = h >= 0
+    tmin = torch.where(hit, torch.minimum(t0, t1), -torch.ones_like(t0))
+    tmax = torch.where(hit, torch.maximum(t0, t1), -torch.ones_like(t1))
+    return tmin, tmax
+
+
+def make_empty_state(num_rays, device):
+    zeros = lambda *shape: torch.zeros((num_rays, *shape), dtype=torch.float32, device=device)
+    return dict(
+        distortion_parts=zeros(2),
+        cum_sum=zeros(2),
+        t=zeros(),
+        drgb=zeros(4),
+        logT=zeros(),
+        C=zeros(3),
+    )
+
+
+def update(state, t, dirac):
+    """Port of `update` from spline-machine.slang, batched over rays."""
+    dt = (t - state['t']).clip(min=0)
+    drgb = state['drgb']
+    area = (drgb[:, 0] * dt).clip(min=0)
+    rgb_norm = safe_div(drgb[:, 1:], drgb[:, :1])
+
+    weight = ((1 - safe_exp(-area)) * safe_exp(-state['logT'])).clip(0, 1)
+    m = tukey_power_ladder((t + state['t']) / 2 * PRE_MULTI, LADDER_P)
+    cum_sum = state['cum_sum']
+    return dict(
+        distortion_parts=state['distortion_parts'] + 2 * weight[:, None] * torch.stack(
+            [m * cum_sum[:, 0], cum_sum[:, 1]], dim=-1),
+        cum_sum=cum_sum + torch.stack([weight, weight * m], dim=-1),
+        t=t,
+        drgb=drgb + dirac,
+        logT=(area + state['logT']).clip(min=0),
+        C=state['C'] + weight[:, None] * rgb_norm,
+    )
+
+
+def extract_color(state):
+    opacity = 1 - torch.exp(-state['logT'])
+    distortion_loss = state['distortion_parts'][:, 0] - state['distortion_parts'][:, 1]
+    return torch.cat([state['C'], opacity[:, None]], dim=1), distortion_loss
+
+
+def pack_states(state):
+    """Lays the state out like the SplineState struct in structs.h."""
+    num_rays = state['t'].shape[0]
+    padding = torch.zeros((num_rays, 3), dtype=torch.float32, device=state['t'].device)
+    return torch.cat([
+        state['distortion_parts'], state['cum_sum'], padding, state['t'][:, None],
+        state['drgb'], state['logT'][:, None], state['C'],
+    ], dim=1)
+
+
+def collect_ctrl_pts(origin, direction, mean, scale, quat, drgb, tmax, max_pts, prim_block_size):
+    """Returns the first max_pts control points along each ray, sorted by t.
+
+    Primitives are visited in blocks and merged into a running top-k, so
+    memory is bounded by the tile size times (max_pts + 2 * prim_block_size).
+    Empty slots have t = inf and tri = -1.
+    """
+    num_rays = origin.shape[0]
+    device = origin.device
+    ts = torch.full((num_rays, 0), float('inf'), device=device)
+    tris = torch.zeros((num_rays, 0), dtype=torch.int64, device=device)
+    diracs = torch.zeros((num_rays, 0, 4), device=device)
+    for start in range(0, mean.shape[0], prim_block_size):
+        end = min(start + prim_block_size, mean.shape[0])
+        t0, t1 = ray_intersect_ellipsoid(
+            origin[:, None] - mean[None, start:end], direction[:, None],
+            scale[None, start:end], quat[None, start:end])
+        # Exits are reported for every primitive whose span starts before tmax,
+        # entries only when they lie in front of the ray origin.
+        valid = (t1 > 0) & (t0.clip(min=0) < tmax)
+        entry = valid & (t0 > 0)
+        inf = torch.full_like(t0, float('inf'))
+        block_ts = torch.cat([torch.where(entry, t0, inf), torch.where(valid, t1, inf)], dim=1)
+        prim_ids = torch.arange(start, end, device=device).expand(num_rays, -1)
+        block_tris = torch.cat([2 * prim_ids + 1, 2 * prim_ids], dim=1)
+        block_drgb = drgb[start:end].expand(num_rays, -1, -1)
+        block_diracs = torch.cat([block_drgb, -block_drgb], dim=1)
+
+        ts = torch.cat([ts, block_ts], dim=1)
+        tris = torch.cat([tris, block_tris], dim=1)
+        diracs = torch.cat([diracs, block_diracs], dim=1)
+        k = min(max_pts, ts.shape[1])
+        ts, inds = torch.topk(ts, k, dim=1, largest=False, sorted=True)
+        tris = torch.gather(tris, 1, inds)
+        diracs = torch.gather(diracs, 1, inds[..., None].expand(-1, -1, 4))
+    tris = torch.where(torch.isinf(ts), -torch.ones_like(tris), tris)
+    return ts, tris, diracs
+
+
+def initial_drgb(origin, mean, scale, quat, drgb):
+    """Density and color of the primitives that contain each ray origin."""
+    Trayo = rotate_vector(origin[:, None] - mean[None], quat[None]) / scale.clip(min=1e-8)[None]
+    inside = ((Trayo * Trayo).sum(dim=-1) <= 1).float()
+    return inside @ drgb
+
+
+def trace_tile(origin, direction, mean, scale, quat, drgb, tmax, max_iters, prim_block_size,
+               log_cutoff=LOG_CUTOFF):
+    if torch.is_tensor(tmax):
+        tmax = tmax[:, None]
+    ts, tris, diracs = collect_ctrl_pts(
+        origin, direction, mean, scale, quat, drgb, tmax, max_iters, prim_block_size)
+    num_rays = origin.shape[0]
+    state = make_empty_state(num_rays, origin.device)
+    state['drgb'] = initial_drgb(origin, mean, scale, quat, drgb)
+    iters = torch.zeros((num_rays,), dtype=torch.int64, device=origin.device)
+    last_dirac = torch.zeros((num_rays, 4), device=origin.device)
+    for i in range(ts.shape[1]):
+        active = (tris[:, i] >= 0) & (state['logT'] < log_cutoff) & (iters < max_iters)
+        if not active.any():
+            break
+        new_state = update(state, ts[:, i].nan_to_num(posinf=0), diracs[:, i])
+        state = {
+            k: torch.where(active.reshape(-1, *([1] * (v.dim() - 1))), new_state[k], v)
+            for k, v in state.items()
+        }
+        last_dirac = torch.where(active[:, None], diracs[:, i], last_dirac)
+        iters = iters + active.long()
+    color, distortion_loss = extract_color(state)
+    used = torch.arange(ts.shape[1], device=origin.device)[None] < iters[:, None]
+    tris = torch.where(used, tris, torch.zeros_like(tris))
+    return dict(
+        color=color,
+        distortion_loss=distortion_loss,
+        states=pack_states(state),
+        diracs=last_dirac,
+        iters=iters,
+        tris=tris,
+    )
+
+
+def trace_rays(
+    mean: torch.Tensor,
+    scale: torch.Tensor,
+    quat: torch.Tensor,
+    density: torch.Tensor,
+    features: torch.Tensor,
+    rayo: torch.Tensor,
+    rayd: torch.Tensor,
+    tmin: float = 0.0,
+    tmax: float = 1000,
+    max_prim_size: float = 3,
+    dL_dmeans2D=None,
+    wcts=None,
+    max_iters: int = 500,
+    return_extras: bool = False,
+    num_threads: int = None,
+    tile_size: int = 256,
+    prim_block_size: int = 2048,
+    memory_budget: int = None,
+    min_transmittance: float = MIN_TRANSMITTANCE,
+):
+    """Drop-in replacement for fast_ellipsoid_splinetracer.trace_rays.
+
+    dL_dmeans2D and wcts are accepted for compatibility; screen space mean
+    gradients are only produced by the CUDA backward kernel. Rays stop once
+    their transmittance falls below min_transmittance (0 disables this).
+    tmin and tmax may be [R] tensors, see ray_bounds.py; tmax is clipped per
+    ray exactly here.
+    """
+    if torch.is_tensor(tmin) or (torch.is_tensor(tmax) and not bool((tmax > 0).all())):
+        return ray_bounds.trace_rays_bounded(
+            trace_rays, mean, scale, quat, density, features, rayo, rayd,
+            tmin, tmax, max_prim_size, dL_dmeans2D, wcts, max_iters=max_iters,
+            return_extras=return_extras, per_ray_tmax=True, num_threads=num_threads,
+            tile_size=tile_size, prim_block_size=prim_block_size, memory_budget=memory_budget,
+            min_transmittance=min_transmittance)
+    if memory_budget is not None:
+        return tiling.trace_rays_tiled(
+            trace_rays, mean, scale, quat, density, features, rayo, rayd,
+            tmin, tmax, max_prim_size, dL_dmeans2D, wcts, max_iters=max_iters,
+            return_extras=return_extras, memory_budget=memory_budget,
+            num_threads=num_threads, tile_size=tile_size, prim_block_size=prim_block_size,
+            min_transmittance=min_transmittance)
+    num_rays = rayo.shape[0]
+    num_prims = mean.shape[0]
+    device = rayo.device
+    num_threads = os.cpu_count() if num_threads is None else num_threads
+    log_cutoff = -math.log(min_transmittance) if min_transmittance > 0 else math.inf
+
+    direction = rayd / rayd.norm(dim=-1, keepdim=True).clip(min=TINY_VAL)
+    origin = rayo + tmin * rayd
+    quat = quat / quat.norm(dim=-1, keepdim=True)
+    color = SH_C0 * features[:, 0, :] + 0.5
+    density = density.reshape(-1, 1)
+    drgb = torch.cat([density, density * color], dim=1)
+
+    tiles = [(s, min(s + tile_size, num_rays)) for s in range(0, num_rays, tile_size)]
+    trace = lambda tile: trace_tile(
+        origin[tile[0]:tile[1]], direction[tile[0]:tile[1]], mean, scale, quat, drgb,
+        ray_bounds.ray_slice(tmax, slice(*tile)), max_iters, prim_block_size, log_cutoff)
+    with instrumentation.scope("cpu/trace"):
+        if num_threads > 1 and len(tiles) > 1:
+            with ThreadPoolExecutor(max_workers=num_threads) as pool:
+                outs = list(pool.map(trace, tiles))
+        else:
+            outs = [trace(tile) for tile in tiles]
+
+    cat = lambda key: torch.cat([out[key] for out in outs], dim=0)
+    if instrumentation.enabled():
+        instrumentation.count("rays", num_rays)
+        instrumentation.count("prims", num_prims)
+        instrumentation.count("iters", int(cat('iters').sum()))
+    color = cat('color')
+    distortion_loss = cat('distortion_loss')
+    color_and_loss = torch.cat([color, distortion_loss.reshape(-1, 1)], dim=1)
+    if not return_extras:
+        return color_and_loss
+
+    iters = cat('iters')
+    tri_collection = torch.zeros((max_iters, num_rays), dtype=torch.int32, device=device)
+    for (s, e), out in zip(tiles, outs):
+        tri_collection[:out['tris'].shape[1], s:e] = out['tris'].T.int()
+    steps = torch.arange(max_iters, device=device)[:, None] < iters[None]
+    touch_count = torch.bincount(
+        (tri_collection[steps] // 2).long(), minlength=num_prims).int()
+    instrumentation.histogram("touch_count", touch_count)
+    saved = SimpleNamespace(
+        states=cat('states').detach(),
+        diracs=cat('diracs').detach(),
+        iters=iters.int(),
+        touch_count=touch_count,
+    )
+    overflow = iter_budget.overflow_mask(iters, saved.states, max_iters, min_transmittance)
+    return color_and_loss, dict(
+        tri_collection=tri_collection.reshape(-1),
+        iters=saved.iters,
+        opacity=color[:, 3],
+        touch_count=touch_count,
+        distortion_loss=distortion_loss,
+        overflow=overflow,
+        num_overflow=overflow.sum(),
+        saved=saved,
+    )
+
+trace_rays.uses_density = True
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import time
+import math
 from pathlib import Path
 from typing import *
 
@@ -25,12 +25,28 @@ import sys
 sys.path.append(str(Path(__file__).parent))
 
 from build.splinetracer.extension import fast_ellipsoid_splinetracer_cpp_extension as sp
+from splinetracers.tracer_scene import ExtensionBuildBackend, TracerScene
+from splinetracers import tiling
+from splinetracers import hit_lists
+from splinetracers import iter_budget
+from splinetracers import instrumentation
+from splinetracers import ray_bounds
+from splinetracers.grad_arena import GradArena
 kernels = slangtorch.loadModule(
     str(Path(__file__).parent / "fast_ellipsoid_splinetracer/slang/backwards_kernel.slang"),
     includePaths=[str(Path(__file__).parent / 'slang')]
 )
 
 otx = sp.OptixContext(torch.device("cuda:0"))
+# Matches LOG_CUTOFF in Forward.h.
+MIN_TRANSMITTANCE = math.exp(-5.54)
+build_backend = ExtensionBuildBackend(sp, otx)
+grad_arena = GradArena()
+
+
+def make_scene(device: torch.device = torch.device("cuda:0")) -> TracerScene:
+    """Creates a scene that can be passed to trace_rays and reused across calls."""
+    return TracerScene(device, build_backend)
 
 
 # Inherit from Function
@@ -53,25 +69,27 @@ class SplineTracer(Function):
         wcts: torch.Tensor,
         max_iters: int,
         return_extras: bool = False,
+        scene: Optional[TracerScene] = None,
+        compact_hits: bool = False,
+        min_transmittance: float = MIN_TRANSMITTANCE,
     ):
         ctx.device = rayo.device
-        st = time.time()
-        ctx.prims = sp.Primitives(ctx.device)
         assert mean.device == ctx.device
-        mean = mean.contiguous()
-        scale = scale.contiguous()
-        density = density.contiguous()
-        quat = quat.contiguous()
-        color = color.contiguous()
-        half_attribs = torch.cat([mean, scale, quat], dim=1).half().contiguous()
-        ctx.prims.add_primitives(mean, scale, quat, half_attribs, density, color)
+        ctx.scene = make_scene(ctx.device) if scene is None else scene
+        with instrumentation.scope("forward/update_scene"):
+            ctx.scene.update(mean, scale, quat, density, color)
+        mean = ctx.scene.tensors['mean']
+        scale = ctx.scene.tensors['scale']
+        quat = ctx.scene.tensors['quat']
+        density = ctx.scene.tensors['density']
+        color = ctx.scene.tensors['features']
+        half_attribs = ctx.scene.half_attribs
 
-        ctx.gas = sp.GAS(otx, ctx.device, ctx.prims, True, False, True)
-
-        ctx.forward = sp.Forward(otx, ctx.device, ctx.prims, True)
-        st = time.time()
         ctx.max_iters = max_iters
-        out = ctx.forward.trace_rays(ctx.gas, rayo, rayd, tmin, tmax, ctx.max_iters, max_prim_size)
+        with instrumentation.scope("forward/trace"):
+            out = ctx.scene.trace_rays(
+                rayo, rayd, tmin, tmax, ctx.max_iters, max_prim_size, min_transmittance)
+        instrumentation.record_trace(rayo.shape[0], mean.shape[0], out["saved"])
         ctx.saved = out["saved"]
         ctx.max_prim_size = max_prim_size
         ctx.tmin = tmin
@@ -86,17 +104,29 @@ class SplineTracer(Function):
 
         initial_inds = out['initial_touch_inds'][:out['initial_touch_count'][0]]
 
+        # Either (tri_collection,) or (hit_offsets, hit_inds), see hit_lists.py.
+        ctx.compact_hits = compact_hits
+        if compact_hits:
+            with instrumentation.scope("forward/pack_hits"):
+                hits = hit_lists.pack(tri_collection, ctx.saved.iters, max_iters)
+        else:
+            hits = (tri_collection,)
+
         ctx.save_for_backward(
-            mean, scale, quat, density, color, rayo, rayd, tri_collection, wcts, out['initial_drgb'], initial_inds, half_attribs
+            mean, scale, quat, density, color, rayo, rayd, wcts, out['initial_drgb'], initial_inds, half_attribs, *hits
         )
 
         if return_extras:
+            overflow = iter_budget.overflow_mask(
+                ctx.saved.iters, ctx.saved.states, max_iters, min_transmittance)
             return color_and_loss, dict(
                 tri_collection=tri_collection,
                 iters=ctx.saved.iters,
                 opacity=out["color"][:, 3],
                 touch_count=ctx.saved.touch_count,
                 distortion_loss=distortion_loss,
+                overflow=overflow,
+                num_overflow=overflow.sum(),
                 saved=ctx.saved,
             )
         else:
@@ -112,103 +142,110 @@ class SplineTracer(Function):
             features,
             rayo,
             rayd,
-            tri_collection,
             wcts,
             initial_drgb,
             initial_inds,
-            half_attribs
+            half_attribs,
+            *hits
         ) = ctx.saved_tensors
         device = ctx.device
 
-        start_ids = torch.cumsum(ctx.saved.iters, dim=0).int()
         num_prims = mean.shape[0]
         num_rays = rayo.shape[0]
-        dL_dmeans = torch.zeros((num_prims, 3), dtype=torch.float32, device=device)
-        dL_dscales = torch.zeros((num_prims, 3), dtype=torch.float32, device=device)
-        dL_dquats = torch.zeros((num_prims, 4), dtype=torch.float32, device=device)
-        dL_ddensities = torch.zeros((num_prims), dtype=torch.float32, device=device)
-        dL_dfeatures = torch.zeros_like(features)
-        dL_drayo = torch.zeros((num_rays, 3), dtype=torch.float32, device=device)
-        dL_drayd = torch.zeros((num_rays, 3), dtype=torch.float32, device=device)
+        with instrumentation.scope("backward/acquire_grads"):
+            grads = grad_arena.acquire(num_prims, num_rays, features.shape, device)
+        dL_dmeans = grads.dL_dmeans
+        dL_dscales = grads.dL_dscales
+        dL_dquats = grads.dL_dquats
+        dL_ddensities = grads.dL_ddensities
+        dL_dfeatures = grads.dL_dfeatures
+        dL_drayo = grads.dL_drayo
+        dL_drayd = grads.dL_drayd
 
-        dL_dmeans2D = torch.zeros((num_prims, 2), dtype=torch.float32, device=device)
+        dL_dmeans2D = grads.dL_dmeans2D
 
-        touch_count = torch.zeros((num_prims), dtype=torch.int32, device=device)
+        touch_count = grads.touch_count
 
-        dL_dinital_drgb = torch.zeros((num_rays, 4), dtype=torch.float32, device=device)
+        dL_dinital_drgb = grads.dL_dinital_drgb
 
         block_size = 16
-        st = time.time()
-        if ctx.saved.iters.sum() > 0:
+        with instrumentation.scope("backward/kernels"):
+            if ctx.saved.iters.sum() > 0:
 
-            dual_model = (
-                mean,
-                scale,
-                quat,
-                density,
-                features,
+                dual_model = (
+                    mean,
+                    scale,
+                    quat,
+                    density,
+                    features,
 
-                dL_dmeans,
-                dL_dscales,
-                dL_dquats,
-                dL_ddensities,
-                dL_dfeatures,
-                dL_drayo,
-                dL_drayd,
-                dL_dmeans2D,
-            )
+                    dL_dmeans,
+                    dL_dscales,
+                    dL_dquats,
+                    dL_ddensities,
+                    dL_dfeatures,
+                    dL_drayo,
+                    dL_drayd,
+                    dL_dmeans2D,
+                )
 
-            kernels.backwards_kernel(
-                last_state=ctx.saved.states,
-                last_dirac=ctx.saved.diracs,
-                iters=ctx.saved.iters,
-                tri_collection=tri_collection,
-                ray_origins=rayo,
-                ray_directions=rayd,
-                model=dual_model,
-                initial_drgb=initial_drgb,
-                dL_dinital_drgb=dL_dinital_drgb,
-                touch_count=touch_count,
-                dL_doutputs=grad_output.contiguous(),
-                wcts=wcts if wcts is not None else torch.ones((1, 4, 4), device=device, dtype=torch.float32),
-                tmin=ctx.tmin,
-                tmax=ctx.tmax,
-                max_prim_size=ctx.max_prim_size,
-                max_iters=ctx.max_iters,
-            ).launchRaw(
-                blockSize=(block_size, 1, 1),
-                gridSize=(num_rays // block_size + 1, 1, 1),
-            )
-            if initial_inds.shape[0] > 0:
-                ray_block_size = 64;
-                second_block_size = 16;
-                kernels.backwards_initial_drgb_kernel(
+                if ctx.compact_hits:
+                    backwards_kernel = kernels.backwards_compact_kernel
+                    hit_kwargs = dict(hit_offsets=hits[0], hit_inds=hits[1])
+                else:
+                    backwards_kernel = kernels.backwards_kernel
+                    hit_kwargs = dict(tri_collection=hits[0])
+                backwards_kernel(
+                    last_state=ctx.saved.states,
+                    last_dirac=ctx.saved.diracs,
+                    iters=ctx.saved.iters,
+                    **hit_kwargs,
                     ray_origins=rayo,
                     ray_directions=rayd,
                     model=dual_model,
                     initial_drgb=initial_drgb,
-                    initial_inds=initial_inds,
                     dL_dinital_drgb=dL_dinital_drgb,
                     touch_count=touch_count,
+                    dL_doutputs=grad_output.contiguous(),
+                    wcts=wcts if wcts is not None else torch.ones((1, 4, 4), device=device, dtype=torch.float32),
                     tmin=ctx.tmin,
+                    tmax=ctx.tmax,
+                    max_prim_size=ctx.max_prim_size,
+                    max_iters=ctx.max_iters,
                 ).launchRaw(
-                    blockSize=(ray_block_size, second_block_size, 1),
-                    gridSize=(
-                        rayo.shape[0] // ray_block_size + 1,
-                        initial_inds.shape[0] // second_block_size + 1,
-                        1),
+                    blockSize=(block_size, 1, 1),
+                    gridSize=(num_rays // block_size + 1, 1, 1),
                 )
-        v = 1e+3
-        mean_v = 1e+3
+                if initial_inds.shape[0] > 0:
+                    ray_block_size = 64;
+                    second_block_size = 16;
+                    kernels.backwards_initial_drgb_kernel(
+                        ray_origins=rayo,
+                        ray_directions=rayd,
+                        model=dual_model,
+                        initial_drgb=initial_drgb,
+                        initial_inds=initial_inds,
+                        dL_dinital_drgb=dL_dinital_drgb,
+                        touch_count=touch_count,
+                        tmin=ctx.tmin,
+                    ).launchRaw(
+                        blockSize=(ray_block_size, second_block_size, 1),
+                        gridSize=(
+                            rayo.shape[0] // ray_block_size + 1,
+                            initial_inds.shape[0] // second_block_size + 1,
+                            1),
+                    )
+        with instrumentation.scope("backward/clip"):
+            grads.clip_()
         dL_dmeans2D = None if wcts is None else dL_dmeans2D
         return (
-            dL_dmeans.clip(min=-mean_v, max=mean_v),
-            dL_dscales.clip(min=-v, max=v),
-            dL_dquats.clip(min=-v, max=v),
-            dL_ddensities.clip(min=-50, max=50).reshape(density.shape),
-            dL_dfeatures.clip(min=-v, max=v),
-            dL_drayo.clip(min=-v, max=v),
-            dL_drayd.clip(min=-v, max=v),
+            dL_dmeans,
+            dL_dscales,
+            dL_dquats,
+            dL_ddensities.reshape(density.shape),
+            dL_dfeatures,
+            dL_drayo,
+            dL_drayd,
             None,
             None,
             None,
@@ -216,6 +253,9 @@ class SplineTracer(Function):
             None,
             None,
             None,
+            None,
+            None,
+            None,
         )
 
 
@@ -234,7 +274,34 @@ def trace_rays(
     wcts=None,
     max_iters: int = 500,
     return_extras: bool = False,
+    scene: Optional[TracerScene] = None,
+    memory_budget: Optional[int] = None,
+    compact_hits: bool = False,
+    min_transmittance: float = MIN_TRANSMITTANCE,
 ):
+    """Traces rays through the ellipsoids.
+
+    Passing a scene from make_scene lets repeated calls reuse the acceleration
+    structure and pipeline while the primitives are unchanged. With a
+    memory_budget (bytes) the rays are traced in tiles, see tiling.py. With
+    compact_hits the hit lists kept for backward are stored compactly, see
+    hit_lists.py. Rays stop accumulating once their transmittance drops
+    below min_transmittance; 0 only stops at max_iters or the last hit.
+    tmin and tmax may be [R] tensors: rays with tmax <= 0 are skipped and
+    the others are traced in one launch, see ray_bounds.py.
+    """
+    if ray_bounds.is_per_ray(tmin, tmax):
+        return ray_bounds.trace_rays_bounded(
+            trace_rays, mean, scale, quat, density, features, rayo, rayd,
+            tmin, tmax, max_prim_size, dL_dmeans2D, wcts, max_iters=max_iters,
+            return_extras=return_extras, scene=scene, memory_budget=memory_budget,
+            compact_hits=compact_hits, min_transmittance=min_transmittance)
+    if memory_budget is not None:
+        return tiling.trace_rays_tiled(
+            trace_rays, mean, scale, quat, density, features, rayo, rayd,
+            tmin, tmax, max_prim_size, dL_dmeans2D, wcts, max_iters=max_iters,
+            return_extras=return_extras, memory_budget=memory_budget, scene=scene,
+            compact_hits=compact_hits, min_transmittance=min_transmittance)
     out = SplineTracer.apply(
         mean,
         scale,
@@ -250,6 +317,9 @@ def trace_rays(
         wcts,
         max_iters,
         return_extras,
+        scene,
+        compact_hits,
+        min_transmittance,
     )
     return out
 
@@ -31,7 +31,8 @@ void Forward::trace_rays(
     uint *iters, uint *last_face,
     uint *touch_count,
     float4 *last_dirac, SplineState *last_state,
-    int *tri_collection, int *d_touch_count, int *d_touch_inds) {
+    int *tri_collection, int *d_touch_count, int *d_touch_inds,
+    const float log_cutoff) {
   CUDA_CHECK(cudaSetDevice(device));
   {
     params.fimage.data = (float4 *)image_out;
@@ -48,6 +49,7 @@ void Forward::trace_rays(
     params.touch_count.data = touch_count;
     params.sh_degree = sh_deg;
     params.max_prim_size = max_prim_size;
+    params.log_cutoff = log_cutoff;
     params.max_iters = max_iters;
     params.ray_origins.data = ray_origins;
     params.ray_origins.size = num_rays;
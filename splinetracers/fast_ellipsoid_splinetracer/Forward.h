@@ -25,6 +25,9 @@
 #include <vector>
 #include "structs.h"
 
+// Default early termination threshold on -log(transmittance).
+#define LOG_CUTOFF 5.54f
+
 extern unsigned char ptx_code_file[];
 extern unsigned char ptx_code_file2[];
 extern unsigned char fast_ptx_code_file[];
@@ -72,6 +75,7 @@ struct Params
     float tmax;
     StructuredBuffer<float4> initial_drgb;
     float max_prim_size;
+    float log_cutoff;
     OptixTraversableHandle handle;
 };
 
@@ -103,7 +107,8 @@ class Forward {
                     SplineState *last_state=NULL,
                     int *tri_collection=NULL,
                     int *d_touch_count=NULL,
-                    int *d_touch_inds=NULL);
+                    int *d_touch_inds=NULL,
+                    const float log_cutoff=LOG_CUTOFF);
    void reset_features(const Primitives &model);
    bool enable_backward = false;
    size_t num_prims = 0;
@@ -210,7 +210,8 @@ public:
   py::dict trace_rays(const fesPyGas &gas, const torch::Tensor &ray_origins,
                       const torch::Tensor &ray_directions, float tmin,
                       float tmax, const size_t max_iters,
-                      const float max_prim_size) {
+                      const float max_prim_size,
+                      const float min_transmittance) {
     torch::AutoGradMode enable_grad(false);
     CHECK_FLOAT_DIM3(ray_origins);
     CHECK_FLOAT_DIM3(ray_directions);
@@ -248,7 +249,8 @@ public:
                        saved_for_backward.states_data_ptr(),
                        reinterpret_cast<int *>(tri_collection.data_ptr()),
                        reinterpret_cast<int *>(initial_touch_count.data_ptr()),
-                       reinterpret_cast<int *>(initial_touch_inds.data_ptr()));
+                       reinterpret_cast<int *>(initial_touch_inds.data_ptr()),
+                       min_transmittance > 0 ? -logf(min_transmittance) : INFINITY);
     return py::dict("color"_a = color,
                     "saved"_a = saved_for_backward,
                     "tri_collection"_a = tri_collection,
@@ -277,6 +279,8 @@ PYBIND11_MODULE(fast_ellipsoid_splinetracer_cpp_extension, m) {
   py::class_<fesPyForward>(m, "Forward")
       .def(py::init<const fesOptixContext &, const torch::Device &,
                     const fesPyPrimitives &, const bool>())
-      .def("trace_rays", &fesPyForward::trace_rays)
+      .def("trace_rays", &fesPyForward::trace_rays, "gas"_a, "ray_origins"_a,
+           "ray_directions"_a, "tmin"_a, "tmax"_a, "max_iters"_a,
+           "max_prim_size"_a, "min_transmittance"_a = expf(-LOG_CUTOFF))
       .def("update_model", &fesPyForward::update_model);
 }
@@ -0,0 +1,104 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reusable gradient buffers for SplineTracer.backward.
+
+Buffers are keyed by (num_prims, num_rays, feature shape, device) and zeroed
+and clipped in place, instead of allocating them for every backward pass.
+
+The gradients handed back to autograd can outlive the backward call, e.g.
+while autograd sums the gradients of several tiles, or when a view ends up
+as a parameter's .grad. A set of buffers is therefore only reused once no
+one else holds on to its storage; otherwise another set is allocated.
+"""
+
+import collections
+from types import SimpleNamespace
+from typing import *
+
+import torch
+
+# Limits applied to the gradients before they are returned.
+MEAN_GRAD_LIMIT = 1e3
+DENSITY_GRAD_LIMIT = 50
+GRAD_LIMIT = 1e3
+
+
+def storage_refs(t: torch.Tensor) -> int:
+    return torch._C._storage_Use_Count(t.untyped_storage()._cdata)
+
+
+class GradBuffers(SimpleNamespace):
+    def tensors(self) -> List[torch.Tensor]:
+        return [v for k, v in vars(self).items() if not k.startswith('_')]
+
+    def in_use(self) -> bool:
+        return any(storage_refs(t) > refs for t, refs in zip(self.tensors(), self._refs))
+
+    def zero_(self):
+        torch._foreach_zero_(self.tensors())
+        return self
+
+    def clip_(self):
+        self.dL_dmeans.clip_(min=-MEAN_GRAD_LIMIT, max=MEAN_GRAD_LIMIT)
+        self.dL_ddensities.clip_(min=-DENSITY_GRAD_LIMIT, max=DENSITY_GRAD_LIMIT)
+        for t in [self.dL_dscales, self.dL_dquats, self.dL_dfeatures, self.dL_drayo, self.dL_drayd]:
+            t.clip_(min=-GRAD_LIMIT, max=GRAD_LIMIT)
+        return self
+
+
+def allocate(num_prims: int, num_rays: int, feature_shape: Tuple[int, ...], device) -> GradBuffers:
+    zeros = lambda *shape, dtype=torch.float32: torch.zeros(shape, dtype=dtype, device=device)
+    buffers = GradBuffers(
+        dL_dmeans=zeros(num_prims, 3),
+        dL_dscales=zeros(num_prims, 3),
+        dL_dquats=zeros(num_prims, 4),
+        dL_ddensities=zeros(num_prims),
+        dL_dfeatures=zeros(*feature_shape),
+        dL_drayo=zeros(num_rays, 3),
+        dL_drayd=zeros(num_rays, 3),
+        dL_dmeans2D=zeros(num_prims, 2),
+        touch_count=zeros(num_prims, dtype=torch.int32),
+        dL_dinital_drgb=zeros(num_rays, 4),
+    )
+    buffers._refs = [storage_refs(t) for t in buffers.tensors()]
+    return buffers
+
+
+class GradArena:
+    def __init__(self, max_keys: int = 4, max_sets_per_key: int = 2):
+        self.max_keys = max_keys
+        self.max_sets_per_key = max_sets_per_key
+        self.pools = collections.OrderedDict()
+        self.num_allocations = 0
+
+    def acquire(self, num_prims: int, num_rays: int, feature_shape, device) -> GradBuffers:
+        """Returns zeroed buffers that are not referenced anywhere else."""
+        key = (num_prims, num_rays, tuple(feature_shape), torch.device(device))
+        pool = self.pools.setdefault(key, [])
+        self.pools.move_to_end(key)
+        while len(self.pools) > self.max_keys:
+            self.pools.popitem(last=False)
+
+        for buffers in pool:
+            if not buffers.in_use():
+                return buffers.zero_()
+        self.num_allocations += 1
+        buffers = allocate(*key)
+        if len(pool) < self.max_sets_per_key:
+            pool.append(buffers)
+        return buffers
+
+    def clear(self):
+        self.pools.clear()
@@ -0,0 +1,51 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact (CSR) storage of the per ray hit lists saved for backward.
+
+The forward pass writes tri_collection densely as [max_iters, num_rays]
+(iteration major), padded to max_iters for every ray. Most rays stop well
+before that, so for backward the hits are repacked ray by ray into a flat
+array of iters.sum() entries, with hit_offsets[r] pointing at the first hit of
+ray r and hit_offsets[-1] == len(hit_inds).
+"""
+
+from typing import *
+
+import torch
+
+
+def hit_offsets(iters: torch.Tensor, max_iters: int) -> torch.Tensor:
+    counts = iters.long().clamp(0, max_iters)
+    return torch.cat([counts.new_zeros(1), torch.cumsum(counts, dim=0)]).int()
+
+
+def pack(tri_collection: torch.Tensor, iters: torch.Tensor, max_iters: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns (hit_offsets [num_rays + 1], hit_inds [iters.sum()]) for a dense tri_collection."""
+    num_rays = iters.shape[0]
+    dense = tri_collection.reshape(max_iters, num_rays).T
+    valid = torch.arange(max_iters, device=iters.device)[None, :] < iters.long()[:, None]
+    return hit_offsets(iters, max_iters), dense[valid].int()
+
+
+def unpack(hit_offsets: torch.Tensor, hit_inds: torch.Tensor, max_iters: int, fill_value: int = 0) -> torch.Tensor:
+    """Inverse of pack, padding unused iterations with fill_value."""
+    num_rays = hit_offsets.shape[0] - 1
+    offsets = hit_offsets.long()
+    counts = offsets[1:] - offsets[:-1]
+    dense = torch.full((num_rays, max_iters), fill_value, dtype=torch.int32, device=hit_inds.device)
+    valid = torch.arange(max_iters, device=hit_inds.device)[None, :] < counts[:, None]
+    dense[valid] = hit_inds.int()
+    return dense.T.reshape(-1)
+
@@ -0,0 +1,205 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in stage timers and counters for the tracer and renderers.
+
+Instrumented code calls
+
+    with instrumentation.scope("forward/trace"):
+        ...
+    instrumentation.count("rays", num_rays)
+
+which do nothing (a shared null context and an early return) unless a
+Recorder is active:
+
+    with instrumentation.recording() as rec:
+        render(...)
+    rec.to_dict()          # per scope totals, counters and histograms
+    rec.to_chrome_trace()  # for chrome://tracing or Perfetto
+
+Scopes are timed with CUDA events when CUDA is available, so recording does
+not synchronize the device; events are resolved when exporting. Otherwise
+time.perf_counter is used. Counter and histogram values may be tensors and
+are only copied to the host on export.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import *
+
+import torch
+
+_NULL_SCOPE = contextlib.nullcontext()
+_recorder = None
+
+
+def bucket_label(i: int) -> str:
+    if i < 2:
+        return str(i)
+    return f"{2**(i-1)}-{2**i - 1}"
+
+
+class Recorder:
+    def __init__(self, use_cuda_events: Optional[bool] = None):
+        if use_cuda_events is None:
+            use_cuda_events = torch.cuda.is_available()
+        self.use_cuda_events = use_cuda_events
+        self.spans = []
+        self.counters = defaultdict(int)
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        if use_cuda_events:
+            self.start_event = torch.cuda.Event(enable_timing=True)
+            self.start_event.record()
+
+    def now(self):
+        if self.use_cuda_events:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def elapsed_ms(self, mark) -> float:
+        """Milliseconds from the start of the recording to mark."""
+        if self.use_cuda_events:
+            mark.synchronize()
+            return self.start_event.elapsed_time(mark)
+        return 1000 * (mark - self.start_time)
+
+    @contextlib.contextmanager
+    def scope(self, name: str):
+        start = self.now()
+        try:
+            yield
+        finally:
+            end = self.now()
+            with self.lock:
+                self.spans.append((name, start, end, threading.get_ident()))
+
+    def count(self, name: str, value=1):
+        with self.lock:
+            self.counters[name] = self.counters[name] + value
+
+    def histogram(self, name: str, values: torch.Tensor):
+        """Adds values to a histogram with power of two buckets [0], [1], [2, 3], [4, 7], ..."""
+        values = values.detach().float().reshape(-1).clip(min=0)
+        buckets = torch.where(values >= 1, torch.floor(torch.log2(values.clip(min=1))) + 1, 0).long()
+        counts = torch.bincount(buckets, minlength=1)
+        with self.lock:
+            old = self.histograms.get(name)
+            if old is not None:
+                size = max(old.shape[0], counts.shape[0])
+                pad = lambda c: torch.nn.functional.pad(c, (0, size - c.shape[0]))
+                counts = pad(old) + pad(counts).to(old.device)
+            self.histograms[name] = counts
+
+    def resolved_spans(self) -> List[Tuple[str, float, float, int]]:
+        return [(name, self.elapsed_ms(start), self.elapsed_ms(end), tid)
+                for name, start, end, tid in self.spans]
+
+    def to_dict(self) -> Dict[str, Any]:
+        scopes = {}
+        for name, start, end, _ in self.resolved_spans():
+            s = scopes.setdefault(name, dict(count=0, total_ms=0.0))
+            s["count"] += 1
+            s["total_ms"] += end - start
+        for s in scopes.values():
+            s["mean_ms"] = s["total_ms"] / s["count"]
+        as_number = lambda v: v.item() if isinstance(v, torch.Tensor) else v
+        histograms = {}
+        for name, counts in self.histograms.items():
+            histograms[name] = {
+                bucket_label(i): int(c)
+                for i, c in enumerate(counts.tolist())
+            }
+        return dict(
+            scopes=scopes,
+            counters={k: as_number(v) for k, v in self.counters.items()},
+            histograms=histograms,
+        )
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Complete ("X") events in the Chrome trace event format, in microseconds."""
+        pid = os.getpid()
+        events = [
+            dict(name=name, ph="X", ts=1000 * start, dur=1000 * (end - start), pid=pid, tid=tid,
+                 cat="cuda" if self.use_cuda_events else "cpu")
+            for name, start, end, tid in self.resolved_spans()
+        ]
+        counters = self.to_dict()["counters"]
+        if counters:
+            events.append(dict(name="counters", ph="C", ts=events[-1]["ts"] if events else 0,
+                               pid=pid, args=counters))
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def write_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+def enabled() -> bool:
+    return _recorder is not None
+
+
+def enable(use_cuda_events: Optional[bool] = None) -> Recorder:
+    global _recorder
+    _recorder = Recorder(use_cuda_events)
+    return _recorder
+
+
+def disable() -> Optional[Recorder]:
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+@contextlib.contextmanager
+def recording(use_cuda_events: Optional[bool] = None):
+    global _recorder
+    previous = _recorder
+    recorder = enable(use_cuda_events)
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+
+
+def scope(name: str):
+    if _recorder is None:
+        return _NULL_SCOPE
+    return _recorder.scope(name)
+
+
+def count(name: str, value=1):
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def histogram(name: str, values: torch.Tensor):
+    if _recorder is not None:
+        _recorder.histogram(name, values)
+
+
+def record_trace(num_rays: int, num_prims: int, saved):
+    """Counts the rays, primitives and iterations of a trace launch and histograms its touch_count."""
+    if _recorder is not None:
+        _recorder.count("rays", num_rays)
+        _recorder.count("prims", num_prims)
+        _recorder.count("iters", saved.iters.sum())
+        _recorder.histogram("touch_count", saved.touch_count)
@@ -0,0 +1,192 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Detects rays truncated by max_iters and picks max_iters adaptively.
+
+A ray stops when its transmittance drops below min_transmittance, when it
+runs out of hits, or when it has used max_iters iterations. Only the last
+case loses quality, and it is recognized by iters == max_iters while the
+saved logT is still below the cutoff. A ray that happened to have exactly
+max_iters hits is reported as well, which only costs a redundant re-trace.
+
+AdaptiveMaxIters picks the cap for the next frame from the iters of the
+previous one, and trace_rays_adaptive re-traces the rays that overflowed
+it with a higher cap, so a low cap can be used without truncating rays.
+"""
+
+import math
+from typing import *
+
+import torch
+
+from splinetracers import ray_bounds
+
+# Index of logT in the SplineState struct (structs.h).
+LOGT_STATE_INDEX = 12
+
+
+def log_cutoff(min_transmittance: float) -> float:
+    return -math.log(min_transmittance) if min_transmittance > 0 else math.inf
+
+
+def overflow_mask(iters: torch.Tensor, states: torch.Tensor, max_iters: int,
+                  min_transmittance: float) -> torch.Tensor:
+    """Returns a bool mask of the rays that were cut off by max_iters."""
+    logT = states.reshape(iters.shape[0], -1)[:, LOGT_STATE_INDEX]
+    return (iters.long() >= max_iters) & (logT < log_cutoff(min_transmittance))
+
+
+def round_up(x: int, alignment: int) -> int:
+    return (x + alignment - 1) // alignment * alignment
+
+
+class AdaptiveMaxIters:
+    """Chooses max_iters from the iters distribution of the previous frame.
+
+    max_iters is set to the given quantile of the previous iters times
+    headroom, rounded up to a multiple of alignment and clipped to
+    [min_iters, max_iters_limit]. Rays beyond it are re-traced with
+    retrace_max_iters, see trace_rays_adaptive.
+    """
+
+    def __init__(self,
+                 initial_max_iters: int = 128,
+                 min_iters: int = 16,
+                 max_iters_limit: int = 1024,
+                 quantile: float = 0.99,
+                 headroom: float = 1.25,
+                 alignment: int = 16):
+        self.min_iters = min_iters
+        self.max_iters_limit = max_iters_limit
+        self.quantile = quantile
+        self.headroom = headroom
+        self.alignment = alignment
+        self.max_iters = self.clip(initial_max_iters)
+
+    @property
+    def retrace_max_iters(self) -> int:
+        return self.max_iters_limit
+
+    def clip(self, max_iters: int) -> int:
+        return int(min(max(round_up(max_iters, self.alignment), self.min_iters), self.max_iters_limit))
+
+    def update(self, iters: torch.Tensor) -> int:
+        """Sets max_iters for the next frame from this frame's (uncapped) iters."""
+        if iters.numel() > 0:
+            q = torch.quantile(iters.float().reshape(-1), self.quantile)
+            self.max_iters = self.clip(math.ceil(float(q) * self.headroom))
+        return self.max_iters
+
+
+def scatter_rows(x: torch.Tensor, inds: torch.Tensor, rows: torch.Tensor) -> torch.Tensor:
+    """Returns a copy of x with x[inds] = rows, differentiable in both."""
+    return x.index_copy(0, inds, rows.to(x.dtype))
+
+
+def first_pass_hits(extras, inds, max_iters):
+    """The tri_collection entries [max_iters, len(inds)] of the rays inds (sorted).
+
+    Tiled extras (see tiling.stitch_extras) are read tile by tile, without
+    stitching the full buffer.
+    """
+    if 'tri_collection' in extras:
+        num_rays = extras['iters'].shape[0]
+        return extras['tri_collection'].reshape(max_iters, num_rays)[:, inds]
+    if 'tile_tri_collections' not in extras:
+        raise ValueError("extras hold neither tri_collection nor tile_tri_collections.")
+    if 'traced_inds' in extras:
+        # The tiles of ray_bounds.trace_rays_bounded only hold the traced rays.
+        traced_inds = extras['traced_inds']
+        columns = torch.full_like(extras['iters'], -1, dtype=torch.long)
+        columns[traced_inds] = torch.arange(traced_inds.shape[0], device=traced_inds.device)
+        inds = columns[inds]
+    hits = []
+    for (s, e), tri_collection in zip(extras['tiles'], extras['tile_tri_collections']):
+        tile_inds = inds[(inds >= s) & (inds < e)] - s
+        hits.append(tri_collection.reshape(max_iters, e - s)[:, tile_inds])
+    return torch.cat(hits, dim=1)
+
+
+def hit_count(hits: torch.Tensor, touch_count: torch.Tensor) -> torch.Tensor:
+    """Per primitive number of tri_collection entries in hits, like touch_count."""
+    return torch.bincount(
+        (hits.reshape(-1) // 2).long(), minlength=touch_count.shape[0]).to(touch_count.dtype)
+
+
+def merge_extras(extras, retrace_extras, inds, max_iters):
+    """Overwrites the per ray extras of the re-traced rays.
+
+    tri_collection and saved still describe the first pass; the re-traced
+    rays are listed in retrace_inds and their hits in retrace_extras.
+    """
+    merged = dict(extras)
+    for key in ['iters', 'opacity', 'distortion_loss']:
+        merged[key] = scatter_rows(extras[key], inds, retrace_extras[key])
+    merged['overflow'] = scatter_rows(extras['overflow'], inds, retrace_extras['overflow'])
+    merged['num_overflow'] = merged['overflow'].sum()
+    touch_count = extras['touch_count'] + retrace_extras['touch_count']
+    # The first pass hits of the re-traced rays are counted again in the re-trace.
+    if 'tri_collection' in extras or 'tile_tri_collections' in extras:
+        touch_count = touch_count - hit_count(first_pass_hits(extras, inds, max_iters), touch_count)
+    elif 'overflow_touch_count' in extras:
+        # Tiles without their tri_collection, inds are the overflowed rays.
+        touch_count = touch_count - extras['overflow_touch_count']
+    else:
+        raise ValueError("extras hold neither tri_collection nor overflow_touch_count.")
+    # The first pass hits are stale once its overflowed rays are replaced.
+    merged.pop('overflow_touch_count', None)
+    merged['touch_count'] = touch_count
+    merged['retrace_inds'] = inds
+    merged['retrace_extras'] = retrace_extras
+    return merged
+
+
+def trace_rays_adaptive(
+    trace_rays: Callable,
+    mean: torch.Tensor,
+    scale: torch.Tensor,
+    quat: torch.Tensor,
+    density: torch.Tensor,
+    features: torch.Tensor,
+    rayo: torch.Tensor,
+    rayd: torch.Tensor,
+    tmin: float = 0.0,
+    tmax: float = 1000,
+    max_prim_size: float = 3,
+    dL_dmeans2D=None,
+    wcts=None,
+    max_iters: int = 128,
+    retrace_max_iters: int = 1024,
+    return_extras: bool = False,
+    **kwargs,
+):
+    """Traces with max_iters, then re-traces the overflowed rays with retrace_max_iters.
+
+    Gradients flow through both passes; the first pass contributes nothing
+    for the rays that were replaced by their re-trace.
+    """
+    out, extras = trace_rays(
+        mean, scale, quat, density, features, rayo, rayd, tmin, tmax, max_prim_size,
+        dL_dmeans2D, wcts, max_iters=max_iters, return_extras=True, **kwargs)
+    inds = extras['overflow'].nonzero()[:, 0]
+    if inds.numel() > 0 and retrace_max_iters > max_iters:
+        retrace_out, retrace_extras = trace_rays(
+            mean, scale, quat, density, features, rayo[inds], rayd[inds],
+            ray_bounds.ray_slice(tmin, inds), ray_bounds.ray_slice(tmax, inds), max_prim_size,
+            dL_dmeans2D, wcts, max_iters=retrace_max_iters, return_extras=True, **kwargs)
+        out = scatter_rows(out, inds, retrace_out)
+        extras = merge_extras(extras, retrace_extras, inds, max_iters)
+    if not return_extras:
+        return out
+    return out, extras
@@ -0,0 +1,137 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Renders several views of one scene with as few trace launches as possible.
+
+The rays of all views are generated with a single batched rotation and
+concatenated. Colors are view dependent, so views are grouped by a feature
+key (e.g. the camera center, or None when the colors do not depend on the
+view) and each group is traced with its own features in one launch, split
+further only when it exceeds the memory budget (see tiling.plan_tiles).
+
+The trace object only needs the Primitives / GAS / Forward interface of the
+extension, so tracer_scene.PyPrimitives, PyGAS and PyForward can be used to
+run the same code on the CPU.
+"""
+
+import collections
+from typing import *
+
+import torch
+
+from splinetracers import instrumentation
+from splinetracers import iter_budget
+from splinetracers import tiling
+from splinetracers.cpu_ellipsoid_splinetracer import MIN_TRANSMITTANCE
+
+
+def stack_rays(directions: torch.Tensor, c2ws: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Rotates camera space directions into every view.
+
+    directions is [..., 3] (shared by all views) and c2ws is [V, 3 or 4, 4].
+    Returns rayo and rayd of shape [V * P, 3], view by view.
+    """
+    directions = directions.reshape(-1, 3)
+    rayd = torch.matmul(directions[None], c2ws[:, :3, :3].transpose(1, 2))
+    rayo = c2ws[:, None, :3, 3].expand(rayd.shape)
+    return rayo.reshape(-1, 3).contiguous(), rayd.reshape(-1, 3).contiguous()
+
+
+def group_views(feature_keys: Sequence[Hashable]) -> List[List[int]]:
+    """Groups view indices with equal feature keys, in order of first use."""
+    groups = collections.OrderedDict()
+    for i, key in enumerate(feature_keys):
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+
+class ForwardTrace:
+    """Traces rays with given features through extension style objects.
+
+    With retrace_max_iters, rays that overflow max_iters are traced again
+    with the higher cap, like iter_budget.trace_rays_adaptive.
+    """
+
+    def __init__(self, prims, gas, forward, tmin: float, tmax: float, max_iters: int,
+                 max_prim_size: float = 1000, min_transmittance: float = MIN_TRANSMITTANCE,
+                 retrace_max_iters: Optional[int] = None):
+        self.prims = prims
+        self.gas = gas
+        self.forward = forward
+        self.tmin = tmin
+        self.tmax = tmax
+        self.max_iters = max_iters
+        self.max_prim_size = max_prim_size
+        self.min_transmittance = min_transmittance
+        self.retrace_max_iters = retrace_max_iters
+        self.num_launches = 0
+        self.num_overflow = 0
+
+    def set_features(self, features: torch.Tensor):
+        self.prims.set_features(features)
+        self.forward.update_model(self.prims)
+
+    def launch(self, rayo, rayd, max_iters):
+        self.num_launches += 1
+        with instrumentation.scope("forward/trace"):
+            out = self.forward.trace_rays(
+                self.gas, rayo, rayd, self.tmin, self.tmax, max_iters, self.max_prim_size,
+                self.min_transmittance)
+        instrumentation.record_trace(rayo.shape[0], out['saved'].touch_count.shape[0], out['saved'])
+        overflow = iter_budget.overflow_mask(
+            out['saved'].iters, out['saved'].states, max_iters, self.min_transmittance)
+        return out['color'], overflow
+
+    def __call__(self, rayo: torch.Tensor, rayd: torch.Tensor) -> torch.Tensor:
+        color, overflow = self.launch(rayo, rayd, self.max_iters)
+        if self.retrace_max_iters is not None and self.retrace_max_iters > self.max_iters:
+            inds = overflow.nonzero()[:, 0]
+            if inds.numel() > 0:
+                color[inds], overflow = self.launch(
+                    rayo[inds].contiguous(), rayd[inds].contiguous(), self.retrace_max_iters)
+        self.num_overflow += int(overflow.sum())
+        return color
+
+
+def render_many(
+    trace: ForwardTrace,
+    directions: torch.Tensor,
+    c2ws: torch.Tensor,
+    feature_keys: Sequence[Hashable],
+    get_features: Callable[[int], torch.Tensor],
+    memory_budget: Optional[int] = None,
+) -> torch.Tensor:
+    """Returns the [V, P, 4] colors of V views sharing the same camera directions.
+
+    get_features(i) is called once per group of views with equal
+    feature_keys, with i the first view of the group.
+    """
+    num_views = c2ws.shape[0]
+    assert len(feature_keys) == num_views
+    num_pixels = directions.reshape(-1, 3).shape[0]
+    rayo, rayd = stack_rays(directions, c2ws)
+    color = torch.empty((num_views, num_pixels, 4), dtype=torch.float32, device=rayo.device)
+    rayo = rayo.reshape(num_views, num_pixels, 3)
+    rayd = rayd.reshape(num_views, num_pixels, 3)
+    for group in group_views(feature_keys):
+        trace.set_features(get_features(group[0]))
+        inds = torch.tensor(group, device=rayo.device)
+        group_rayo = rayo[inds].reshape(-1, 3)
+        group_rayd = rayd[inds].reshape(-1, 3)
+        group_color = torch.cat([
+            trace(group_rayo[s:e].contiguous(), group_rayd[s:e].contiguous())
+            for s, e in tiling.plan_tiles(group_rayo.shape[0], trace.max_iters, memory_budget)
+        ], dim=0)
+        color[inds] = group_color.reshape(len(group), num_pixels, -1)[..., :4]
+    return color
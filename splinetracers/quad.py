@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+from typing import *
+
 import jax
 import jax.numpy as jnp
 import torch
@@ -64,6 +67,142 @@ def query_ellipsoid( tdist, rayo, rayd, params):
 def SH2RGB(x):
     return 0.28209479177387814 * x + 0.5
 
+
+def intersect_ellipsoids(rayo, rayd, mean, scale, quat):
+    """Entry and exit distances of every ray [R, 3] with every ellipsoid [P].
+
+    Returns t0, t1 of shape [R, P] and a mask of rays that hit each ellipsoid.
+    """
+    R = jax.vmap(math_util.jquatToMat3)(jax.vmap(math_util.jl2_normalize)(quat))
+    inv_scale = 1 / jnp.maximum(scale, 1e-8)
+    o = jnp.einsum('pij,rpj->rpi', R, rayo[:, None, :] - mean[None]) * inv_scale[None]
+    d = jnp.einsum('pij,rj->rpi', R, rayd) * inv_scale[None]
+    a = jnp.sum(d * d, axis=-1)
+    b = jnp.sum(o * d, axis=-1)
+    c = jnp.sum(o * o, axis=-1) - 1
+    disc = b * b - a * c
+    hit = disc > 0
+    sq = jnp.sqrt(jnp.where(hit, disc, 0))
+    a = jnp.where(hit, a, 1)
+    return (-b - sq) / a, (-b + sq) / a, hit
+
+
+@jax.jit
+def render_exact(rayo, rayd, tmin, tmax, mean, scale, quat, density, rgb):
+    """Exact volume rendering of constant density ellipsoids.
+
+    The density along a ray only changes when it enters or leaves an
+    ellipsoid, so sorting those events gives a step function that can be
+    alpha composited without sampling. The distortion loss treats the weight
+    of each step as uniform over the step.
+    """
+    t0, t1, hit = intersect_ellipsoids(rayo, rayd, mean, scale, quat)
+    t0 = jnp.where(hit, jnp.clip(t0, tmin, tmax), tmin)
+    t1 = jnp.where(hit, jnp.clip(t1, tmin, tmax), tmin)
+
+    num_rays = rayo.shape[0]
+    drgb = jnp.concatenate([density, density * rgb], axis=-1)
+    event_t = jnp.concatenate([t0, t1], axis=1)
+    event_drgb = jnp.concatenate([
+        jnp.broadcast_to(drgb, (num_rays,) + drgb.shape),
+        jnp.broadcast_to(-drgb, (num_rays,) + drgb.shape),
+    ], axis=1)
+    order = jnp.argsort(event_t, axis=1)
+    event_t = jnp.take_along_axis(event_t, order, axis=1)
+    event_drgb = jnp.take_along_axis(event_drgb, order[..., None], axis=1)
+
+    # Interval k spans [tdist[k], tdist[k+1]] and holds the sum of all events before it.
+    tdist = jnp.concatenate([
+        jnp.full((num_rays, 1), tmin), event_t, jnp.full((num_rays, 1), tmax)], axis=1)
+    drgb = jnp.cumsum(event_drgb, axis=1)
+    drgb = jnp.concatenate([jnp.zeros_like(drgb[:, :1]), drgb], axis=1)
+    total_density = jnp.clip(drgb[..., 0], 0, None)
+    avg_colors = jnp.clip(safe_math.safe_div(drgb[..., 1:], total_density[..., None]), 0, None)
+    avg_colors = jnp.where(total_density[..., None] > 0, avg_colors, 0)
+
+    t_delta = jnp.diff(tdist, axis=-1)
+    weights = quadrature.compute_alpha_weights_helper(total_density * t_delta)
+    dist_loss = quadrature.lossfun_distortion(tdist, weights)
+    rendered_color = jnp.concatenate([
+        jnp.sum(weights[..., None] * avg_colors, axis=-2),
+        jnp.sum(weights, axis=-1, keepdims=True),
+        dist_loss.reshape(-1, 1),
+    ], axis=1)
+    extras = {
+        "tdist": tdist,
+        "avg_colors": avg_colors,
+        "weights": weights,
+        "total_density": jnp.sum(total_density * t_delta, axis=-1),
+    }
+    return rendered_color, extras
+
+
+# Rough peak bytes of intermediate float64 values per (ray, primitive) pair,
+# used to turn a memory budget into chunk sizes.
+EXACT_BYTES_PER_RAY_PRIM = 48 * 8
+SAMPLED_BYTES_PER_RAY_PRIM_SAMPLE = 16 * 8
+DEFAULT_MEMORY_BUDGET = 2**30
+
+
+def plan_chunks(num_rays, num_prims, bytes_per_ray_prim, memory_budget=DEFAULT_MEMORY_BUDGET,
+                ray_chunk_size=None, prim_block_size=None):
+    """Picks (ray_chunk_size, prim_block_size) so one chunk fits in memory_budget bytes.
+
+    Sizes that are passed in are kept as is. Primitive blocks are grown
+    first, since every ray chunk has to loop over all of them.
+    """
+    if prim_block_size is None:
+        prim_block_size = memory_budget // (bytes_per_ray_prim * (ray_chunk_size or 1))
+    prim_block_size = int(np.clip(prim_block_size, 1, max(num_prims, 1)))
+    if ray_chunk_size is None:
+        ray_chunk_size = memory_budget // (bytes_per_ray_prim * prim_block_size)
+    ray_chunk_size = int(np.clip(ray_chunk_size, 1, max(num_rays, 1)))
+    return ray_chunk_size, prim_block_size
+
+
+def pad_rows(x, n, value=None):
+    """Pads x to n rows, repeating the last row or filling with value."""
+    if x.shape[0] == n:
+        return x
+    fill = np.repeat(x[-1:], n - x.shape[0], axis=0) if value is None else \
+        np.full((n - x.shape[0],) + x.shape[1:], value, dtype=x.dtype)
+    return np.concatenate([x, fill], axis=0)
+
+
+@functools.partial(jax.jit, static_argnames=('kernel',))
+def query_block(t_avg, rayo, rayd, params, kernel):
+    """Summed density and density weighted color of a block of primitives for a chunk of rays."""
+    vquery = jax.vmap(kernel, in_axes=(None, None, None, {
+        'mean': 0,
+        'quat': 0,
+        'density': 0,
+        'scale': 0,
+        'features': 0,
+    }))
+    vvquery = jax.vmap(vquery, in_axes=(None, 0, 0, None))
+    densities, colors = vvquery(t_avg, rayo, rayd, params)
+    return densities.sum(axis=1)[..., 0], colors.sum(axis=1)
+
+
+def render_sampled(tdist, rayo, rayd, params, kernel, prim_block_size, return_extras):
+    t_avg = 0.5 * (tdist[1:] + tdist[:-1])
+    num_prims = params['mean'].shape[0]
+    density = 0
+    colors = 0
+    # Padded primitives get zero density, unit scale and the identity rotation,
+    # so every kernel stays finite on them and they add nothing.
+    padding = dict(scale=1, quat=np.array([1, 0, 0, 0], dtype=params['quat'].dtype))
+    for s in range(0, num_prims, prim_block_size):
+        block = {k: pad_rows(v[s:s + prim_block_size], prim_block_size, padding.get(k, 0))
+                 for k, v in params.items()}
+        block_density, block_colors = query_block(t_avg, rayo, rayd, block, kernel)
+        density = density + block_density
+        colors = colors + block_colors
+    colors = safe_math.safe_div(colors, density[..., None]).clip(min=0)
+    return quadrature.render_quadrature(
+        tdist, lambda t: (density, colors), return_extras=return_extras)
+
+
 def trace_rays(
     mean: torch.Tensor,
     scale: torch.Tensor,
@@ -79,39 +218,68 @@ def trace_rays(
     wcts=None,
     max_iters: int = 500,
     return_extras: bool = False,
-    kernel = query_ellipsoid
+    kernel = None,
+    ray_chunk_size: Optional[int] = None,
+    prim_block_size: Optional[int] = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    num_quad: int = 2**16,
 ):
+    """Reference renderer.
 
-    vquery_ellipsoid = jax.vmap(kernel, in_axes=(None, None, None, {
-        'mean': 0,
-        'quat': 0,
-        'density': 0,
-        'scale': 0,
-        'features': 0,
-    }))
-
-    def sum_vquery_ellipsoid( tdist, rayo, rayd, params):
-        densities, colors = vquery_ellipsoid(tdist, rayo, rayd, params)
-        density = densities.sum(axis=0)
-        colors = safe_math.safe_div(colors.sum(axis=0), density)
-        return density.reshape(-1), colors.clip(min=0)
+    With kernel=None the constant density ellipsoids are integrated exactly.
+    Passing a query function such as query_ellipsoid instead samples it at
+    num_quad points along each ray, which is only meant as a cross-check of
+    the exact path and for the other kernels.
 
-    num_quad = 2**16
-    tdist = jnp.linspace(*(tmin, tmax), num_quad + 1)
+    Rays are rendered ray_chunk_size at a time, and the sampled path sums
+    primitives prim_block_size at a time. Sizes that are not given are
+    derived from memory_budget (bytes), so large images can be rendered on
+    a CPU. Note that the extras hold per sample values for every ray.
+    """
     params = {
         'mean': mean.detach().cpu().numpy().astype(np.float64).reshape(-1, 3),
         'scale': scale.detach().cpu().numpy().astype(np.float64).reshape(-1, 3),
         'quat': quat.detach().cpu().numpy().astype(np.float64).reshape(-1, 4),
         'density': density.detach().cpu().numpy().astype(np.float64).reshape(-1, 1),
-        'features': SH2RGB(features).detach().cpu().numpy().astype(np.float64).reshape(-1, 3),
+        'features': SH2RGB(features[:, 0]).detach().cpu().numpy().astype(np.float64).reshape(-1, 3),
     }
-    rayo = rayo.detach().cpu().numpy().astype(np.float64)
-    rayd = rayd.detach().cpu().numpy().astype(np.float64)
-    out, extras = quadrature.render_quadrature(
-        tdist,
-        lambda t: sum_vquery_ellipsoid(t, rayo, rayd, params),
-        return_extras=return_extras,
-    )
+    rayo = rayo.detach().cpu().numpy().astype(np.float64).reshape(-1, 3)
+    rayd = rayd.detach().cpu().numpy().astype(np.float64).reshape(-1, 3)
+    num_rays = rayo.shape[0]
+    num_prims = params['mean'].shape[0]
+
+    if kernel is None:
+        ray_chunk_size, _ = plan_chunks(
+            num_rays, num_prims, EXACT_BYTES_PER_RAY_PRIM, memory_budget,
+            ray_chunk_size, num_prims)
+        render = lambda o, d: render_exact(
+            o, d, float(tmin), float(tmax), params['mean'], params['scale'],
+            params['quat'], params['density'], params['features'])
+    else:
+        tdist = jnp.linspace(*(tmin, tmax), num_quad + 1)
+        ray_chunk_size, prim_block_size = plan_chunks(
+            num_rays, num_prims, num_quad * SAMPLED_BYTES_PER_RAY_PRIM_SAMPLE, memory_budget,
+            ray_chunk_size, prim_block_size)
+        render = lambda o, d: render_sampled(
+            tdist, o, d, params, kernel, prim_block_size, return_extras=True)
+
+    outs = []
+    extras = []
+    for s in range(0, num_rays, ray_chunk_size):
+        # Pad the last chunk so every chunk reuses the same compiled function.
+        n = min(num_rays - s, ray_chunk_size)
+        out, chunk_extras = render(
+            pad_rows(rayo[s:s + ray_chunk_size], ray_chunk_size),
+            pad_rows(rayd[s:s + ray_chunk_size], ray_chunk_size))
+        outs.append(out[:n])
+        if return_extras:
+            extras.append({k: v if k == 'tdist' and v.ndim == 1 else v[:n]
+                           for k, v in chunk_extras.items()})
+    out = jnp.concatenate(outs, axis=0)
+    if not return_extras:
+        return out
+    extras = {k: extras[0][k] if k == 'tdist' and extras[0][k].ndim == 1 else
+              jnp.concatenate([e[k] for e in extras], axis=0) for k in extras[0]}
     return out, extras
 
 trace_rays.uses_density = True
@@ -0,0 +1,189 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per ray tmin/tmax for the tracers, e.g. from utils/scene_bounds.py.
+
+A ray starts at rayo + tmin * rayd and is traced for a distance of tmax
+along its normalized direction; passing [R] tensors instead of floats sets
+these per ray. The CUDA tracer only takes one tmin and tmax per launch, so
+
+  - rays with tmax <= 0 (they miss the scene bounds) are not traced at all
+    and come back transparent, showing the background,
+  - the remaining rays are traced with the smallest of their tmin, and the
+    rest of each ray's tmin is folded into its origin,
+  - the launch uses the largest tmax, unless the tracer clips per ray
+    (per_ray_tmax, the CPU tracer does).
+
+The CUDA tracer finds the primitives that contain the ray starts around the
+first ray's origin, so a folded tmin is exact as long as the moved starts lie
+outside the primitives, as they do on bounds that enclose the scene. Like
+for a scalar tmin, the distortion loss is measured from the ray start.
+"""
+
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import *
+
+import torch
+
+
+def is_per_ray(tmin, tmax) -> bool:
+    return torch.is_tensor(tmin) or torch.is_tensor(tmax)
+
+
+def ray_slice(bound, inds):
+    """bound restricted to the rays inds (a slice or index tensor); floats pass through."""
+    return bound[inds] if torch.is_tensor(bound) else bound
+
+
+@dataclass
+class BoundedRays:
+    inds: torch.Tensor  # [T] int64, the rays that are traced
+    rayo: torch.Tensor  # [T, 3], moved by the per ray part of tmin
+    rayd: torch.Tensor  # [T, 3]
+    tmin: float
+    tmax: torch.Tensor  # [T]
+    num_rays: int
+
+    @property
+    def num_traced(self) -> int:
+        return self.inds.shape[0]
+
+    @property
+    def max_tmax(self) -> float:
+        return float(self.tmax.max()) if self.num_traced > 0 else 0.0
+
+
+def bound_rays(rayo: torch.Tensor, rayd: torch.Tensor, tmin, tmax) -> BoundedRays:
+    num_rays = rayo.shape[0]
+    tmin = torch.as_tensor(tmin, dtype=rayo.dtype, device=rayo.device).expand(num_rays)
+    tmax = torch.as_tensor(tmax, dtype=rayo.dtype, device=rayo.device).expand(num_rays)
+    inds = (tmax > 0).nonzero()[:, 0]
+    tmin, tmax = tmin[inds], tmax[inds]
+    base = float(tmin.detach().min()) if inds.numel() > 0 else 0.0
+    rayd = rayd[inds]
+    rayo = (rayo[inds] + (tmin - base)[:, None] * rayd).contiguous()
+    return BoundedRays(inds, rayo, rayd.contiguous(), base, tmax, num_rays)
+
+
+def scatter(values: torch.Tensor, rays: BoundedRays, dim: int = 0) -> torch.Tensor:
+    """Per traced ray values -> all rays, zero for the skipped ones. Differentiable."""
+    shape = list(values.shape)
+    shape[dim] = rays.num_rays
+    return values.new_zeros(shape).index_copy(dim, rays.inds, values)
+
+
+def scatter_extras(extras, rays: BoundedRays, max_iters: int, num_prims: int):
+    """The return_extras of trace_rays on the traced rays, for all rays.
+
+    tri_collection (iteration major, [max_iters, num_rays] or flattened) is
+    scattered too. Tiled extras keep their tile_tri_collections, if any, which
+    describe the traced rays; traced_inds maps them back.
+    """
+    if extras is None:
+        zeros = lambda *shape, dtype=torch.float32: torch.zeros(
+            (rays.num_rays, *shape), dtype=dtype, device=rays.inds.device)
+        iters = zeros(dtype=torch.int32)
+        return dict(
+            tri_collection=torch.zeros((max_iters * rays.num_rays,), dtype=torch.int32, device=rays.inds.device),
+            iters=iters,
+            opacity=zeros(),
+            touch_count=torch.zeros((num_prims,), dtype=torch.int32, device=rays.inds.device),
+            distortion_loss=zeros(),
+            overflow=zeros(dtype=torch.bool),
+            num_overflow=torch.zeros((), dtype=torch.int64, device=rays.inds.device),
+            saved=SimpleNamespace(states=zeros(16), diracs=zeros(4), iters=iters,
+                                  touch_count=torch.zeros((num_prims,), dtype=torch.int32, device=rays.inds.device)),
+            traced_inds=rays.inds,
+        )
+    merged = dict(extras)
+    for key in ['iters', 'opacity', 'distortion_loss', 'overflow']:
+        merged[key] = scatter(extras[key], rays)
+    saved = extras['saved']
+    merged['saved'] = SimpleNamespace(
+        states=scatter(saved.states.reshape(rays.num_traced, -1), rays),
+        diracs=scatter(saved.diracs.reshape(rays.num_traced, -1), rays),
+        iters=scatter(saved.iters, rays),
+        touch_count=saved.touch_count,
+    )
+    if 'tri_collection' in extras:
+        tri_collection = extras['tri_collection']
+        scattered = scatter(tri_collection.reshape(max_iters, rays.num_traced), rays, dim=1)
+        merged['tri_collection'] = scattered if tri_collection.dim() > 1 else scattered.reshape(-1)
+    merged['traced_inds'] = rays.inds
+    return merged
+
+
+def trace_rays_bounded(
+    trace_rays: Callable,
+    mean: torch.Tensor,
+    scale: torch.Tensor,
+    quat: torch.Tensor,
+    density: torch.Tensor,
+    features: torch.Tensor,
+    rayo: torch.Tensor,
+    rayd: torch.Tensor,
+    tmin,
+    tmax,
+    max_prim_size: float = 3,
+    dL_dmeans2D=None,
+    wcts=None,
+    max_iters: int = 500,
+    return_extras: bool = False,
+    per_ray_tmax: bool = False,
+    **kwargs,
+):
+    """Calls trace_rays with scalar tmin (and tmax) on the rays inside their bounds."""
+    rays = bound_rays(rayo, rayd, tmin, tmax)
+    if rays.num_traced == 0:
+        out = torch.zeros((rays.num_rays, 5), dtype=torch.float32, device=rayo.device)
+        extras = None
+    else:
+        out = trace_rays(
+            mean, scale, quat, density, features, rays.rayo, rays.rayd, rays.tmin,
+            rays.tmax if per_ray_tmax else rays.max_tmax, max_prim_size,
+            dL_dmeans2D, wcts, max_iters=max_iters, return_extras=return_extras, **kwargs)
+        if return_extras:
+            out, extras = out
+        out = scatter(out, rays)
+    if not return_extras:
+        return out
+    return out, scatter_extras(extras, rays, max_iters, mean.shape[0])
+
+
+def scatter_forward(out, rays: BoundedRays):
+    """The dict of a raw Forward.trace_rays launch on the traced rays, for all rays.
+
+    Only the outputs FastRenderer reads (color, saved.iters/states and
+    overflow) are kept.
+    """
+    if out is None:
+        zeros = lambda *shape, dtype=torch.float32: torch.zeros(
+            (rays.num_rays, *shape), dtype=dtype, device=rays.inds.device)
+        return dict(
+            color=zeros(4),
+            saved=SimpleNamespace(iters=zeros(dtype=torch.int32), states=zeros(16)),
+            overflow=zeros(dtype=torch.bool),
+            traced_inds=rays.inds,
+        )
+    saved = out['saved']
+    return dict(
+        color=scatter(out['color'], rays),
+        saved=SimpleNamespace(
+            iters=scatter(saved.iters, rays),
+            states=scatter(saved.states.reshape(rays.num_traced, -1), rays),
+        ),
+        overflow=scatter(out['overflow'], rays),
+        traced_inds=rays.inds,
+    )
@@ -0,0 +1,170 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splits a trace_rays call into ray tiles that fit a memory budget.
+
+The forward pass allocates tri_collection as num_rays * max_iters int32 next
+to a handful of per ray buffers, so the number of rays per launch is what
+bounds peak memory. Tiles are traced one after another and their outputs are
+concatenated. Only the per ray outputs of a tile are kept; its
+tri_collection is dropped before the next tile is traced, unless
+keep_tri_collections asks for them. When gradients are needed each tile is
+checkpointed, so only the inputs are kept and the tile is traced again
+during the backward pass.
+"""
+
+from types import SimpleNamespace
+from typing import *
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+from splinetracers import iter_budget
+from splinetracers import ray_bounds
+
+# int32 entries of tri_collection per ray and iteration.
+TRI_BYTES_PER_ITER = 4
+# color, states, diracs, faces, iters, initial_drgb and color_and_loss per ray.
+RAY_STATE_BYTES = (4 + 16 + 4 + 1 + 1 + 4 + 5) * 4
+# Tiles larger than this are rounded down to a multiple of it.
+TILE_ALIGNMENT = 1024
+
+
+def bytes_per_ray(max_iters: int) -> int:
+    return TRI_BYTES_PER_ITER * max_iters + RAY_STATE_BYTES
+
+
+def plan_tiles(num_rays: int, max_iters: int, memory_budget: Optional[int]) -> List[Tuple[int, int]]:
+    """Returns [start, end) ray ranges whose buffers each fit in memory_budget bytes."""
+    if memory_budget is None:
+        return [(0, num_rays)]
+    per_ray = bytes_per_ray(max_iters)
+    tile_size = memory_budget // per_ray
+    if tile_size < 1:
+        raise ValueError(
+            f"A memory budget of {memory_budget} bytes can not hold a single ray "
+            f"with max_iters={max_iters} ({per_ray} bytes).")
+    if tile_size >= TILE_ALIGNMENT:
+        tile_size -= tile_size % TILE_ALIGNMENT
+    return [(s, min(s + tile_size, num_rays)) for s in range(0, max(num_rays, 1), tile_size)]
+
+
+def tile_extras(extras, max_iters: int, keep_tri_collection: bool = False):
+    """The extras of one tile that are kept while the next tiles are traced.
+
+    tri_collection is only kept when asked for. In its place
+    overflow_touch_count holds the hits of the overflowed rays, which is what
+    iter_budget.merge_extras needs when they are re-traced.
+    """
+    kept = {key: extras[key] for key in [
+        'iters', 'opacity', 'touch_count', 'distortion_loss', 'overflow', 'num_overflow', 'saved']}
+    overflow_hits = iter_budget.first_pass_hits(extras, extras['overflow'].nonzero()[:, 0], max_iters)
+    kept['overflow_touch_count'] = iter_budget.hit_count(overflow_hits, extras['touch_count'])
+    if keep_tri_collection:
+        kept['tri_collection'] = extras['tri_collection']
+    return kept
+
+
+def stitch_extras(extras, tiles):
+    """Concatenates the per tile extras of trace_rays.
+
+    tri_collection is laid out iteration major ([max_iters, num_rays]) within
+    each tile, so stitching it would allocate the full buffer the budget is
+    meant to avoid. Tiles traced with keep_tri_collections return their
+    buffers in tile_tri_collections instead, next to the ray ranges in tiles.
+    """
+    cat = lambda key: torch.cat([e[key] for e in extras], dim=0)
+    saved = [e['saved'] for e in extras]
+    touch_count = sum(e['touch_count'] for e in extras)
+    stitched_saved = SimpleNamespace(
+        states=torch.cat([s.states for s in saved], dim=0),
+        diracs=torch.cat([s.diracs for s in saved], dim=0),
+        iters=torch.cat([s.iters for s in saved], dim=0),
+        touch_count=touch_count,
+    )
+    stitched = dict(
+        iters=cat('iters'),
+        opacity=cat('opacity'),
+        touch_count=touch_count,
+        distortion_loss=cat('distortion_loss'),
+        overflow=cat('overflow'),
+        num_overflow=sum(e['num_overflow'] for e in extras),
+        overflow_touch_count=sum(e['overflow_touch_count'] for e in extras),
+        saved=stitched_saved,
+        tiles=tiles,
+    )
+    if all('tri_collection' in e for e in extras):
+        stitched['tile_tri_collections'] = [e['tri_collection'] for e in extras]
+    return stitched
+
+
+def trace_rays_tiled(
+    trace_rays: Callable,
+    mean: torch.Tensor,
+    scale: torch.Tensor,
+    quat: torch.Tensor,
+    density: torch.Tensor,
+    features: torch.Tensor,
+    rayo: torch.Tensor,
+    rayd: torch.Tensor,
+    tmin: float = 0.0,
+    tmax: float = 1000,
+    max_prim_size: float = 3,
+    dL_dmeans2D=None,
+    wcts=None,
+    max_iters: int = 500,
+    return_extras: bool = False,
+    memory_budget: Optional[int] = None,
+    keep_tri_collections: bool = False,
+    **kwargs,
+):
+    """Calls trace_rays on tiles of rays sized by memory_budget (bytes).
+
+    The result matches a single trace_rays call, except that the extras of
+    more than one tile hold no tri_collection; with keep_tri_collections it
+    is returned per tile (see stitch_extras), which costs the memory of an
+    untiled launch.
+    """
+    tiles = plan_tiles(rayo.shape[0], max_iters, memory_budget)
+    if len(tiles) == 1:
+        return trace_rays(
+            mean, scale, quat, density, features, rayo, rayd, tmin, tmax, max_prim_size,
+            dL_dmeans2D, wcts, max_iters=max_iters, return_extras=return_extras, **kwargs)
+
+    def trace_tile(mean, scale, quat, density, features, rayo, rayd, dL_dmeans2D, tmin, tmax):
+        out = trace_rays(
+            mean, scale, quat, density, features, rayo, rayd, tmin, tmax, max_prim_size,
+            dL_dmeans2D, wcts, max_iters=max_iters, return_extras=return_extras, **kwargs)
+        if not return_extras:
+            return out
+        out, extras = out
+        return out, tile_extras(extras, max_iters, keep_tri_collections)
+
+    inputs = (mean, scale, quat, density, features)
+    needs_grad = torch.is_grad_enabled() and any(
+        t is not None and t.requires_grad for t in inputs + (rayo, rayd, dL_dmeans2D))
+    outs = []
+    extras = []
+    for s, e in tiles:
+        args = inputs + (rayo[s:e], rayd[s:e], dL_dmeans2D,
+                          ray_bounds.ray_slice(tmin, slice(s, e)), ray_bounds.ray_slice(tmax, slice(s, e)))
+        out = checkpoint(trace_tile, *args, use_reentrant=False) if needs_grad else trace_tile(*args)
+        if return_extras:
+            out, kept = out
+            extras.append(kept)
+        outs.append(out)
+    color_and_loss = torch.cat(outs, dim=0)
+    if not return_extras:
+        return color_and_loss
+    return color_and_loss, stitch_extras(extras, tiles)
@@ -0,0 +1,253 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent scene handle for the ellipsoid spline tracer.
+
+A TracerScene owns the Primitives, GAS and Forward objects together with the
+half precision attribute buffer, and only rebuilds the parts that are stale
+when it is handed a new set of primitive tensors:
+
+  * "none":     nothing changed, reuse everything.
+  * "features": only features or densities changed, point the primitives
+                and the forward pipeline at the new values.
+  * "refit":    means, scales or quats were modified in place, recompute the
+                half attributes and aabbs and rebuild the GAS.
+  * "rebuild":  primitive count, feature size or storage changed, start over.
+
+Changes are detected from tensor data pointers and version counters, so the
+check itself never touches tensor data. The native objects keep raw pointers
+into the tensors, which is why the scene holds on to them.
+"""
+
+from typing import *
+
+import torch
+
+from splinetracers import cpu_ellipsoid_splinetracer
+
+GEOMETRY_KEYS = ('mean', 'scale', 'quat')
+KEYS = GEOMETRY_KEYS + ('density', 'features')
+
+
+def tensor_signature(t: torch.Tensor):
+    return (t.data_ptr(), t._version, tuple(t.shape), t.stride(), t.dtype, t.device)
+
+
+class ExtensionBuildBackend:
+    """Builds scene objects with the compiled splinetracer extension."""
+
+    def __init__(self, module, context):
+        self.module = module
+        self.context = context
+
+    def primitives(self, device):
+        return self.module.Primitives(device)
+
+    def gas(self, device, prims):
+        return self.module.GAS(self.context, device, prims, True, False, True)
+
+    def forward(self, device, prims, enable_backward):
+        return self.module.Forward(self.context, device, prims, enable_backward)
+
+
+class PyPrimitives:
+    def __init__(self, device):
+        self.device = device
+        self.num_prims = 0
+
+    def add_primitives(self, means, scales, quats, half_attribs, densities, colors):
+        self.means = means
+        self.scales = scales
+        self.quats = quats
+        self.half_attribs = half_attribs
+        self.densities = densities
+        self.features = colors
+        self.num_prims = means.shape[0]
+        self.feature_size = colors.shape[1]
+
+    def set_features(self, colors):
+        assert colors.shape[0] == self.num_prims
+        self.features = colors
+
+
+class PyGAS:
+    def __init__(self, device, prims):
+        self.device = device
+        self.num_prims = prims.num_prims
+
+
+class PyForward:
+    def __init__(self, device, prims, enable_backward):
+        self.device = device
+        self.prims = prims
+        self.features = prims.features
+        self.enable_backward = enable_backward
+
+    def update_model(self, prims):
+        self.features = prims.features
+
+    def trace_rays(self, gas, rayo, rayd, tmin, tmax, max_iters, max_prim_size,
+                   min_transmittance=cpu_ellipsoid_splinetracer.MIN_TRANSMITTANCE):
+        prims = self.prims
+        assert gas.num_prims == prims.num_prims
+        color_and_loss, extras = cpu_ellipsoid_splinetracer.trace_rays(
+            prims.means, prims.scales, prims.quats, prims.densities, self.features,
+            rayo, rayd, tmin, tmax, max_prim_size,
+            max_iters=max_iters, return_extras=True, min_transmittance=min_transmittance)
+
+        origin = rayo + tmin * rayd
+        quat = prims.quats / prims.quats.norm(dim=-1, keepdim=True)
+        color = cpu_ellipsoid_splinetracer.SH_C0 * self.features[:, 0, :] + 0.5
+        density = prims.densities.reshape(-1, 1)
+        drgb = torch.cat([density, density * color], dim=1)
+        initial_drgb = cpu_ellipsoid_splinetracer.initial_drgb(
+            origin, prims.means, prims.scales, quat, drgb)
+        inside = cpu_ellipsoid_splinetracer.initial_drgb(
+            origin, prims.means, prims.scales, quat,
+            torch.eye(prims.num_prims, device=rayo.device)).amax(dim=0) > 0
+        inds = inside.nonzero().reshape(-1).int()
+        initial_touch_inds = torch.zeros((prims.num_prims,), dtype=torch.int32, device=rayo.device)
+        initial_touch_inds[:inds.shape[0]] = inds
+        return dict(
+            color=color_and_loss[:, :4],
+            saved=extras['saved'],
+            tri_collection=extras['tri_collection'],
+            initial_drgb=initial_drgb,
+            initial_touch_inds=initial_touch_inds,
+            initial_touch_count=torch.tensor([inds.shape[0]], dtype=torch.int32, device=rayo.device),
+        )
+
+
+class PyBuildBackend:
+    """Pure Python stand-in for ExtensionBuildBackend.
+
+    Tracing is done with cpu_ellipsoid_splinetracer, and every build is
+    counted so the caching behaviour of TracerScene can be checked without
+    CUDA.
+    """
+
+    def __init__(self):
+        self.num_builds = dict(primitives=0, gas=0, forward=0)
+
+    def primitives(self, device):
+        self.num_builds['primitives'] += 1
+        return PyPrimitives(device)
+
+    def gas(self, device, prims):
+        self.num_builds['gas'] += 1
+        return PyGAS(device, prims)
+
+    def forward(self, device, prims, enable_backward):
+        self.num_builds['forward'] += 1
+        return PyForward(device, prims, enable_backward)
+
+
+class TracerScene:
+    def __init__(self, device: torch.device, backend, enable_backward: bool = True):
+        self.device = device
+        self.backend = backend
+        self.enable_backward = enable_backward
+        self.prims = None
+        self.gas = None
+        self.forward = None
+        self.half_attribs = None
+        self.inputs = {}
+        self.tensors = {}
+        self.signatures = {}
+        self.last_update = None
+
+    def classify(self, **inputs) -> str:
+        """Returns which update `update` would perform for these tensors."""
+        if self.prims is None:
+            return 'rebuild'
+        new = {k: tensor_signature(inputs[k]) for k in KEYS}
+        old = self.signatures
+        storage = lambda sig: sig[:1] + sig[2:]
+        if any(storage(new[k]) != storage(old[k]) for k in GEOMETRY_KEYS + ('density',)):
+            return 'rebuild'
+        if new['features'][2] != old['features'][2]:
+            return 'rebuild'
+        if any(new[k] != old[k] for k in GEOMETRY_KEYS):
+            return 'refit'
+        if new['features'] != old['features'] or new['density'] != old['density']:
+            return 'features'
+        return 'none'
+
+    def update(
+        self,
+        mean: torch.Tensor,
+        scale: torch.Tensor,
+        quat: torch.Tensor,
+        density: torch.Tensor,
+        features: torch.Tensor,
+    ) -> str:
+        inputs = dict(mean=mean, scale=scale, quat=quat, density=density, features=features)
+        for k, v in inputs.items():
+            assert v.device == self.device, f"{k} is on {v.device}, scene is on {self.device}"
+        action = self.classify(**inputs)
+        if action == 'rebuild':
+            self._rebuild(inputs)
+        elif action == 'refit':
+            self._refresh(inputs)
+            self._refit()
+        elif action == 'features':
+            self._refresh(inputs)
+            self.prims.set_features(self.tensors['features'])
+            self.forward.update_model(self.prims)
+        self.inputs = inputs
+        self.signatures = {k: tensor_signature(v) for k, v in inputs.items()}
+        self.last_update = action
+        return action
+
+    def trace_rays(self, rayo, rayd, tmin, tmax, max_iters, max_prim_size,
+                   min_transmittance=cpu_ellipsoid_splinetracer.MIN_TRANSMITTANCE):
+        assert self.forward is not None, "TracerScene.update must be called before tracing"
+        return self.forward.trace_rays(
+            self.gas, rayo, rayd, tmin, tmax, max_iters, max_prim_size, min_transmittance)
+
+    def _half_attribs(self):
+        return torch.cat(
+            [self.tensors['mean'], self.tensors['scale'], self.tensors['quat']], dim=1).half()
+
+    def _refresh(self, inputs):
+        # The native objects hold pointers into self.tensors, so values are
+        # copied into the existing buffers whenever the input is not the
+        # buffer itself. Only features may move to new storage.
+        for k, v in inputs.items():
+            if k == 'features' and v.data_ptr() != self.inputs[k].data_ptr():
+                self.tensors[k] = v.contiguous()
+            elif self.tensors[k] is not v:
+                self.tensors[k].copy_(v)
+
+    def _add_primitives(self):
+        t = self.tensors
+        self.prims.add_primitives(
+            t['mean'], t['scale'], t['quat'], self.half_attribs, t['density'], t['features'])
+
+    def _refit(self):
+        self.half_attribs.copy_(self._half_attribs())
+        self._add_primitives()
+        self.gas = self.backend.gas(self.device, self.prims)
+
+    def _rebuild(self, inputs):
+        self.tensors = {k: v.contiguous() for k, v in inputs.items()}
+        self.half_attribs = self._half_attribs().contiguous()
+        self.prims = self.backend.primitives(self.device)
+        self._add_primitives()
+        self.gas = self.backend.gas(self.device, self.prims)
+        self.forward = self.backend.forward(self.device, self.prims, self.enable_backward)
+
+
+def make_py_scene(device: torch.device = torch.device('cpu'), enable_backward: bool = True):
+    return TracerScene(device, PyBuildBackend(), enable_backward)
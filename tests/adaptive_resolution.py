@@ -0,0 +1,60 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from integration_utils.adaptive_resolution import ResolutionController
+
+def pose(i):
+    p = np.eye(4)
+    p[0, 3] = 0.1 * i
+    return p
+
+class ResolutionControllerTest(parameterized.TestCase):
+    def simulate(self, controller, poses, full_frame_time):
+        scales = []
+        for p in poses:
+            scale = controller.begin(p)
+            controller.end(full_frame_time * scale**2)
+            scales.append(scale)
+        return scales
+
+    @parameterized.parameters(0.01, 0.1, 0.5)
+    def test_holds_target_while_moving(self, full_frame_time):
+        controller = ResolutionController(target_fps=30, min_scale=0.125)
+        scales = self.simulate(controller, [pose(i) for i in range(20)], full_frame_time)
+        scale = scales[-1]
+        self.assertEqual(scale % controller.scale_step, 0)
+        if full_frame_time <= 1 / 30:
+            self.assertEqual(scale, 1.0)
+        elif scale > controller.min_scale:
+            self.assertLessEqual(full_frame_time * scale**2, 1 / 30 + 1e-9)
+            self.assertGreater(full_frame_time * (scale + controller.scale_step)**2, 1 / 30)
+
+    def test_full_resolution_when_still(self):
+        controller = ResolutionController(target_fps=30, still_frames=3)
+        poses = [pose(i) for i in range(10)] + [pose(10)] * 5 + [pose(11)]
+        scales = self.simulate(controller, poses, 0.2)
+        self.assertLess(scales[9], 1.0)
+        self.assertEqual(scales[10:13], [scales[9]] * 3)
+        self.assertEqual(scales[13:15], [1.0, 1.0])
+        self.assertEqual(scales[15], scales[9])
+
+    def test_scaled_size(self):
+        self.assertEqual(ResolutionController.scaled_size(1920, 1080, 0.5), (960, 540))
+        self.assertEqual(ResolutionController.scaled_size(3, 3, 0.01), (1, 1))
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,81 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from scipy.spatial.transform import Rotation
+from utils import camera_path
+
+def random_c2w(n, seed=0):
+    rng = np.random.default_rng(seed)
+    c2w = np.zeros((n, 3, 4))
+    c2w[:, :, :3] = Rotation.random(n, random_state=seed).as_matrix()
+    c2w[:, :, 3] = rng.normal(size=(n, 3))
+    return c2w
+
+def loop_viewmatrix(lookdir, up, position, lock_up=False):
+    """The per pose lookat the path generators used before batching."""
+    normalize = lambda x: x / np.linalg.norm(x)
+    orthogonal_dir = lambda a, b: normalize(np.cross(a, b))
+    vecs = [None, normalize(up), normalize(lookdir)]
+    vecs[0] = orthogonal_dir(vecs[1], vecs[2])
+    ax = 2 if lock_up else 1
+    vecs[ax] = orthogonal_dir(vecs[(ax + 1) % 3], vecs[(ax + 2) % 3])
+    return np.stack(vecs + [position], axis=1)
+
+class CameraPathTest(parameterized.TestCase):
+    def test_round_trip(self):
+        c2w = random_c2w(5)
+        world_view = camera_path.world_view_from_c2w(c2w)
+        self.assertEqual(world_view.shape, (5, 4, 4))
+        np.testing.assert_allclose(camera_path.c2w_from_world_view(world_view), c2w, atol=1e-10)
+
+    def test_conventions(self):
+        c2w = random_c2w(3)
+        world_view = camera_path.world_view_from_c2w(c2w)
+        # A point in front of an OpenGL camera (-z) has positive depth in the 3DGS view.
+        points = c2w[:, :, 3] - 2 * c2w[:, :, 2] + 0.5 * c2w[:, :, 1]
+        cam = np.einsum("ni,nij->nj", np.concatenate([points, np.ones((3, 1))], -1), world_view)
+        np.testing.assert_allclose(cam[:, :3], np.tile([0, -0.5, 2], (3, 1)), atol=1e-10)
+
+    def test_undo_transform(self):
+        c2w = random_c2w(4)
+        transform = np.eye(4)
+        transform[:3, :3] = 0.5 * Rotation.random(random_state=1).as_matrix()
+        transform[:3, 3] = [1, 2, 3]
+        transformed = transform @ camera_path.pad_poses(c2w)
+        np.testing.assert_allclose(camera_path.undo_transform(transformed[:, :3], transform), c2w, atol=1e-10)
+
+    @parameterized.parameters(False, True)
+    def test_viewmatrix_matches_loop(self, lock_up):
+        rng = np.random.default_rng(2)
+        positions = rng.normal(size=(100, 3))
+        lookdirs = positions - rng.normal(size=3)
+        up = np.array([0.1, 0.2, 1.0])
+        poses = camera_path.viewmatrix(lookdirs, up, positions, lock_up)
+        self.assertEqual(poses.shape, (100, 3, 4))
+        expected = np.stack([loop_viewmatrix(d, up, p, lock_up) for d, p in zip(lookdirs, positions)])
+        np.testing.assert_allclose(poses, expected, rtol=0, atol=1e-15)
+        # Single poses keep their [3, 4] shape.
+        np.testing.assert_allclose(camera_path.viewmatrix(lookdirs[0], up, positions[0], lock_up), expected[0],
+                                   rtol=0, atol=1e-15)
+        rot = poses[:, :, :3]
+        np.testing.assert_allclose(rot @ np.swapaxes(rot, -1, -2), np.broadcast_to(np.eye(3), rot.shape), atol=1e-12)
+        locked = poses[:, :, 1] if lock_up else poses[:, :, 2]
+        np.testing.assert_allclose(locked, camera_path.normalize(np.broadcast_to(up, (100, 3)) if lock_up else lookdirs),
+                                   atol=1e-15)
+
+if __name__ == "__main__":
+    absltest.main()
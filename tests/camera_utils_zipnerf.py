@@ -0,0 +1,142 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import scipy
+
+try:
+    # Imported like render_path.py does; needs the gaussian-splatting integration
+    # (scene.dataset_readers and utils.stepfun) on the path.
+    from ever.integration_utils.utils import camera_utils_zipnerf
+except ImportError:
+    camera_utils_zipnerf = None
+
+def loop_viewmatrix(lookdir, up, position, lock_up=False):
+    """The per pose lookat the path generators used before batching."""
+    normalize = lambda x: x / np.linalg.norm(x)
+    orthogonal_dir = lambda a, b: normalize(np.cross(a, b))
+    vecs = [None, normalize(up), normalize(lookdir)]
+    vecs[0] = orthogonal_dir(vecs[1], vecs[2])
+    ax = 2 if lock_up else 1
+    vecs[ax] = orthogonal_dir(vecs[(ax + 1) % 3], vecs[(ax + 2) % 3])
+    return np.stack(vecs + [position], axis=1)
+
+def batched_loop_viewmatrix(lookdir, up, position, lock_up=False):
+    """loop_viewmatrix over the leading axes of broadcast inputs."""
+    lookdir, up, position = np.broadcast_arrays(lookdir, up, position)
+    if lookdir.ndim == 1:
+        return loop_viewmatrix(lookdir, up, position, lock_up)
+    return np.stack([loop_viewmatrix(l, u, p, lock_up) for l, u, p in zip(lookdir, up, position)])
+
+def ring_poses(n, seed=0):
+    rng = np.random.default_rng(seed)
+    theta = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    positions = np.stack([4 * np.cos(theta), 3 * np.sin(theta), 0.3 * rng.normal(size=n)], axis=-1)
+    up = np.array([0.0, 0.0, 1.0]) + 0.05 * rng.normal(size=(n, 3))
+    return np.stack([loop_viewmatrix(p, u, p) for p, u in zip(positions, up)])
+
+def loop_spiral_path(poses, bounds, n_frames=120, n_rots=2, zrate=0.5):
+    """generate_spiral_path with one lookat per frame, as before batching."""
+    near_bound = bounds.min() * camera_utils_zipnerf.NEAR_STRETCH
+    far_bound = bounds.max() * camera_utils_zipnerf.FAR_STRETCH
+    focus = camera_utils_zipnerf.FOCUS_DISTANCE
+    focal = 1 / (((1 - focus) / near_bound + focus / far_bound))
+    radii = np.concatenate([np.percentile(np.abs(poses[:, :3, 3]), 90, 0), [1.0]])
+    cam2world = camera_utils_zipnerf.average_pose(poses)
+    up = poses[:, :3, 1].mean(0)
+    render_poses = []
+    for theta in np.linspace(0.0, 2.0 * np.pi * n_rots, n_frames, endpoint=False):
+        t = radii * [np.cos(theta), -np.sin(theta), -np.sin(theta * zrate), 1.0]
+        position = cam2world @ t
+        lookat = cam2world @ [0, 0, -focal, 1.0]
+        render_poses.append(loop_viewmatrix(position - lookat, up, position))
+    return np.stack(render_poses, axis=0)
+
+def loop_interpolated_path(poses, n_interp, spline_degree=5, smoothness=0.03, rot_weight=0.1,
+                           lock_up=False, fixed_up_vector=None, lookahead_i=None):
+    """generate_interpolated_path (without buffers or resampling) with the per frame points_to_poses."""
+    pos = poses[:, :3, -1]
+    points = np.stack([pos, pos - rot_weight * poses[:, :3, 2], pos + rot_weight * poses[:, :3, 1]], 1)
+    n_frames = n_interp * (points.shape[0] - 1)
+    u = np.linspace(0, 1, n_frames, endpoint=True)
+    pts = points.reshape(points.shape[0], -1)
+    tck, _ = scipy.interpolate.splprep(pts.T, k=min(spline_degree, points.shape[0] - 1), s=smoothness)
+    new_points = np.array(scipy.interpolate.splev(u, tck)).T.reshape(len(u), 3, 3)
+    render_poses = []
+    for i in range(len(new_points)):
+        position, lookat_point, up_point = new_points[i]
+        if lookahead_i is not None:
+            if i + lookahead_i < len(new_points):
+                lookat = position - new_points[i + lookahead_i][0]
+        else:
+            lookat = position - lookat_point
+        up = (up_point - position) if fixed_up_vector is None else fixed_up_vector
+        render_poses.append(loop_viewmatrix(lookat, up, position, lock_up=lock_up))
+    return np.array(render_poses)[:-1]
+
+class PathGeneratorTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        if camera_utils_zipnerf is None:
+            self.skipTest("camera_utils_zipnerf needs the gaussian-splatting integration")
+        self.poses, _ = camera_utils_zipnerf.transform_poses_pca(ring_poses(12))
+
+    @parameterized.parameters(1, 7, 120)
+    def test_spiral_path(self, n_frames):
+        bounds = np.array([0.5, 5.0])
+        path = camera_utils_zipnerf.generate_spiral_path(self.poses, bounds, n_frames=n_frames)
+        expected = loop_spiral_path(self.poses, bounds, n_frames=n_frames)
+        self.assertEqual(path.shape, (n_frames, 3, 4))
+        np.testing.assert_allclose(path, expected, atol=1e-12)
+
+    @parameterized.product(
+        lock_up = [False, True],
+        const_speed = [False, True],
+    )
+    def test_ellipse_path(self, lock_up, const_speed):
+        path = camera_utils_zipnerf.generate_ellipse_path(
+            self.poses, 50, const_speed=const_speed, z_variation=0.5, lock_up=lock_up)
+        # The same generator with the lookat of one pose at a time.
+        with mock.patch.object(camera_utils_zipnerf, "viewmatrix", batched_loop_viewmatrix):
+            expected = camera_utils_zipnerf.generate_ellipse_path(
+                self.poses, 50, const_speed=const_speed, z_variation=0.5, lock_up=lock_up)
+        self.assertEqual(path.shape, (50, 3, 4))
+        np.testing.assert_allclose(path, expected, atol=1e-12)
+
+    @parameterized.product(
+        lookahead_i = [None, 1, 5],
+        lock_up = [False, True],
+        fixed_up = [False, True],
+    )
+    def test_interpolated_path(self, lookahead_i, lock_up, fixed_up):
+        fixed_up_vector = np.array([0.0, 0.0, 1.0]) if fixed_up else None
+        path, u, _ = camera_utils_zipnerf.generate_interpolated_path(
+            self.poses, 4, lock_up=lock_up, fixed_up_vector=fixed_up_vector, lookahead_i=lookahead_i)
+        expected = loop_interpolated_path(
+            self.poses, 4, lock_up=lock_up, fixed_up_vector=fixed_up_vector, lookahead_i=lookahead_i)
+        self.assertEqual(path.shape, (4 * 11 - 1, 3, 4))
+        self.assertEqual(u.shape, (4 * 11 - 1,))
+        np.testing.assert_allclose(path, expected, atol=1e-12)
+
+    def test_lookahead_needs_enough_poses(self):
+        with self.assertRaises(ValueError):
+            camera_utils_zipnerf.generate_interpolated_path(
+                self.poses[:3], 2, spline_degree=2, lookahead_i=4)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,90 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from third_party.sh_util import eval_sh
+from splinetracers.color_cache import ViewColorCache
+
+device = torch.device('cpu')
+
+class ViewColorCacheTest(parameterized.TestCase):
+    def setUp(self):
+        N = 500
+        self.means = torch.randn(N, 3, device=device)
+        self.shs = torch.randn(N, 3, 16, device=device)
+
+    def colors(self, cam_pos, inds=None):
+        means = self.means if inds is None else self.means[inds]
+        shs = self.shs if inds is None else self.shs[inds]
+        dirs = means - cam_pos.reshape(1, 3)
+        return eval_sh(3, shs, dirs / dirs.norm(dim=-1, keepdim=True))
+
+    def get(self, cache, cam_pos, key=None):
+        return cache.get(self.means, cam_pos, lambda inds: self.colors(cam_pos, inds), key)
+
+    def test_same_position_skips_evaluation(self):
+        cache = ViewColorCache()
+        cam_pos = torch.tensor([0, 0, -5.0])
+        colors1 = self.get(cache, cam_pos)
+        colors2 = self.get(cache, cam_pos.clone())
+        self.assertIs(colors1, colors2)
+        self.assertEqual(cache.num_evaluated, self.means.shape[0])
+
+    def test_exact_without_tolerance(self):
+        cache = ViewColorCache()
+        for cam_pos in torch.randn(4, 3) - torch.tensor([0, 0, 5.0]):
+            np.testing.assert_allclose(
+                self.get(cache, cam_pos).numpy(), self.colors(cam_pos).numpy(), atol=1e-6)
+
+    def test_key_change_recomputes(self):
+        cache = ViewColorCache(position_tolerance=1.0)
+        cam_pos = torch.tensor([0, 0, -5.0])
+        self.get(cache, cam_pos, key=0)
+        self.get(cache, cam_pos, key=1)
+        self.assertEqual(cache.num_evaluated, 2 * self.means.shape[0])
+
+    def test_position_tolerance_accumulates_drift(self):
+        cache = ViewColorCache(position_tolerance=0.1)
+        cam_pos = torch.tensor([0, 0, -5.0])
+        self.get(cache, cam_pos)
+        for i in range(1, 5):
+            self.get(cache, cam_pos + torch.tensor([0.03 * i, 0, 0]))
+        self.assertEqual(cache.num_evaluated, 2 * self.means.shape[0])
+
+    @parameterized.parameters(0.02, 0.03)
+    def test_angle_tolerance(self, angle_tolerance):
+        cache = ViewColorCache(angle_tolerance=angle_tolerance)
+        cam_pos = torch.tensor([0, 0, -5.0])
+        self.get(cache, cam_pos)
+        for step in range(5):
+            cam_pos = cam_pos + torch.tensor([0.05, 0.025, 0])
+            colors = self.get(cache, cam_pos)
+            dirs = self.means - cam_pos
+            dirs = dirs / dirs.norm(dim=-1, keepdim=True)
+            # Every cached color was evaluated within the tolerance of the current direction.
+            cos = (dirs * cache.dirs).sum(dim=-1)
+            self.assertTrue(bool((cos >= math.cos(angle_tolerance) - 1e-6).all()))
+            evaluated_dirs = self.colors(cam_pos)
+            fresh = cos > 1 - 1e-7
+            np.testing.assert_allclose(colors[fresh].numpy(), evaluated_dirs[fresh].numpy(), atol=1e-5)
+        self.assertLess(cache.num_evaluated, 6 * self.means.shape[0])
+        self.assertGreater(cache.num_evaluated, self.means.shape[0])
+
+if __name__ == "__main__":
+    absltest.main()
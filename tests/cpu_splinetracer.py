@@ -0,0 +1,144 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils.math_util import l2_normalize_th
+torch.set_printoptions(precision=10)
+np.set_printoptions(precision=10)
+from splinetracers import quad
+from splinetracers import cpu_ellipsoid_splinetracer
+import random
+
+device = torch.device('cpu')
+
+def random_scene(N, density_multi, num_rays=1):
+    mean = 1.2*torch.rand(N, 3, dtype=torch.float32, device=device)-0.2
+    mean[:, 0] *= 0.5
+    mean[:, 1] *= 0.5
+    scale = 0.5*torch.rand(N, 3, dtype=torch.float32, device=device)
+    quat = l2_normalize_th(2*torch.rand(N, 4, dtype=torch.float32, device=device)-1)
+    density = density_multi*torch.rand(N, 1, dtype=torch.float32, device=device)
+    features = torch.rand(N, 1, 3, dtype=torch.float32, device=device)
+    return mean, scale, quat, density, features
+
+class CPUSplineTracerTest(parameterized.TestCase):
+    @parameterized.product(
+        N = [1, 5, 10],
+        density_multi = [0.1, 1],
+    )
+    def test_matches_quadrature(self, N, density_multi):
+        rayo = torch.tensor([[0, 0, 0]], dtype=torch.float32, device=device)
+        rayd = torch.tensor([[0, 0, 1]], dtype=torch.float32, device=device)
+        mean, scale, quat, density, features = random_scene(N, density_multi)
+
+        tmin = random.random()*0.3
+        color1 = quad.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd,
+                  tmin, 3)
+        color1 = color1[:, :4].reshape(-1)
+
+        color2 = cpu_ellipsoid_splinetracer.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd,
+                  tmin, 100)
+        color2 = color2[:, :4].reshape(-1)
+
+        np.testing.assert_allclose(np.array(color1), color2.numpy(), atol=1e-4, rtol=1e-4)
+
+    def test_matches_quadrature_batched(self):
+        mean, scale, quat, density, features = random_scene(20, 1)
+        rayo = 0.1*torch.randn(500, 3, device=device) + torch.tensor([0, 0, -1.0])
+        rayd = l2_normalize_th(0.2*torch.randn(500, 3, device=device) + torch.tensor([0, 0, 1.0]))
+
+        color1 = quad.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd, 0, 5)
+        color2 = cpu_ellipsoid_splinetracer.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd, 0, 5)
+
+        np.testing.assert_allclose(np.array(color1)[:, :4], color2[:, :4].numpy(), atol=1e-4, rtol=1e-4)
+
+    @parameterized.parameters(1e-3, 0.05, 0.3)
+    def test_early_termination(self, min_transmittance):
+        mean, scale, quat, density, features = random_scene(40, 5)
+        rayo = 0.1*torch.randn(200, 3, device=device) + torch.tensor([0, 0, -1.0])
+        rayd = l2_normalize_th(0.2*torch.randn(200, 3, device=device) + torch.tensor([0, 0, 1.0]))
+        args = (mean, scale, quat, density, features, rayo, rayd, 0, 100)
+
+        color1, extras1 = cpu_ellipsoid_splinetracer.trace_rays(
+            *args, return_extras=True, min_transmittance=0)
+        color2, extras2 = cpu_ellipsoid_splinetracer.trace_rays(
+            *args, return_extras=True, min_transmittance=min_transmittance)
+
+        self.assertTrue(bool((extras2['iters'] <= extras1['iters']).all()))
+        self.assertLess(int(extras2['iters'].sum()), int(extras1['iters'].sum()))
+        # The skipped hits can only add color weighted by the remaining transmittance.
+        max_color = float((cpu_ellipsoid_splinetracer.SH_C0 * features + 0.5).max())
+        err = (color1[:, :3] - color2[:, :3]).abs().max()
+        self.assertLessEqual(float(err), min_transmittance * max_color + 1e-5)
+
+    def test_default_min_transmittance(self):
+        mean, scale, quat, density, features = random_scene(20, 5)
+        rayo = 0.1*torch.randn(50, 3, device=device) + torch.tensor([0, 0, -1.0])
+        rayd = l2_normalize_th(0.2*torch.randn(50, 3, device=device) + torch.tensor([0, 0, 1.0]))
+        args = (mean, scale, quat, density, features, rayo, rayd, 0, 100)
+        _, extras1 = cpu_ellipsoid_splinetracer.trace_rays(*args, return_extras=True)
+        _, extras2 = cpu_ellipsoid_splinetracer.trace_rays(
+            *args, return_extras=True,
+            min_transmittance=np.exp(-cpu_ellipsoid_splinetracer.LOG_CUTOFF))
+        np.testing.assert_array_equal(extras1['iters'].numpy(), extras2['iters'].numpy())
+
+    @parameterized.product(
+        num_threads = [1, 4],
+        tile_size = [7, 64],
+        prim_block_size = [3, 1024],
+    )
+    def test_tiling_is_transparent(self, num_threads, tile_size, prim_block_size):
+        mean, scale, quat, density, features = random_scene(40, 1)
+        rayo = 0.1*torch.randn(100, 3, device=device) + torch.tensor([0, 0, -1.0])
+        rayd = 0.2*torch.randn(100, 3, device=device) + torch.tensor([0, 0, 1.0])
+
+        color1, extras1 = cpu_ellipsoid_splinetracer.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd,
+                  0, 100, return_extras=True, num_threads=1,
+                  tile_size=rayo.shape[0], prim_block_size=mean.shape[0])
+        color2, extras2 = cpu_ellipsoid_splinetracer.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd,
+                  0, 100, return_extras=True, num_threads=num_threads,
+                  tile_size=tile_size, prim_block_size=prim_block_size)
+
+        np.testing.assert_allclose(color1.numpy(), color2.numpy(), atol=1e-6)
+        np.testing.assert_array_equal(extras1['iters'].numpy(), extras2['iters'].numpy())
+        np.testing.assert_array_equal(extras1['tri_collection'].numpy(), extras2['tri_collection'].numpy())
+        np.testing.assert_array_equal(extras1['touch_count'].numpy(), extras2['touch_count'].numpy())
+
+    def test_extras_layout(self):
+        mean, scale, quat, density, features = random_scene(10, 1)
+        rayo = torch.zeros((3, 3), device=device)
+        rayd = torch.tensor([[0, 0, 1.0]], device=device).expand(3, -1).contiguous()
+        max_iters = 16
+        color, extras = cpu_ellipsoid_splinetracer.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd,
+                  0, 100, max_iters=max_iters, return_extras=True)
+
+        self.assertEqual(color.shape, (3, 5))
+        self.assertEqual(extras['tri_collection'].shape, (3 * max_iters,))
+        self.assertEqual(extras['saved'].states.shape, (3, 16))
+        self.assertEqual(extras['touch_count'].shape, (10,))
+        self.assertEqual(int(extras['touch_count'].sum()), int(extras['iters'].sum()))
+        np.testing.assert_allclose(extras['opacity'].numpy(), color[:, 3].numpy())
+
+if __name__ == "__main__":
+    absltest.main()
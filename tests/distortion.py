@@ -0,0 +1,140 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils import distortion
+
+PARAMS = dict(k1=-0.12, k2=0.03, k3=-0.004, k4=0.0, p1=0.001, p2=-0.0005)
+W, H, FX, FY = 64, 48, 40.0, 42.0
+
+class UndistortTest(parameterized.TestCase):
+    @parameterized.named_parameters(("numpy", np), ("torch", torch))
+    def test_inverts_distort(self, xnp):
+        rng = np.random.default_rng(0)
+        x = rng.uniform(-0.8, 0.8, 1000)
+        y = rng.uniform(-0.6, 0.6, 1000)
+        if xnp is torch:
+            x, y = torch.as_tensor(x), torch.as_tensor(y)
+        xd, yd = distortion.radial_and_tangential_distort(x, y, **PARAMS)
+        xu, yu = distortion.radial_and_tangential_undistort(xd, yd, **PARAMS, xnp=xnp)
+        np.testing.assert_allclose(np.asarray(xu), np.asarray(x), atol=1e-9)
+        np.testing.assert_allclose(np.asarray(yu), np.asarray(y), atol=1e-9)
+
+    @parameterized.named_parameters(("numpy", np), ("torch", torch))
+    def test_convergence_info(self, xnp):
+        rng = np.random.default_rng(3)
+        xd = rng.uniform(-0.8, 0.8, (20, 30))
+        yd = rng.uniform(-0.6, 0.6, (20, 30))
+        xd[0, 0] = yd[0, 0] = 0
+        if xnp is torch:
+            xd, yd = torch.as_tensor(xd), torch.as_tensor(yd)
+        x, y, info = distortion.radial_and_tangential_undistort(
+            xd, yd, **PARAMS, max_iterations=20, xnp=xnp, return_info=True)
+        self.assertEqual(tuple(x.shape), (20, 30))
+        iterations = np.asarray(info.iterations)
+        self.assertEqual(iterations.shape, (20, 30))
+        # The center is a fixed point, the first step is already zero.
+        self.assertEqual(iterations[0, 0], 1)
+        self.assertLess(iterations.max(), 20)
+        self.assertEqual(info.num_active[0], 600)
+        self.assertTrue(all(a >= b for a, b in zip(info.num_active, info.num_active[1:])))
+        self.assertEqual(sum(info.num_active), iterations.sum())
+        self.assertLess(float(np.asarray(info.residual).max()), 1e-12)
+        # Same solution as running every point for all iterations.
+        x_full, y_full = distortion.radial_and_tangential_undistort(
+            xd, yd, **PARAMS, max_iterations=20, xnp=xnp, tol=-1)
+        np.testing.assert_allclose(np.asarray(x), np.asarray(x_full), atol=1e-12)
+        np.testing.assert_allclose(np.asarray(y), np.asarray(y_full), atol=1e-12)
+
+    def test_float32_stops_early(self):
+        rng = np.random.default_rng(5)
+        x = torch.as_tensor(rng.uniform(-0.8, 0.8, 100_000), dtype=torch.float32)
+        y = torch.as_tensor(rng.uniform(-0.6, 0.6, 100_000), dtype=torch.float32)
+        xd, yd = distortion.radial_and_tangential_distort(x, y, **PARAMS)
+        xu, yu, info = distortion.radial_and_tangential_undistort(
+            xd, yd, **PARAMS, xnp=torch, return_info=True)
+        # A step of 1e-12 is below float32 resolution, points stop at a few ulps instead.
+        self.assertLess(len(info.num_active), 10)
+        self.assertLess(int(info.iterations.max()), 10)
+        np.testing.assert_allclose(xu.numpy(), x.numpy(), atol=1e-5)
+        np.testing.assert_allclose(yu.numpy(), y.numpy(), atol=1e-5)
+
+    def test_per_point_params(self):
+        rng = np.random.default_rng(4)
+        x = rng.uniform(-0.5, 0.5, 50)
+        y = rng.uniform(-0.5, 0.5, 50)
+        k1 = np.linspace(-0.2, 0.2, 50)
+        xd, yd = distortion.radial_and_tangential_distort(x, y, k1=k1, p1=0.001)
+        xu, yu = distortion.radial_and_tangential_undistort(xd, yd, k1=k1, p1=0.001)
+        np.testing.assert_allclose(xu, x, atol=1e-9)
+        np.testing.assert_allclose(yu, y, atol=1e-9)
+
+class UndistortionMapTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.map = distortion.UndistortionMap.build(W, H, FX, FY, W / 2, H / 2, PARAMS)
+
+    def test_pixel_centers(self):
+        # Pixel centers and their +1 neighbours, as used by pixels_to_rays.
+        u, v = np.meshgrid(np.arange(W + 1) + 0.5, np.arange(H + 1) + 0.5, indexing="xy")
+        x, y = self.map.lookup(u, v)
+        xs, ys = distortion.UndistortionMap.solve(u, v, FX, FY, W / 2, H / 2, PARAMS)
+        np.testing.assert_allclose(x, xs, atol=1e-6)
+        np.testing.assert_allclose(y, ys, atol=1e-6)
+
+    def test_max_error(self):
+        self.assertGreater(self.map.max_error, 0)
+        self.assertLess(self.map.max_error, 1e-4)
+        rng = np.random.default_rng(1)
+        u = rng.uniform(0.5, W + 0.5, 5000)
+        v = rng.uniform(0.5, H + 0.5, 5000)
+        x, y = self.map.lookup(u, v)
+        xs, ys = distortion.UndistortionMap.solve(u, v, FX, FY, W / 2, H / 2, PARAMS)
+        self.assertLessEqual(max(np.abs(x - xs).max(), np.abs(y - ys).max()), 1.01 * self.map.max_error)
+
+    def test_coarse_step(self):
+        coarse = distortion.UndistortionMap.build(W, H, FX, FY, W / 2, H / 2, PARAMS, step=4)
+        self.assertEqual(coarse.grid.shape, (H // 4 + 1, W // 4 + 1, 2))
+        self.assertGreater(coarse.max_error, self.map.max_error)
+
+    def test_torch_lookup(self):
+        rng = np.random.default_rng(2)
+        u = rng.uniform(0, W + 1, 100)
+        v = rng.uniform(0, H + 1, 100)
+        x, y = self.map.lookup(u, v)
+        xt, yt = self.map.lookup(torch.as_tensor(u, dtype=torch.float32),
+                                 torch.as_tensor(v, dtype=torch.float32), xnp=torch)
+        np.testing.assert_allclose(xt.numpy(), x, atol=1e-5)
+        np.testing.assert_allclose(yt.numpy(), y, atol=1e-5)
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            first = distortion.UndistortionMap.cached(W, H, FX, FY, W / 2, H / 2, PARAMS, cache_dir=d)
+            self.assertLen(os.listdir(d), 1)
+            with mock.patch.object(distortion.UndistortionMap, "build", side_effect=AssertionError):
+                second = distortion.UndistortionMap.cached(W, H, FX, FY, W / 2, H / 2, PARAMS, cache_dir=d)
+            np.testing.assert_array_equal(first.grid, second.grid)
+            self.assertEqual(first.max_error, second.max_error)
+            distortion.UndistortionMap.cached(W, H, FX, FY, W / 2, H / 2, dict(PARAMS, k1=-0.1), cache_dir=d)
+            self.assertLen(os.listdir(d), 2)
+
+if __name__ == "__main__":
+    absltest.main()
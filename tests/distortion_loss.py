@@ -0,0 +1,60 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from jax import config
+config.update("jax_enable_x64", True)
+import numpy as np
+from jaxutil import quadrature
+
+class DistortionLossTest(parameterized.TestCase):
+    @parameterized.product(
+        n = [1, 2, 17, 256],
+        batch_shape = [(), (3,), (2, 5)],
+    )
+    def test_matches_pairwise(self, n, batch_shape):
+        rng = np.random.default_rng(n)
+        t = np.sort(3*rng.random(batch_shape + (n + 1,)), axis=-1)
+        w = rng.random(batch_shape + (n,)) / n
+
+        loss1 = quadrature.lossfun_distortion_pairwise(t, w)
+        loss2 = quadrature.lossfun_distortion(t, w)
+
+        self.assertEqual(loss2.shape, batch_shape)
+        np.testing.assert_allclose(loss1, loss2, atol=1e-12, rtol=1e-10)
+
+    def test_unsorted_intervals(self):
+        rng = np.random.default_rng(0)
+        t = 3*rng.random((4, 33))
+        w = rng.random((4, 32))
+        np.testing.assert_allclose(
+            quadrature.lossfun_distortion_pairwise(t, w),
+            quadrature.lossfun_distortion(t, w), rtol=1e-10)
+
+    @parameterized.parameters(1, 3, 100)
+    def test_batched_shared_tdist(self, batch_size):
+        rng = np.random.default_rng(1)
+        t = np.sort(rng.random(65), axis=-1)
+        w = rng.random((2, 5, 64))
+
+        loss = quadrature.lossfun_distortion_batched(t, w, batch_size=batch_size)
+
+        self.assertEqual(loss.shape, (2, 5))
+        np.testing.assert_allclose(
+            quadrature.lossfun_distortion_pairwise(np.broadcast_to(t, (2, 5, 65)), w),
+            loss, rtol=1e-10)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,106 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import struct
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from integration_utils import frame_codec
+from integration_utils.render_server import Frame, Request, RenderServer, StandInRenderer
+
+H, W = 24, 32
+
+def frame(image, **message):
+    return Frame(Request(0, message, None, 0.0), image, 0.0)
+
+def decode(payload):
+    length, encoding = struct.unpack("<IB", payload[:5])
+    assert length == len(payload) - 4
+    return encoding, payload[5:]
+
+class FrameEncoderTest(parameterized.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.images = [rng.integers(0, 256, (H, W, 3), dtype=np.uint8)]
+        for i in range(4):
+            image = self.images[-1].copy()
+            image[i:i+3, 5:9] = 255 - image[i:i+3, 5:9]
+            self.images.append(image)
+
+    def test_legacy_raw(self):
+        encoder = frame_codec.FrameEncoder()
+        self.assertEqual(encoder(frame(self.images[0])), self.images[0].tobytes())
+        self.assertEqual(encoder(frame(None)), b"")
+
+    def test_fallback_to_raw(self):
+        encoder = frame_codec.FrameEncoder()
+        encoding, payload = decode(encoder(frame(self.images[0], encodings=["bmp"])))
+        self.assertEqual(encoding, frame_codec.ENCODING_IDS["raw"])
+        self.assertEqual(payload, self.images[0].tobytes())
+        encoding, _ = decode(encoder(frame(self.images[0], encodings=["delta"], compressor="brotli")))
+        self.assertEqual(encoding, frame_codec.ENCODING_IDS["raw"])
+
+    def test_delta_roundtrip(self):
+        encoder = frame_codec.FrameEncoder()
+        decoder = frame_codec.DeltaDecoder()
+        sizes = []
+        for image in self.images + [np.zeros((H // 2, W, 3), dtype=np.uint8)]:
+            encoding, payload = decode(encoder(frame(image, encodings=["delta", "raw"])))
+            self.assertEqual(encoding, frame_codec.ENCODING_IDS["delta"])
+            np.testing.assert_array_equal(decoder(payload, *image.shape[:2]), image)
+            sizes.append((payload[0], len(payload)))
+        self.assertEqual([key for key, _ in sizes], [1, 0, 0, 0, 0, 1])
+        self.assertLess(max(size for _, size in sizes[1:5]), sizes[0][1] // 10)
+
+    @parameterized.parameters("jpeg", "png", "webp")
+    def test_image_formats(self, fmt):
+        if frame_codec.cv2 is None:
+            self.skipTest("cv2 is not installed")
+        encoder = frame_codec.FrameEncoder()
+        encoding, payload = decode(encoder(frame(self.images[0], encodings=[fmt], quality=90)))
+        self.assertEqual(encoding, frame_codec.ENCODING_IDS[fmt])
+        image = frame_codec.cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), frame_codec.cv2.IMREAD_COLOR)
+        self.assertEqual(image.shape, (H, W, 3))
+
+class ServerDeltaTest(parameterized.TestCase):
+    def test_server_sends_deltas(self):
+        async def run():
+            server = RenderServer(StandInRenderer(), port=0)
+            await server.start()
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            decoder = frame_codec.DeltaDecoder()
+            images = []
+            for i in range(3):
+                message = dict(resolution_x=W, resolution_y=H, frame_id=7, encodings=["delta"])
+                payload = json.dumps(message).encode("utf-8")
+                writer.write(struct.pack("<I", len(payload)) + payload)
+                await writer.drain()
+                length, encoding = struct.unpack("<IB", await reader.readexactly(5))
+                images.append(decoder(await reader.readexactly(length - 1), H, W))
+                verify_length, = struct.unpack("<I", await reader.readexactly(4))
+                await reader.readexactly(verify_length)
+            writer.close()
+            server.server.close()
+            await server.server.wait_closed()
+            return images, server.stats
+        images, stats = asyncio.run(asyncio.wait_for(run(), 30))
+        for image in images:
+            np.testing.assert_array_equal(image, 7)
+        self.assertLess(stats["sent_bytes"], 3 * H * W * 3)
+
+if __name__ == "__main__":
+    absltest.main()
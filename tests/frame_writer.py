@@ -0,0 +1,123 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from utils import frame_writer
+
+def decode_png(data):
+    """Decodes the unfiltered 8 bit PNGs written by encode_png."""
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    pos, idat = 8, b""
+    while pos < len(data):
+        length, = struct.unpack(">I", data[pos:pos + 4])
+        kind = data[pos + 4:pos + 8]
+        body = data[pos + 8:pos + 8 + length]
+        crc, = struct.unpack(">I", data[pos + 8 + length:pos + 12 + length])
+        assert crc == zlib.crc32(kind + body) & 0xFFFFFFFF
+        if kind == b"IHDR":
+            w, h, depth, color_type = struct.unpack(">IIBB", body[:10])
+        elif kind == b"IDAT":
+            idat += body
+        pos += 12 + length
+    c = {0: 1, 2: 3, 6: 4}[color_type]
+    rows = np.frombuffer(zlib.decompress(idat), np.uint8).reshape(h, 1 + w * c)
+    assert (rows[:, 0] == 0).all()
+    return rows[:, 1:].reshape(h, w, c)
+
+class FakeVideo:
+    def __init__(self):
+        self.frames = []
+        self.closed = False
+
+    def append_data(self, image):
+        time.sleep(0.001 * np.random.rand())
+        self.frames.append(int(image[0, 0, 0]))
+
+    def close(self):
+        self.closed = True
+
+class FrameWriterTest(parameterized.TestCase):
+    @parameterized.parameters(1, 3, 4)
+    def test_encode_png(self, channels):
+        image = np.random.randint(0, 256, (5, 7, channels), dtype=np.uint8)
+        decoded = decode_png(frame_writer.encode_png(image))
+        np.testing.assert_array_equal(decoded, image)
+
+    def test_writes_files_and_video_in_order(self):
+        video = FakeVideo()
+        with tempfile.TemporaryDirectory() as d:
+            with frame_writer.FrameWriter(d, formats=("png", "npy"), video_path="path.mp4",
+                                          num_threads=3, max_pending=2,
+                                          open_video=lambda path, fps: video) as writer:
+                for i in range(10):
+                    writer.submit(i, np.full((4, 6, 3), i / 255, dtype=np.float32))
+            self.assertEqual(writer.num_finished, 10)
+            self.assertEqual(sorted(os.listdir(d))[:2], ["000000.npy", "000000.png"])
+            self.assertLen(os.listdir(d), 20)
+            with open(os.path.join(d, "000007.png"), "rb") as f:
+                np.testing.assert_array_equal(decode_png(f.read()), np.full((4, 6, 3), 7, np.uint8))
+        self.assertEqual(video.frames, list(range(10)))
+        self.assertTrue(video.closed)
+
+    def test_submit_blocks_when_full(self):
+        release = threading.Event()
+        def slow(path, image):
+            release.wait()
+        frame_writer.WRITERS["slow"] = slow
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                writer = frame_writer.FrameWriter(d, formats=("slow",), max_pending=2)
+                writer.submit(0, np.zeros((1, 1, 3)))
+                writer.submit(1, np.zeros((1, 1, 3)))
+                blocked = threading.Thread(target=writer.submit, args=(2, np.zeros((1, 1, 3))))
+                blocked.start()
+                blocked.join(0.2)
+                self.assertTrue(blocked.is_alive())
+                release.set()
+                blocked.join(5)
+                self.assertFalse(blocked.is_alive())
+                writer.close()
+                self.assertEqual(writer.num_finished, 3)
+        finally:
+            del frame_writer.WRITERS["slow"]
+
+    def test_errors_are_raised(self):
+        def fail(path, image):
+            raise IOError("disk full")
+        frame_writer.WRITERS["fail"] = fail
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                # Raised by the next submit once the frame failed, or at the latest by close.
+                with self.assertRaisesRegex(IOError, "disk full"):
+                    with frame_writer.FrameWriter(d, formats=("fail",)) as writer:
+                        for i in range(3):
+                            writer.submit(i, np.zeros((1, 1, 3)))
+        finally:
+            del frame_writer.WRITERS["fail"]
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            frame_writer.FrameWriter(None, formats=("gif",))
+
+if __name__ == "__main__":
+    absltest.main()
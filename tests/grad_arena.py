@@ -0,0 +1,111 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from torch.autograd import Function
+from splinetracers.grad_arena import GradArena
+
+device = torch.device('cpu')
+
+class ArenaDensity(Function):
+    """Returns 2 * density, with its gradient written into arena buffers."""
+    arena = None
+
+    @staticmethod
+    def forward(ctx, density):
+        ctx.shape = density.shape
+        return 2 * density
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        num_prims = grad_output.numel()
+        grads = ArenaDensity.arena.acquire(num_prims, 1, (num_prims, 1, 3), device)
+        grads.dL_ddensities += 2 * grad_output.reshape(-1)
+        grads.clip_()
+        return grads.dL_ddensities.reshape(ctx.shape)
+
+class GradArenaTest(parameterized.TestCase):
+    def setUp(self):
+        self.arena = GradArena()
+        ArenaDensity.arena = self.arena
+
+    def test_reuses_and_zeroes(self):
+        grads1 = self.arena.acquire(10, 20, (10, 1, 3), device)
+        for t in grads1.tensors():
+            t += 1
+        grads2 = self.arena.acquire(10, 20, (10, 1, 3), device)
+        self.assertIs(grads1, grads2)
+        self.assertEqual(self.arena.num_allocations, 1)
+        for t in grads2.tensors():
+            self.assertEqual(float(t.abs().sum()), 0)
+
+    def test_shapes(self):
+        grads = self.arena.acquire(10, 20, (10, 16, 3), device)
+        self.assertEqual(grads.dL_dmeans.shape, (10, 3))
+        self.assertEqual(grads.dL_dquats.shape, (10, 4))
+        self.assertEqual(grads.dL_ddensities.shape, (10,))
+        self.assertEqual(grads.dL_dfeatures.shape, (10, 16, 3))
+        self.assertEqual(grads.dL_drayd.shape, (20, 3))
+        self.assertEqual(grads.dL_dinital_drgb.shape, (20, 4))
+        self.assertEqual(grads.touch_count.dtype, torch.int32)
+
+    def test_referenced_buffers_are_not_reused(self):
+        grads1 = self.arena.acquire(10, 20, (10, 1, 3), device)
+        held = grads1.dL_dfeatures[:, 0]
+        grads2 = self.arena.acquire(10, 20, (10, 1, 3), device)
+        self.assertIsNot(grads1, grads2)
+        del held
+        self.assertIs(self.arena.acquire(10, 20, (10, 1, 3), device), grads1)
+
+    def test_clip_in_place(self):
+        grads = self.arena.acquire(10, 20, (10, 1, 3), device)
+        for t in grads.tensors():
+            if t.dtype == torch.float32:
+                t.copy_(1e5 * torch.randn_like(t))
+        expected = dict(
+            dL_dmeans=grads.dL_dmeans.clip(-1e3, 1e3),
+            dL_ddensities=grads.dL_ddensities.clip(-50, 50),
+            dL_dfeatures=grads.dL_dfeatures.clip(-1e3, 1e3),
+            dL_drayd=grads.dL_drayd.clip(-1e3, 1e3),
+        )
+        ptrs = [t.data_ptr() for t in grads.tensors()]
+        grads.clip_()
+        self.assertEqual(ptrs, [t.data_ptr() for t in grads.tensors()])
+        for key, value in expected.items():
+            np.testing.assert_array_equal(getattr(grads, key).numpy(), value.numpy())
+
+    def test_two_backwards_in_one_graph(self):
+        density = torch.rand(10, 1, device=device, requires_grad=True)
+        loss = (3 * ArenaDensity.apply(density)).sum() + (5 * ArenaDensity.apply(density)).sum()
+        loss.backward()
+        np.testing.assert_allclose(density.grad.numpy(), np.full((10, 1), 16.0))
+
+    def test_repeated_steps_accumulate(self):
+        density = torch.rand(10, 1, device=device, requires_grad=True)
+        for step in range(3):
+            ArenaDensity.apply(density).sum().backward()
+            np.testing.assert_allclose(density.grad.numpy(), np.full((10, 1), 2.0 * (step + 1)))
+        self.assertLessEqual(self.arena.num_allocations, 3)
+
+    def test_key_limit(self):
+        arena = GradArena(max_keys=2)
+        for num_rays in range(5):
+            arena.acquire(10, num_rays + 1, (10, 1, 3), device)
+        self.assertLen(arena.pools, 2)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,71 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils.math_util import l2_normalize_th
+from splinetracers import cpu_ellipsoid_splinetracer
+from splinetracers import hit_lists
+
+device = torch.device('cpu')
+
+class HitListsTest(parameterized.TestCase):
+    @parameterized.product(
+        num_rays = [1, 13, 200],
+        max_iters = [1, 8, 64],
+    )
+    def test_roundtrip(self, num_rays, max_iters):
+        iters = torch.randint(0, max_iters + 1, (num_rays,), dtype=torch.int32, device=device)
+        tri_collection = torch.randint(0, 1000, (max_iters, num_rays), dtype=torch.int32, device=device)
+        tri_collection[torch.arange(max_iters)[:, None] >= iters[None]] = -1
+        tri_collection = tri_collection.reshape(-1)
+
+        offsets, inds = hit_lists.pack(tri_collection, iters, max_iters)
+
+        self.assertEqual(offsets.shape, (num_rays + 1,))
+        self.assertEqual(inds.shape, (int(iters.sum()),))
+        self.assertEqual(int(offsets[-1]), inds.shape[0])
+        np.testing.assert_array_equal(
+            hit_lists.unpack(offsets, inds, max_iters, fill_value=-1).numpy(), tri_collection.numpy())
+        dense = tri_collection.reshape(max_iters, num_rays)
+        for r in range(num_rays):
+            np.testing.assert_array_equal(
+                inds[offsets[r]:offsets[r+1]].numpy(), dense[:iters[r], r].numpy())
+
+    def test_pack_traced_hits(self):
+        N = 20
+        max_iters = 64
+        mean = torch.rand(N, 3, device=device)
+        scale = 0.3*torch.rand(N, 3, device=device)
+        quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1)
+        density = torch.rand(N, 1, device=device)
+        features = torch.rand(N, 1, 3, device=device)
+        rayo = torch.rand(50, 3, device=device) - torch.tensor([0, 0, 1.0])
+        rayd = l2_normalize_th(0.2*torch.randn(50, 3, device=device) + torch.tensor([0, 0, 1.0]))
+
+        _, extras = cpu_ellipsoid_splinetracer.trace_rays(
+            mean, scale, quat, density, features, rayo, rayd, 0, 100,
+            max_iters=max_iters, return_extras=True)
+        offsets, inds = hit_lists.pack(extras['tri_collection'], extras['iters'], max_iters)
+
+        self.assertLess(inds.numel(), extras['tri_collection'].numel())
+        np.testing.assert_array_equal(
+            torch.bincount(inds.long() // 2, minlength=N).numpy(), extras['touch_count'].numpy())
+        np.testing.assert_array_equal(
+            hit_lists.unpack(offsets, inds, max_iters).numpy(), extras['tri_collection'].numpy())
+
+if __name__ == "__main__":
+    absltest.main()
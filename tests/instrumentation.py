@@ -0,0 +1,94 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import torch
+from utils.math_util import l2_normalize_th
+from splinetracers import cpu_ellipsoid_splinetracer
+from splinetracers import instrumentation
+
+def random_scene(N, num_rays):
+    mean = torch.rand(N, 3)
+    scale = 0.3*torch.rand(N, 3)
+    quat = l2_normalize_th(2*torch.rand(N, 4)-1)
+    density = 0.5*torch.rand(N, 1)
+    features = torch.rand(N, 1, 3)
+    rayo = 0.1*torch.randn(num_rays, 3) + torch.tensor([0.5, 0.5, -1.0])
+    rayd = l2_normalize_th(0.1*torch.randn(num_rays, 3) + torch.tensor([0, 0, 1.0]))
+    return (mean, scale, quat, density, features), rayo, rayd
+
+class InstrumentationTest(parameterized.TestCase):
+    def test_disabled(self):
+        self.assertFalse(instrumentation.enabled())
+        self.assertIs(instrumentation.scope("a"), instrumentation.scope("b"))
+        instrumentation.count("rays", 10)
+        instrumentation.histogram("h", torch.ones(3))
+        with instrumentation.recording(use_cuda_events=False) as rec:
+            self.assertTrue(instrumentation.enabled())
+        self.assertFalse(instrumentation.enabled())
+        self.assertEqual(rec.to_dict(), dict(scopes={}, counters={}, histograms={}))
+
+    def test_scopes_counters_histograms(self):
+        with instrumentation.recording(use_cuda_events=False) as rec:
+            for _ in range(3):
+                with instrumentation.scope("outer"):
+                    with instrumentation.scope("inner"):
+                        pass
+            instrumentation.count("rays", 5)
+            instrumentation.count("rays", torch.tensor(7))
+            instrumentation.histogram("touch_count", torch.tensor([0, 1, 2, 3, 4, 9]))
+            instrumentation.histogram("touch_count", torch.tensor([1]))
+        summary = rec.to_dict()
+        self.assertEqual(summary["scopes"]["outer"]["count"], 3)
+        self.assertEqual(summary["scopes"]["inner"]["count"], 3)
+        self.assertLessEqual(summary["scopes"]["inner"]["total_ms"], summary["scopes"]["outer"]["total_ms"])
+        self.assertEqual(summary["counters"], dict(rays=12))
+        self.assertEqual(summary["histograms"]["touch_count"],
+                         {"0": 1, "1": 2, "2-3": 2, "4-7": 1, "8-15": 1})
+
+    def test_chrome_trace(self):
+        with instrumentation.recording(use_cuda_events=False) as rec:
+            with instrumentation.scope("a"):
+                pass
+            instrumentation.count("rays", 3)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "trace.json")
+            rec.write_chrome_trace(path)
+            with open(path) as f:
+                trace = json.load(f)
+        events = trace["traceEvents"]
+        self.assertEqual([e["ph"] for e in events], ["X", "C"])
+        self.assertEqual(events[0]["name"], "a")
+        self.assertGreaterEqual(events[0]["dur"], 0)
+        self.assertEqual(events[1]["args"], dict(rays=3))
+
+    def test_cpu_tracer(self):
+        params, rayo, rayd = random_scene(40, 64)
+        with instrumentation.recording(use_cuda_events=False) as rec:
+            _, extras = cpu_ellipsoid_splinetracer.trace_rays(
+                *params, rayo, rayd, 0, 100, max_iters=128, return_extras=True)
+        summary = rec.to_dict()
+        self.assertEqual(summary["scopes"]["cpu/trace"]["count"], 1)
+        self.assertEqual(summary["counters"]["rays"], 64)
+        self.assertEqual(summary["counters"]["prims"], 40)
+        self.assertEqual(summary["counters"]["iters"], int(extras["iters"].sum()))
+        self.assertEqual(sum(summary["histograms"]["touch_count"].values()), 40)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,129 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils.math_util import l2_normalize_th
+from splinetracers import cpu_ellipsoid_splinetracer
+from splinetracers import iter_budget
+from splinetracers import ray_bounds
+from splinetracers import tiling
+
+device = torch.device('cpu')
+
+def random_scene(N, num_rays):
+    mean = torch.rand(N, 3, device=device)
+    scale = 0.3*torch.rand(N, 3, device=device)
+    quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1)
+    density = 0.5*torch.rand(N, 1, device=device)
+    features = torch.rand(N, 1, 3, device=device)
+    rayo = 0.1*torch.randn(num_rays, 3, device=device) + torch.tensor([0.5, 0.5, -1.0])
+    rayd = l2_normalize_th(0.1*torch.randn(num_rays, 3, device=device) + torch.tensor([0, 0, 1.0]))
+    return (mean, scale, quat, density, features), rayo, rayd
+
+class OverflowTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        torch.manual_seed(0)
+
+    def test_overflow_matches_truncation(self):
+        params, rayo, rayd = random_scene(60, 100)
+        _, full = cpu_ellipsoid_splinetracer.trace_rays(
+            *params, rayo, rayd, 0, 100, max_iters=512, return_extras=True)
+        self.assertEqual(int(full['num_overflow']), 0)
+
+        max_iters = 8
+        _, extras = cpu_ellipsoid_splinetracer.trace_rays(
+            *params, rayo, rayd, 0, 100, max_iters=max_iters, return_extras=True)
+        truncated = full['iters'] > max_iters
+        self.assertGreater(int(truncated.sum()), 0)
+        # Rays with exactly max_iters hits may be reported too.
+        self.assertTrue(bool((full['iters'][extras['overflow']] >= max_iters).all()))
+        self.assertTrue(bool(extras['overflow'][truncated].all()))
+        self.assertEqual(int(extras['num_overflow']), int(extras['overflow'].sum()))
+
+class AdaptiveMaxItersTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        torch.manual_seed(0)
+
+    def test_update(self):
+        policy = iter_budget.AdaptiveMaxIters(
+            initial_max_iters=100, min_iters=16, max_iters_limit=256, quantile=0.5, headroom=1.0)
+        self.assertEqual(policy.max_iters, 112)
+        self.assertEqual(policy.update(torch.full((100,), 40)), 48)
+        self.assertEqual(policy.update(torch.full((100,), 1)), 16)
+        self.assertEqual(policy.update(torch.full((100,), 1000)), 256)
+
+    def test_adaptive_matches_full(self):
+        params = [p.requires_grad_() for p in random_scene(60, 100)[0]]
+        _, rayo, rayd = random_scene(60, 100)
+        color1, extras1 = cpu_ellipsoid_splinetracer.trace_rays(
+            *params, rayo, rayd, 0, 100, max_iters=512, return_extras=True)
+        grads1 = torch.autograd.grad(color1.sum(), params)
+        color2, extras2 = iter_budget.trace_rays_adaptive(
+            cpu_ellipsoid_splinetracer.trace_rays, *params, rayo, rayd, 0, 100,
+            max_iters=8, retrace_max_iters=512, return_extras=True)
+        grads2 = torch.autograd.grad(color2.sum(), params)
+
+        self.assertGreater(extras2['retrace_inds'].numel(), 0)
+        self.assertEqual(int(extras2['num_overflow']), 0)
+        np.testing.assert_allclose(color1.detach().numpy(), color2.detach().numpy(), atol=1e-6)
+        for key in ['iters', 'touch_count']:
+            np.testing.assert_array_equal(extras1[key].numpy(), extras2[key].numpy())
+        for g1, g2 in zip(grads1, grads2):
+            np.testing.assert_allclose(g1.numpy(), g2.numpy(), atol=1e-4, rtol=1e-4)
+
+    @parameterized.product(
+        per_ray_bounds = [False, True],
+        keep_tri_collections = [False, True],
+    )
+    def test_tiled_touch_count(self, per_ray_bounds, keep_tri_collections):
+        params, rayo, rayd = random_scene(60, 100)
+        tmin, tmax = 0.0, 100
+        if per_ray_bounds:
+            # Skipped rays leave gaps in the traced rays of the tiles.
+            tmin = 0.2 * torch.rand(100)
+            tmax = torch.full((100,), 100.0)
+            tmax[::7] = 0
+        _, expected = iter_budget.trace_rays_adaptive(
+            cpu_ellipsoid_splinetracer.trace_rays, *params, rayo, rayd, tmin, tmax,
+            max_iters=8, retrace_max_iters=512, return_extras=True)
+        # 46 rays per tile in the first pass; the tiles of bounded rays skip the missed ones.
+        trace_rays = functools.partial(
+            ray_bounds.trace_rays_bounded,
+            functools.partial(tiling.trace_rays_tiled, cpu_ellipsoid_splinetracer.trace_rays,
+                              keep_tri_collections=keep_tri_collections),
+            per_ray_tmax=True)
+        _, extras = iter_budget.trace_rays_adaptive(
+            trace_rays, *params, rayo, rayd, tmin, tmax,
+            max_iters=8, retrace_max_iters=512, return_extras=True, memory_budget=8000)
+        self.assertGreater(len(extras['tiles']), 1)
+        self.assertGreater(extras['retrace_inds'].numel(), 0)
+        np.testing.assert_array_equal(extras['touch_count'].numpy(), expected['touch_count'].numpy())
+
+    def test_merge_needs_tri_collection(self):
+        params, rayo, rayd = random_scene(10, 8)
+        _, extras = cpu_ellipsoid_splinetracer.trace_rays(
+            *params, rayo, rayd, 0, 100, max_iters=8, return_extras=True)
+        del extras['tri_collection']
+        with self.assertRaises(ValueError):
+            iter_budget.merge_extras(extras, extras, torch.arange(8), 8)
+
+if __name__ == "__main__":
+    absltest.main()
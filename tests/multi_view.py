@@ -0,0 +1,116 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils.math_util import l2_normalize_th
+from splinetracers import cpu_ellipsoid_splinetracer
+from splinetracers import instrumentation
+from splinetracers import multi_view
+from splinetracers import tiling
+from splinetracers import tracer_scene
+
+device = torch.device('cpu')
+
+def lookat(eye):
+    forward = l2_normalize_th(-eye)
+    right = l2_normalize_th(torch.linalg.cross(torch.tensor([0, 1.0, 0]), forward))
+    up = torch.linalg.cross(forward, right)
+    c2w = torch.eye(4)
+    c2w[:3, :3] = torch.stack([right, up, forward], dim=1)
+    c2w[:3, 3] = eye
+    return c2w
+
+class MultiViewTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        torch.manual_seed(0)
+        N = 30
+        self.mean = 0.5*torch.rand(N, 3, device=device) - 0.25
+        self.scale = 0.2*torch.rand(N, 3, device=device)
+        self.quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1)
+        self.density = 2*torch.rand(N, 1, device=device)
+        self.features = [torch.rand(N, 1, 3, device=device) for _ in range(3)]
+        prims = tracer_scene.PyPrimitives(device)
+        prims.add_primitives(self.mean, self.scale, self.quat, None, self.density, self.features[0])
+        self.trace = multi_view.ForwardTrace(
+            prims, tracer_scene.PyGAS(device, prims), tracer_scene.PyForward(device, prims, False),
+            0, 100, 64)
+        h, w = 6, 5
+        ys, xs = torch.meshgrid(torch.linspace(-0.3, 0.3, h), torch.linspace(-0.3, 0.3, w), indexing='ij')
+        self.directions = l2_normalize_th(torch.stack([xs, ys, torch.ones_like(xs)], dim=-1))
+        self.c2ws = torch.stack([lookat(torch.tensor(eye)) for eye in [
+            [0, 0, -2.0], [1.5, 0, -1.5], [0, 1.0, -2.0], [-2.0, 0.2, 0.0]]])
+
+    def reference(self, i, feature_ind):
+        c2w = self.c2ws[i]
+        rayd = self.directions.reshape(-1, 3) @ c2w[:3, :3].T
+        rayo = c2w[:3, 3].expand(rayd.shape)
+        color = cpu_ellipsoid_splinetracer.trace_rays(
+            self.mean, self.scale, self.quat, self.density, self.features[feature_ind],
+            rayo, rayd, 0, 100, max_iters=64)
+        return color[:, :4]
+
+    def test_stack_rays(self):
+        rayo, rayd = multi_view.stack_rays(self.directions, self.c2ws)
+        P = self.directions.shape[0] * self.directions.shape[1]
+        self.assertEqual(rayo.shape, (4 * P, 3))
+        for i, c2w in enumerate(self.c2ws):
+            np.testing.assert_allclose(
+                rayd[i*P:(i+1)*P].numpy(), (self.directions.reshape(-1, 3) @ c2w[:3, :3].T).numpy(), atol=1e-6)
+            np.testing.assert_allclose(rayo[i*P:(i+1)*P].numpy(), c2w[None, :3, 3].expand(P, 3).numpy())
+
+    def test_group_views(self):
+        self.assertEqual(multi_view.group_views(['a', 'b', 'a', None]), [[0, 2], [1], [3]])
+
+    @parameterized.parameters(False, True)
+    def test_matches_single_views(self, split_launches):
+        keys = [0, 1, 0, 2]
+        budget = 7 * tiling.bytes_per_ray(64) if split_launches else None
+        color = multi_view.render_many(
+            self.trace, self.directions, self.c2ws, keys, lambda i: self.features[keys[i]],
+            memory_budget=budget)
+        P = self.directions.shape[0] * self.directions.shape[1]
+        self.assertEqual(color.shape, (4, P, 4))
+        if not split_launches:
+            self.assertEqual(self.trace.num_launches, 3)
+        for i, key in enumerate(keys):
+            np.testing.assert_allclose(color[i].numpy(), self.reference(i, key).numpy(), atol=1e-6)
+
+    def test_retrace_overflow(self):
+        self.trace.max_iters = 2
+        self.trace.retrace_max_iters = 64
+        color = multi_view.render_many(
+            self.trace, self.directions, self.c2ws, [None] * 4, lambda i: self.features[0])
+        self.assertEqual(self.trace.num_launches, 2)
+        self.assertEqual(self.trace.num_overflow, 0)
+        for i in range(4):
+            np.testing.assert_allclose(color[i].numpy(), self.reference(i, 0).numpy(), atol=1e-6)
+
+    def test_launches_are_recorded(self):
+        keys = [0, 1, 0, 2]
+        with instrumentation.recording(use_cuda_events=False) as rec:
+            multi_view.render_many(
+                self.trace, self.directions, self.c2ws, keys, lambda i: self.features[keys[i]])
+        events = rec.to_chrome_trace()["traceEvents"]
+        self.assertLen([e for e in events if e["name"] == "forward/trace"], self.trace.num_launches)
+        summary = rec.to_dict()
+        self.assertGreater(summary["counters"]["rays"], 0)
+        self.assertGreater(summary["counters"]["iters"], 0)
+        self.assertIn("touch_count", summary["histograms"])
+
+if __name__ == "__main__":
+    absltest.main()
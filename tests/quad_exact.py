@@ -0,0 +1,108 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils.math_util import l2_normalize_th
+torch.set_printoptions(precision=10)
+np.set_printoptions(precision=10)
+from splinetracers import quad
+import random
+
+device = torch.device('cpu')
+
+class ExactQuadratureTest(parameterized.TestCase):
+    @parameterized.product(
+        N = [3, 10],
+        density_multi = [1],
+    )
+    def test_matches_sampled_quadrature(self, N, density_multi):
+        rayo = torch.tensor([[0, 0, 0]], dtype=torch.float32, device=device)
+        rayd = torch.tensor([[0, 0, 1]], dtype=torch.float32, device=device)
+
+        mean = 1.2*torch.rand(N, 3, dtype=torch.float32, device=device)-0.2
+        mean[:, 0] *= 0.5
+        mean[:, 1] *= 0.5
+        scale = 0.5*torch.rand(N, 3, dtype=torch.float32, device=device)
+        quat = l2_normalize_th(2*torch.rand(N, 4, dtype=torch.float32, device=device)-1)
+        density = density_multi*torch.rand(N, 1, dtype=torch.float32, device=device)
+        features = torch.rand(N, 1, 3, dtype=torch.float32, device=device)
+
+        tmin = random.random()*0.3
+        color1, extras1 = quad.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd,
+                  tmin, 3, return_extras=True, kernel=quad.query_ellipsoid)
+        color2, extras2 = quad.trace_rays(
+                  mean, scale, quat, density, features, rayo, rayd,
+                  tmin, 3, return_extras=True)
+
+        np.testing.assert_allclose(np.array(color1)[:, :4], np.array(color2)[:, :4], atol=1e-5, rtol=1e-5)
+        np.testing.assert_allclose(extras1['total_density'], extras2['total_density'], atol=1e-3, rtol=1e-3)
+
+    def test_rays_are_independent(self):
+        N = 10
+        mean = torch.rand(N, 3, device=device)
+        scale = 0.3*torch.rand(N, 3, device=device)
+        quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1)
+        density = torch.rand(N, 1, device=device)
+        features = torch.rand(N, 1, 3, device=device)
+        rayo = torch.rand(8, 3, device=device) - torch.tensor([0, 0, 1.0])
+        rayd = l2_normalize_th(0.2*torch.randn(8, 3, device=device) + torch.tensor([0, 0, 1.0]))
+
+        batched = quad.trace_rays(mean, scale, quat, density, features, rayo, rayd, 0, 5)
+        for i in range(rayo.shape[0]):
+            single = quad.trace_rays(
+                mean, scale, quat, density, features, rayo[i:i+1], rayd[i:i+1], 0, 5)
+            np.testing.assert_allclose(np.array(batched)[i], np.array(single)[0], atol=1e-12)
+
+    @parameterized.product(
+        kernel = [None, quad.query_ellipsoid, quad.query_l1],
+        ray_chunk_size = [None, 3],
+        prim_block_size = [None, 4],
+    )
+    def test_chunking_is_transparent(self, kernel, ray_chunk_size, prim_block_size):
+        N = 10
+        mean = torch.rand(N, 3, device=device)
+        scale = 0.3*torch.rand(N, 3, device=device)
+        quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1)
+        density = torch.rand(N, 1, device=device)
+        features = torch.rand(N, 1, 3, device=device)
+        rayo = torch.rand(8, 3, device=device) - torch.tensor([0, 0, 1.0])
+        rayd = l2_normalize_th(0.2*torch.randn(8, 3, device=device) + torch.tensor([0, 0, 1.0]))
+
+        kwargs = dict(kernel=kernel, num_quad=2**10, return_extras=True)
+        color1, extras1 = quad.trace_rays(
+            mean, scale, quat, density, features, rayo, rayd, 0, 3, **kwargs)
+        color2, extras2 = quad.trace_rays(
+            mean, scale, quat, density, features, rayo, rayd, 0, 3, **kwargs,
+            ray_chunk_size=ray_chunk_size, prim_block_size=prim_block_size, memory_budget=2**16)
+
+        np.testing.assert_allclose(np.array(color1), np.array(color2), atol=1e-12)
+        np.testing.assert_allclose(extras1['weights'], extras2['weights'], atol=1e-12)
+
+    def test_plan_chunks_respects_budget(self):
+        budget = 2**20
+        ray_chunk_size, prim_block_size = quad.plan_chunks(10**6, 500, 64, budget)
+        self.assertEqual(prim_block_size, 500)
+        self.assertLessEqual(ray_chunk_size * prim_block_size * 64, budget)
+        ray_chunk_size, prim_block_size = quad.plan_chunks(10**6, 500, 2**16, budget)
+        self.assertEqual(ray_chunk_size, 1)
+        self.assertEqual(prim_block_size, 16)
+        self.assertEqual(quad.plan_chunks(10, 500, 2**30, budget), (1, 1))
+        self.assertEqual(quad.plan_chunks(10, 5, 1, budget, ray_chunk_size=4), (4, 5))
+
+if __name__ == "__main__":
+    absltest.main()
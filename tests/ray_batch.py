@@ -0,0 +1,76 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from scipy.spatial.transform import Rotation
+from utils.math_util import l2_normalize_th
+from utils import ray_batch
+
+def random_c2ws(k, seed=0):
+    c2ws = torch.eye(4).repeat(k, 1, 1).double()
+    c2ws[:, :3, :3] = torch.as_tensor(Rotation.random(k, random_state=seed).as_matrix())
+    c2ws[:, :3, 3] = torch.randn(k, 3, dtype=torch.float64)
+    return c2ws
+
+class RayBatchTest(parameterized.TestCase):
+    def test_matches_per_camera_rays(self):
+        grid_a = l2_normalize_th(torch.randn(12, 3, dtype=torch.float64))
+        grid_b = l2_normalize_th(torch.randn(20, 3, dtype=torch.float64))
+        grids = [grid_a, grid_b, grid_a, grid_b]
+        c2ws = random_c2ws(4)
+        pixel_inds = [torch.tensor([3, 0, 7]), None, torch.tensor([11]), torch.tensor([5, 5, 19])]
+        batch = ray_batch.build_ray_batch(grids, c2ws, pixel_inds)
+        self.assertEqual(batch.num_cameras, 4)
+        self.assertEqual(batch.offsets.tolist(), [0, 3, 23, 24, 27])
+        self.assertTrue(batch.origins.is_contiguous() and batch.directions.is_contiguous())
+        for k in range(4):
+            inds = torch.arange(grids[k].shape[0]) if pixel_inds[k] is None else pixel_inds[k]
+            origins, directions = batch.camera(k)
+            np.testing.assert_allclose(directions.numpy(), (grids[k][inds] @ c2ws[k, :3, :3].T).numpy(), atol=1e-12)
+            np.testing.assert_allclose(origins.numpy(), c2ws[k, :3, 3].expand(len(inds), 3).numpy())
+            self.assertTrue(bool((batch.camera_ids[batch.offsets[k]:batch.offsets[k + 1]] == k).all()))
+
+    def test_equal_cameras(self):
+        grid = l2_normalize_th(torch.randn(16, 3, dtype=torch.float64))
+        c2ws = random_c2ws(3)
+        batch = ray_batch.build_ray_batch([grid] * 3, c2ws)
+        for k in range(3):
+            np.testing.assert_allclose(batch.camera(k)[1].numpy(), (grid @ c2ws[k, :3, :3].T).numpy(), atol=1e-12)
+
+    def test_gradients(self):
+        grid = l2_normalize_th(torch.randn(6, 3, dtype=torch.float64))
+        c2ws = random_c2ws(2).requires_grad_()
+        batch = ray_batch.build_ray_batch([grid, grid], c2ws, [torch.tensor([0, 2]), None])
+        batch.directions.sum().backward()
+        expected = torch.zeros(2, 3, 3, dtype=torch.float64)
+        expected[0] = grid[[0, 2]].sum(dim=0).expand(3, 3)
+        expected[1] = grid.sum(dim=0).expand(3, 3)
+        np.testing.assert_allclose(c2ws.grad[:, :3, :3].numpy(), expected.numpy(), atol=1e-12)
+
+    def test_split(self):
+        grid = torch.randn(5, 3)
+        batch = ray_batch.build_ray_batch([grid, grid], random_c2ws(2).float(), [torch.tensor([1]), None])
+        parts = batch.split(torch.arange(6))
+        self.assertEqual([p.tolist() for p in parts], [[0], [1, 2, 3, 4, 5]])
+
+    def test_c2ws_from_world_views(self):
+        c2ws = random_c2ws(3)
+        world_views = torch.linalg.inv(c2ws).transpose(-1, -2)
+        np.testing.assert_allclose(ray_batch.c2ws_from_world_views(world_views).numpy(), c2ws.numpy(), atol=1e-12)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,128 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils import scene_bounds
+from utils.math_util import l2_normalize_th
+from splinetracers import cpu_ellipsoid_splinetracer
+from splinetracers import ray_bounds
+
+device = torch.device('cpu')
+trace_rays = cpu_ellipsoid_splinetracer.trace_rays
+
+def random_scene(N, num_rays):
+    mean = torch.rand(N, 3, device=device)
+    scale = 0.3*torch.rand(N, 3, device=device)
+    quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1)
+    density = 2*torch.rand(N, 1, device=device)
+    features = torch.rand(N, 1, 3, device=device)
+    rayo = 0.1*torch.randn(num_rays, 3, device=device) + torch.tensor([0.5, 0.5, -1.0])
+    rayd = l2_normalize_th(0.3*torch.randn(num_rays, 3, device=device) + torch.tensor([0, 0, 1.0]))
+    return (mean, scale, quat, density, features), rayo, rayd
+
+class PerRayBoundsTest(parameterized.TestCase):
+    def test_constant_tensors_match_scalars(self):
+        params, rayo, rayd = random_scene(30, 64)
+        expected = trace_rays(*params, rayo, rayd, 0.3, 2.0)
+        out = trace_rays(*params, rayo, rayd, torch.full((64,), 0.3), torch.full((64,), 2.0))
+        np.testing.assert_allclose(out.numpy(), expected.numpy(), atol=1e-5)
+
+    def test_matches_per_ray_scalar_calls(self):
+        params, rayo, rayd = random_scene(30, 16)
+        tmin = 0.5 * torch.rand(16)
+        tmax = 0.5 + 2 * torch.rand(16)
+        out = trace_rays(*params, rayo, rayd, tmin, tmax)
+        for i in range(16):
+            expected = trace_rays(*params, rayo[i:i+1], rayd[i:i+1], float(tmin[i]), float(tmax[i]))
+            np.testing.assert_allclose(out[i].numpy(), expected[0].numpy(), atol=1e-5)
+
+    def test_misses_are_skipped(self):
+        params, rayo, rayd = random_scene(30, 64)
+        tmax = torch.full((64,), 5.0)
+        tmax[::3] = 0
+        traced = []
+        def trace(*args, **kwargs):
+            traced.append(args[5].shape[0])
+            return trace_rays(*args, **kwargs)
+        out, extras = ray_bounds.trace_rays_bounded(
+            trace, *params, rayo, rayd, 0.0, tmax, max_iters=64, return_extras=True, per_ray_tmax=True)
+        self.assertEqual(traced, [64 - 22])
+        np.testing.assert_array_equal(out[::3].numpy(), 0)
+        np.testing.assert_array_equal(extras['iters'][::3].numpy(), 0)
+        tri_collection = extras['tri_collection'].reshape(64, 64)
+        self.assertEqual(tuple(extras['saved'].states.shape), (64, 16))
+        np.testing.assert_array_equal(extras['traced_inds'].numpy(), np.nonzero(np.arange(64) % 3)[0])
+        hit = tmax > 0
+        expected, expected_extras = trace_rays(
+            *params, rayo[hit], rayd[hit], 0.0, 5.0, max_iters=64, return_extras=True)
+        np.testing.assert_allclose(out[hit].numpy(), expected.numpy())
+        np.testing.assert_array_equal(tri_collection[:, hit].numpy(),
+                                      expected_extras['tri_collection'].reshape(64, -1).numpy())
+
+    def test_all_missed(self):
+        params, rayo, rayd = random_scene(10, 8)
+        with mock.patch.object(cpu_ellipsoid_splinetracer, "trace_tile", side_effect=AssertionError):
+            out, extras = trace_rays(*params, rayo, rayd, 0.0, torch.zeros(8), max_iters=32, return_extras=True)
+        np.testing.assert_array_equal(out.numpy(), 0)
+        self.assertEqual(int(extras['num_overflow']), 0)
+        self.assertEqual(tuple(extras['touch_count'].shape), (10,))
+
+    def test_scene_bounds(self):
+        params, rayo, rayd = random_scene(30, 200)
+        # Half of the rays look away from the scene.
+        rayd[100:] = -rayd[100:]
+        bounds = scene_bounds.SceneBounds.from_ellipsoids(params[0], params[1])
+        tmin, tmax = bounds.clip(rayo, rayd, 0.0, 100.0)
+        self.assertTrue(bool((tmax[100:] == 0).all()))
+        expected = trace_rays(*params, rayo, rayd, 0.0, 100.0)
+        # Clipping to bounds that hold every ellipsoid does not change the image,
+        # also when the tracer can only clip at the largest tmax. The distortion
+        # loss is measured from the ray start, which moved.
+        for per_ray_tmax in (False, True):
+            out = ray_bounds.trace_rays_bounded(
+                trace_rays, *params, rayo, rayd, tmin, tmax, per_ray_tmax=per_ray_tmax)
+            np.testing.assert_allclose(out[:, :4].numpy(), expected[:, :4].numpy(), atol=1e-4)
+
+    def test_tiled(self):
+        params, rayo, rayd = random_scene(20, 100)
+        tmin = 0.3 * torch.rand(100)
+        tmax = 3 * torch.rand(100)
+        expected = trace_rays(*params, rayo, rayd, tmin, tmax, max_iters=32)
+        # tmax stays per ray through the tiles of the memory budget.
+        out = trace_rays(*params, rayo, rayd, tmin.clamp(max=0.0), tmax + 1, max_iters=32, memory_budget=20_000)
+        reference = trace_rays(*params, rayo, rayd, 0.0, tmax + 1, max_iters=32)
+        np.testing.assert_allclose(out.numpy(), reference.numpy(), atol=1e-5)
+        out = trace_rays(*params, rayo, rayd, tmin, tmax, max_iters=32, memory_budget=20_000)
+        np.testing.assert_allclose(out.numpy(), expected.numpy(), atol=1e-5)
+
+    def test_gradients(self):
+        params, rayo, rayd = random_scene(10, 32)
+        density = params[3].clone().requires_grad_()
+        tmax = torch.full((32,), 3.0)
+        tmax[:8] = 0
+        out = trace_rays(params[0], params[1], params[2], density, params[4], rayo, rayd, 0.0, tmax)
+        out[:, :3].sum().backward()
+        expected_density = params[3].clone().requires_grad_()
+        expected = trace_rays(params[0], params[1], params[2], expected_density, params[4],
+                              rayo[8:], rayd[8:], 0.0, 3.0)
+        expected[:, :3].sum().backward()
+        np.testing.assert_allclose(density.grad.numpy(), expected_density.grad.numpy(), atol=1e-5)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,65 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import torch
+from utils import ray_cache
+
+class ByteLRUCacheTest(parameterized.TestCase):
+    def grid(self, h, w):
+        return lambda: torch.zeros((h * w, 3), dtype=torch.float32)
+
+    def test_hit_returns_same_tensor(self):
+        cache = ray_cache.ByteLRUCache()
+        key = ray_cache.camera_key(8, 4, 10, 10, 4, 2)
+        t1 = cache.get(key, self.grid(4, 8))
+        t2 = cache.get(key, self.fail)
+        self.assertIs(t1, t2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.nbytes, 4 * 8 * 3 * 4)
+
+    def fail(self):
+        raise AssertionError("cache hit expected")
+
+    def test_evicts_least_recently_used(self):
+        cache = ray_cache.ByteLRUCache(max_bytes=3 * 100 * 12)
+        for i in range(3):
+            cache.get(i, self.grid(10, 10))
+        cache.get(0, self.fail)
+        cache.get(3, self.grid(10, 10))
+        self.assertEqual(list(cache.entries), [2, 0, 3])
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        cache.resize(100 * 12)
+        self.assertEqual(list(cache.entries), [3])
+
+    def test_oversized_is_not_cached(self):
+        cache = ray_cache.ByteLRUCache(max_bytes=100)
+        cache.get(0, self.grid(10, 10))
+        self.assertLen(cache, 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_camera_key(self):
+        key = lambda **kw: ray_cache.camera_key(640, 480, 500.0, 500.0, 320, 240, **kw)
+        self.assertEqual(key(), ray_cache.camera_key(640, 480, 500, 500, 320.0, 240.0))
+        self.assertEqual(
+            key(distortion_params=dict(k1=0.1, k2=0.0)),
+            key(distortion_params=dict(k2=0.0, k1=0.1)))
+        self.assertNotEqual(key(distortion_params=dict(k1=0.1)), key(distortion_params=dict(k1=0.2)))
+        self.assertNotEqual(key(model='fisheye'), key())
+        self.assertNotEqual(key(device='cpu'), key())
+        self.assertNotEqual(ray_cache.camera_key(640, 480, 501, 500, 320, 240), key())
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,124 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import struct
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from integration_utils.render_server import RenderServer, StandInRenderer, LatestSlot, CLOSED
+
+W, H = 8, 4
+VERIFY = "scene"
+
+def request(frame_id, width=W, height=H):
+    payload = json.dumps(dict(resolution_x=width, resolution_y=height, frame_id=frame_id)).encode("utf-8")
+    return struct.pack("<I", len(payload)) + payload
+
+async def read_reply(reader, num_bytes):
+    image = await reader.readexactly(num_bytes)
+    length, = struct.unpack("<I", await reader.readexactly(4))
+    verify = (await reader.readexactly(length)).decode("ascii")
+    return image, verify
+
+class LatestSlotTest(parameterized.TestCase):
+    def test_latest_wins(self):
+        async def run():
+            slot = LatestSlot()
+            for i in range(3):
+                slot.put(i)
+            first = await slot.get()
+            slot.close()
+            return first, await slot.get(), slot.num_dropped
+        self.assertEqual(asyncio.run(run()), (2, CLOSED, 2))
+
+class RenderServerTest(parameterized.TestCase):
+    def serve(self, client, delay=0.0, renderer=None):
+        async def run():
+            server = RenderServer(renderer or StandInRenderer(delay), verify=VERIFY, port=0)
+            await server.start()
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            try:
+                result = await client(reader, writer)
+            finally:
+                writer.close()
+                server.server.close()
+                await server.server.wait_closed()
+            return result, server.stats
+        return asyncio.run(asyncio.wait_for(run(), 30))
+
+    def test_request_reply(self):
+        async def client(reader, writer):
+            frames = []
+            for i in range(5):
+                writer.write(request(i))
+                await writer.drain()
+                frames.append(await read_reply(reader, W * H * 3))
+            return frames
+        frames, stats = self.serve(client)
+        for i, (image, verify) in enumerate(frames):
+            self.assertEqual(verify, VERIFY)
+            np.testing.assert_array_equal(np.frombuffer(image, dtype=np.uint8), i)
+        self.assertEqual(stats["rendered"], 5)
+
+    def test_empty_request_only_verifies(self):
+        async def client(reader, writer):
+            writer.write(request(0, width=0, height=0))
+            await writer.drain()
+            return await read_reply(reader, 0)
+        (image, verify), stats = self.serve(client)
+        self.assertEqual((image, verify), (b"", VERIFY))
+        self.assertEqual(stats["rendered"], 0)
+
+    def test_stale_requests_are_dropped(self):
+        num_requests = 20
+        async def client(reader, writer):
+            for i in range(num_requests):
+                writer.write(request(i))
+            await writer.drain()
+            frames = []
+            while True:
+                image, _ = await read_reply(reader, W * H * 3)
+                frames.append(int(np.frombuffer(image, dtype=np.uint8)[0]))
+                if frames[-1] == num_requests - 1:
+                    return frames
+        frames, stats = self.serve(client, delay=0.05)
+        self.assertLess(len(frames), num_requests)
+        self.assertEqual(frames, sorted(frames))
+        self.assertEqual(stats["received"], num_requests)
+
+    def test_render_errors_keep_serving(self):
+        stand_in = StandInRenderer()
+        def renderer(message):
+            if message["frame_id"] == 1:
+                raise RuntimeError("render failed")
+            return stand_in(message)
+        async def client(reader, writer):
+            frames = []
+            for i in range(3):
+                writer.write(request(i + 1))
+                await writer.drain()
+                frames.append(await read_reply(reader, W * H * 3))
+            return frames
+        frames, stats = self.serve(client, renderer=renderer)
+        for (image, verify), expected in zip(frames, [0, 2, 3]):
+            self.assertEqual(verify, VERIFY)
+            np.testing.assert_array_equal(np.frombuffer(image, dtype=np.uint8), expected)
+        self.assertEqual(stats["render_errors"], 1)
+        self.assertEqual(stats["rendered"], 2)
+
+if __name__ == "__main__":
+    absltest.main()
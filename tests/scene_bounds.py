@@ -0,0 +1,100 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils import scene_bounds
+from utils.math_util import l2_normalize_th
+
+AABB = torch.tensor([[-1.0, -1.0, -1.0], [1.0, 2.0, 1.0]])
+
+class IntersectionTest(parameterized.TestCase):
+    def test_box_numpy_and_torch(self):
+        rng = np.random.default_rng(0)
+        rayo = rng.normal(size=(100, 3)) * 3
+        rayd = rng.normal(size=(100, 3))
+        t0, t1 = scene_bounds.ray_box_intersection(rayo, rayd, AABB.double().numpy())
+        tt0, tt1 = scene_bounds.ray_box_intersection(
+            torch.as_tensor(rayo), torch.as_tensor(rayd), AABB.double(), xnp=torch)
+        np.testing.assert_allclose(tt0.numpy(), t0)
+        np.testing.assert_allclose(tt1.numpy(), t1)
+        # Points between enter and exit are inside the box.
+        hit = t0 < t1
+        mid = rayo[hit] + 0.5 * (t0 + t1)[hit, None] * rayd[hit]
+        self.assertTrue(np.all((mid >= AABB[0].numpy() - 1e-9) & (mid <= AABB[1].numpy() + 1e-9)))
+
+    def test_sphere(self):
+        rayo = torch.tensor([[0.0, 0.0, -5.0], [0.0, 3.0, -5.0]])
+        rayd = torch.tensor([[0.0, 0.0, 2.0], [0.0, 0.0, 1.0]])
+        t0, t1, hit = scene_bounds.ray_sphere_intersection(rayo, rayd, torch.zeros(3), 2.0, xnp=torch)
+        np.testing.assert_allclose(t0.numpy(), [1.5, 0.0])
+        np.testing.assert_allclose(t1.numpy(), [3.5, 0.0])
+        np.testing.assert_array_equal(hit.numpy(), [True, False])
+
+class SceneBoundsTest(parameterized.TestCase):
+    def test_clip_box(self):
+        bounds = scene_bounds.SceneBounds(aabb=AABB)
+        rayo = torch.tensor([[0.0, 0.0, -3.0], [0.0, 0.0, 0.0], [0.0, 5.0, -3.0], [0.0, 0.0, -3.0]])
+        rayd = torch.tensor([[0.0, 0.0, 2.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, 0.0, -1.0]])
+        tmin, tmax = bounds.clip(rayo, rayd, tmin=0.2, tmax=100)
+        # Enters at z=-1 (t=1) and leaves at z=1 (t=2), a distance of 2.
+        np.testing.assert_allclose(tmin[0], 1.0)
+        np.testing.assert_allclose(tmax[0], 2.0)
+        # Starting inside, the near plane is kept.
+        np.testing.assert_allclose(tmin[1], 0.2)
+        np.testing.assert_allclose(tmax[1], 0.8, rtol=1e-6)
+        # Misses, also behind the camera.
+        self.assertEqual(float(tmax[2]), 0)
+        self.assertEqual(float(tmax[3]), 0)
+
+    def test_clip_keeps_far_plane(self):
+        bounds = scene_bounds.SceneBounds(aabb=AABB)
+        rayo = torch.tensor([[0.0, 0.0, -3.0]])
+        rayd = torch.tensor([[0.0, 0.0, 1.0]])
+        tmin, tmax = bounds.clip(rayo, rayd, tmin=0.0, tmax=2.5)
+        np.testing.assert_allclose(tmin, [2.0])
+        np.testing.assert_allclose(tmax, [0.5])
+        _, tmax = bounds.clip(rayo, rayd, tmin=0.0, tmax=1.5)
+        self.assertEqual(float(tmax[0]), 0)
+
+    def test_clip_sphere(self):
+        bounds = scene_bounds.SceneBounds(center=torch.tensor([0.0, 0.0, 1.0]), radius=1.0)
+        rayo = torch.zeros(2, 3)
+        rayd = torch.tensor([[0.0, 0.0, 1.0], [1.0, 0.0, 0.0]])
+        tmin, tmax = bounds.clip(rayo, rayd, tmin=0.5)
+        np.testing.assert_allclose(tmin[0], 0.5)
+        np.testing.assert_allclose(tmax.numpy(), [1.5, 0.0], atol=1e-6)
+
+    def test_from_ellipsoids(self):
+        mean = torch.rand(50, 3)
+        scale = 0.1 * torch.rand(50, 3)
+        bounds = scene_bounds.SceneBounds.from_ellipsoids(mean, scale)
+        self.assertTrue(bool((bounds.aabb[0] <= mean - scale).all()))
+        self.assertTrue(bool((bounds.aabb[1] >= mean + scale).all()))
+        # Rays from outside towards the center all hit it.
+        rayo = torch.tensor([0.5, 0.5, -3.0]).expand(10, 3)
+        rayd = l2_normalize_th(torch.tensor([0.0, 0.0, 1.0]) + 0.05 * torch.randn(10, 3))
+        _, tmax = bounds.clip(rayo, rayd)
+        self.assertTrue(bool((tmax > 0).all()))
+
+    def test_needs_a_volume(self):
+        with self.assertRaises(ValueError):
+            scene_bounds.SceneBounds()
+        with self.assertRaises(ValueError):
+            scene_bounds.SceneBounds(aabb=AABB, center=torch.zeros(3), radius=1.0)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,80 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import struct
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from scipy.spatial.transform import Rotation
+from utils import camera_path
+from utils import sibr_path
+
+def random_records(n, seed=0):
+    rng = np.random.default_rng(seed)
+    records = np.empty((n, 11), np.float32)
+    records[:, :3] = rng.normal(size=(n, 3))
+    records[:, 3:7] = Rotation.random(n, random_state=seed).as_quat()
+    records[:, 7:] = [0.8, 1.2, 0.01, 100]
+    return records
+
+def write_with_struct(path, records):
+    """Writes a .path file the way SIBR does, one float at a time."""
+    with open(path, "wb") as f:
+        f.write(struct.pack(">i", len(records)))
+        for value in records.reshape(-1):
+            f.write(struct.pack(">f", value))
+
+class SibrPathTest(parameterized.TestCase):
+    @parameterized.parameters(False, True)
+    def test_read_write(self, mmap):
+        records = random_records(50)
+        with tempfile.TemporaryDirectory() as d:
+            reference = os.path.join(d, "reference.path")
+            write_with_struct(reference, records)
+            np.testing.assert_array_equal(sibr_path.read(reference, mmap=mmap), records)
+            path = os.path.join(d, "written.path")
+            sibr_path.write(path, records)
+            with open(reference, "rb") as a, open(path, "rb") as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_truncated(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "truncated.path")
+            with open(path, "wb") as f:
+                f.write(struct.pack(">i", 3) + b"\0" * 44)
+            with self.assertRaises(ValueError):
+                sibr_path.read(path)
+
+    def test_records_to_c2w(self):
+        records = random_records(20)
+        c2w = sibr_path.records_to_c2w(records)
+        np.testing.assert_allclose(c2w[:, :, :3], Rotation.from_quat(records[:, 3:7]).as_matrix(), atol=1e-6)
+        np.testing.assert_allclose(c2w[:, :, 3], records[:, :3])
+        np.testing.assert_allclose(sibr_path.records_to_world_view(records),
+                                   camera_path.world_view_from_c2w(c2w))
+
+    def test_c2w_to_records(self):
+        records = random_records(100, seed=3)
+        # Cover the branches for every largest quaternion component.
+        records[:4, 3:7] = np.eye(4)
+        records[:, 3:7] *= np.where(records[:, 6:7] < 0, -1, 1)
+        c2w = sibr_path.records_to_c2w(records)
+        back = sibr_path.c2w_to_records(c2w, 0.8, 1.2, 0.01, 100)
+        np.testing.assert_allclose(back, records, atol=1e-6)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,125 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import weakref
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils.math_util import l2_normalize_th
+from splinetracers import cpu_ellipsoid_splinetracer
+from splinetracers import tiling
+
+device = torch.device('cpu')
+
+class PlanTilesTest(parameterized.TestCase):
+    @parameterized.product(
+        num_rays = [1, 1000, 3840*2160],
+        max_iters = [16, 400],
+        memory_budget = [2**20, 2**30],
+    )
+    def test_tiles_cover_rays_within_budget(self, num_rays, max_iters, memory_budget):
+        tiles = tiling.plan_tiles(num_rays, max_iters, memory_budget)
+        self.assertEqual(tiles[0][0], 0)
+        self.assertEqual(tiles[-1][1], num_rays)
+        for (s1, e1), (s2, e2) in zip(tiles[:-1], tiles[1:]):
+            self.assertEqual(e1, s2)
+        for s, e in tiles:
+            self.assertLessEqual((e - s) * tiling.bytes_per_ray(max_iters), memory_budget)
+
+    def test_no_budget_is_one_tile(self):
+        self.assertEqual(tiling.plan_tiles(123, 400, None), [(0, 123)])
+
+    def test_budget_too_small(self):
+        with self.assertRaises(ValueError):
+            tiling.plan_tiles(10, 400, tiling.bytes_per_ray(400) - 1)
+
+class TiledTraceTest(parameterized.TestCase):
+    @parameterized.parameters(1, 7, 33)
+    def test_matches_untiled(self, rays_per_tile):
+        N = 30
+        max_iters = 32
+        mean = torch.rand(N, 3, device=device).requires_grad_()
+        scale = (0.3*torch.rand(N, 3, device=device)).requires_grad_()
+        quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1).requires_grad_()
+        density = torch.rand(N, 1, device=device).requires_grad_()
+        features = torch.rand(N, 1, 3, device=device).requires_grad_()
+        params = [mean, scale, quat, density, features]
+        rayo = torch.rand(100, 3, device=device) - torch.tensor([0, 0, 1.0])
+        rayd = l2_normalize_th(0.2*torch.randn(100, 3, device=device) + torch.tensor([0, 0, 1.0]))
+
+        color1, extras1 = cpu_ellipsoid_splinetracer.trace_rays(
+            *params, rayo, rayd, 0, 100, max_iters=max_iters, return_extras=True)
+        grads1 = torch.autograd.grad(color1.sum(), params)
+        color2, extras2 = tiling.trace_rays_tiled(
+            cpu_ellipsoid_splinetracer.trace_rays, *params, rayo, rayd, 0, 100,
+            max_iters=max_iters, return_extras=True, keep_tri_collections=True,
+            memory_budget=rays_per_tile*tiling.bytes_per_ray(max_iters))
+        grads2 = torch.autograd.grad(color2.sum(), params)
+
+        self.assertLen(extras2['tiles'], (100 + rays_per_tile - 1) // rays_per_tile)
+        np.testing.assert_allclose(color1.detach().numpy(), color2.detach().numpy(), atol=1e-6)
+        for key in ['iters', 'touch_count']:
+            np.testing.assert_array_equal(extras1[key].numpy(), extras2[key].numpy())
+        np.testing.assert_allclose(extras1['saved'].states.numpy(), extras2['saved'].states.numpy(), atol=1e-6)
+        for g1, g2 in zip(grads1, grads2):
+            np.testing.assert_allclose(g1.numpy(), g2.numpy(), atol=1e-4, rtol=1e-4)
+
+        tri_collection = extras1['tri_collection'].reshape(max_iters, -1)
+        for (s, e), tile_tris in zip(extras2['tiles'], extras2['tile_tri_collections']):
+            np.testing.assert_array_equal(
+                tri_collection[:, s:e].numpy(), tile_tris.reshape(max_iters, -1).numpy())
+
+    @parameterized.product(
+        return_extras = [False, True],
+        requires_grad = [False, True],
+        keep_tri_collections = [False, True],
+    )
+    def test_frees_tile_buffers(self, return_extras, requires_grad, keep_tri_collections):
+        N = 30
+        max_iters = 32
+        mean = torch.rand(N, 3, device=device).requires_grad_(requires_grad)
+        scale = 0.3*torch.rand(N, 3, device=device)
+        quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1)
+        density = torch.rand(N, 1, device=device)
+        features = torch.rand(N, 1, 3, device=device)
+        rayo = torch.rand(100, 3, device=device) - torch.tensor([0, 0, 1.0])
+        rayd = l2_normalize_th(0.2*torch.randn(100, 3, device=device) + torch.tensor([0, 0, 1.0]))
+
+        # Counts the tri_collections of earlier tiles that are alive when a tile starts.
+        buffers = []
+        alive = []
+        def trace_rays(*args, return_extras, **kwargs):
+            alive.append(sum(ref() is not None for ref in buffers))
+            out, extras = cpu_ellipsoid_splinetracer.trace_rays(*args, return_extras=True, **kwargs)
+            buffers.append(weakref.ref(extras['tri_collection']))
+            return (out, extras) if return_extras else out
+
+        out = tiling.trace_rays_tiled(
+            trace_rays, mean, scale, quat, density, features, rayo, rayd, 0, 100,
+            max_iters=max_iters, return_extras=return_extras, keep_tri_collections=keep_tri_collections,
+            memory_budget=25*tiling.bytes_per_ray(max_iters))
+        self.assertLen(buffers, 4)
+        if return_extras and keep_tri_collections:
+            self.assertEqual(alive, [0, 1, 2, 3])
+            self.assertLen(out[1]['tile_tri_collections'], 4)
+        else:
+            self.assertEqual(alive, [0, 0, 0, 0])
+        if return_extras:
+            self.assertEqual(tuple(out[1]['overflow_touch_count'].shape), (N,))
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,60 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from utils import timing
+
+class TimingTest(parameterized.TestCase):
+    def test_summarize(self):
+        samples = np.arange(1, 101) / 1000
+        summary = timing.summarize(samples)
+        self.assertEqual(summary["n"], 100)
+        self.assertAlmostEqual(summary["mean_ms"], 50.5)
+        self.assertAlmostEqual(summary["p50_ms"], 50.5)
+        self.assertAlmostEqual(summary["p90_ms"], 90.1)
+        self.assertAlmostEqual(summary["p99_ms"], 99.01)
+        self.assertAlmostEqual(summary["fps"], 1000 / 50.5)
+        self.assertEqual(timing.summarize([]), dict(n=0))
+
+    def test_run_benchmark(self):
+        calls = []
+        syncs = []
+        def render(item, timer):
+            with timer.stage("a"):
+                calls.append(item)
+            with timer.stage("b"):
+                pass
+        timer = timing.run_benchmark(render, [1, 2, 3], warmup=2, repeats=4, sync=lambda: syncs.append(1))
+        self.assertLen(calls, 3 * 6)
+        self.assertEqual({k: len(v) for k, v in timer.samples.items()}, dict(frame=12, a=12, b=12))
+        self.assertLen(syncs, 2 * 3 * 12)
+        for name in ["a", "b"]:
+            self.assertTrue(all(s <= f for s, f in zip(timer.samples[name], timer.samples["frame"])))
+
+    def test_write_json(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out", "bench.json")
+            results = dict(environment=timing.environment(), frame=timing.summarize([0.01, 0.02]))
+            timing.write_json(path, results)
+            with open(path) as f:
+                self.assertEqual(json.load(f), results)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,105 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import torch
+from utils.math_util import l2_normalize_th
+from splinetracers import cpu_ellipsoid_splinetracer
+from splinetracers import tracer_scene
+
+device = torch.device('cpu')
+
+def random_scene(N, feature_size=1):
+    mean = torch.rand(N, 3, device=device)
+    scale = 0.3*torch.rand(N, 3, device=device)
+    quat = l2_normalize_th(2*torch.rand(N, 4, device=device)-1)
+    density = torch.rand(N, 1, device=device)
+    features = torch.rand(N, feature_size, 3, device=device)
+    return mean, scale, quat, density, features
+
+class TracerSceneTest(parameterized.TestCase):
+    def setUp(self):
+        self.scene = tracer_scene.make_py_scene(device)
+        self.builds = self.scene.backend.num_builds
+        self.params = list(random_scene(20))
+
+    def update(self):
+        return self.scene.update(*self.params)
+
+    def test_unchanged_reuses_everything(self):
+        self.assertEqual(self.update(), 'rebuild')
+        for _ in range(3):
+            self.assertEqual(self.update(), 'none')
+        self.assertEqual(self.builds, dict(primitives=1, gas=1, forward=1))
+
+    def test_new_features_only_swaps_features(self):
+        self.update()
+        forward = self.scene.forward
+        self.params[4] = torch.rand_like(self.params[4])
+        self.assertEqual(self.update(), 'features')
+        self.assertIs(self.scene.forward, forward)
+        self.assertIs(forward.features, self.params[4])
+        self.assertEqual(self.builds, dict(primitives=1, gas=1, forward=1))
+
+    def test_inplace_density_does_not_rebuild(self):
+        self.update()
+        self.params[3].mul_(2)
+        self.assertEqual(self.update(), 'features')
+        self.assertEqual(self.builds, dict(primitives=1, gas=1, forward=1))
+
+    @parameterized.parameters(0, 1, 2)
+    def test_inplace_geometry_refits(self, ind):
+        self.update()
+        half_attribs = self.scene.half_attribs
+        self.params[ind].add_(0.1)
+        self.assertEqual(self.update(), 'refit')
+        self.assertEqual(self.builds, dict(primitives=1, gas=2, forward=1))
+        self.assertEqual(self.scene.half_attribs.data_ptr(), half_attribs.data_ptr())
+        np.testing.assert_allclose(
+            self.scene.half_attribs.float().numpy(),
+            torch.cat(self.params[:3], dim=1).half().float().numpy())
+
+    def test_new_storage_rebuilds(self):
+        self.update()
+        self.params[0] = self.params[0].clone()
+        self.assertEqual(self.update(), 'rebuild')
+        self.assertEqual(self.builds, dict(primitives=2, gas=2, forward=2))
+
+    def test_feature_size_rebuilds(self):
+        self.update()
+        self.params[4] = torch.rand(20, 4, 3, device=device)
+        self.assertEqual(self.update(), 'rebuild')
+
+    def test_noncontiguous_inputs_are_refreshed(self):
+        mean = torch.rand(3, 20, device=device).T
+        self.params[0] = mean
+        self.assertEqual(self.update(), 'rebuild')
+        mean.add_(0.1)
+        self.assertEqual(self.update(), 'refit')
+        np.testing.assert_allclose(self.scene.tensors['mean'].numpy(), mean.numpy())
+
+    def test_trace_matches_cpu_tracer(self):
+        rayo = torch.tensor([[0.5, 0.5, -1.0], [0.3, 0.6, -1.0]], device=device)
+        rayd = torch.tensor([[0, 0, 1.0], [0.1, 0, 1.0]], device=device)
+        self.update()
+        self.params[4] = torch.rand_like(self.params[4])
+        self.update()
+        out = self.scene.trace_rays(rayo, rayd, 0.0, 100.0, 64, 3)
+        expected = cpu_ellipsoid_splinetracer.trace_rays(*self.params, rayo, rayd, 0.0, 100.0)
+        np.testing.assert_allclose(out['color'].numpy(), expected[:, :4].numpy(), atol=1e-6)
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,79 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Conversions between render path poses and 3DGS world_view_transforms.
+
+Path generators (camera_utils_zipnerf.generate_ellipse_path and friends) and
+SIBR .path files use OpenGL camera to world poses (x right, y up, looking
+down -z). 3DGS cameras store world_view_transform, the transposed world to
+camera matrix with y down and z forward. All functions work on batches.
+viewmatrix builds the lookat poses of a whole path at once.
+"""
+
+import numpy as np
+
+GL_TO_CV = np.diag(np.array([1.0, -1.0, -1.0, 1.0]))
+
+
+def pad_poses(poses: np.ndarray) -> np.ndarray:
+    """[..., 3, 4] -> [..., 4, 4] by appending [0, 0, 0, 1]."""
+    if poses.shape[-2] == 4:
+        return poses
+    bottom = np.broadcast_to(np.array([0.0, 0.0, 0.0, 1.0]), poses.shape[:-2] + (1, 4))
+    return np.concatenate([poses, bottom], axis=-2)
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    """Normalizes the vectors along the last axis."""
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def viewmatrix(lookdir: np.ndarray, up: np.ndarray, position: np.ndarray, lock_up: bool = False) -> np.ndarray:
+    """Lookat camera to world poses [..., 3, 4] from [..., 3] vectors.
+
+    The inputs broadcast against each other, e.g. [N, 3] positions with a
+    single up vector. Per pose this is the lookat of camera_utils_zipnerf:
+    the z axis is lookdir, or with lock_up the y axis is up.
+    """
+    lookdir, up, position = np.broadcast_arrays(lookdir, up, position)
+    vecs = [None, normalize(up), normalize(lookdir)]
+    # x-axis is always the normalized cross product of `lookdir` and `up`.
+    vecs[0] = normalize(np.cross(vecs[1], vecs[2]))
+    # Set the not-locked axis to be orthogonal to the other two.
+    ax = 2 if lock_up else 1
+    vecs[ax] = normalize(np.cross(vecs[(ax + 1) % 3], vecs[(ax + 2) % 3]))
+    return np.stack(vecs + [position], axis=-1)
+
+
+def world_view_from_c2w(c2w: np.ndarray) -> np.ndarray:
+    """OpenGL camera to world [N, 3|4, 4] -> world_view_transform [N, 4, 4]."""
+    w2c = np.linalg.inv(pad_poses(c2w) @ GL_TO_CV)
+    return np.swapaxes(w2c, -1, -2)
+
+
+def c2w_from_world_view(world_view: np.ndarray) -> np.ndarray:
+    """world_view_transform [N, 4, 4] -> OpenGL camera to world [N, 3, 4]."""
+    c2w = np.linalg.inv(np.swapaxes(world_view, -1, -2)) @ GL_TO_CV
+    return c2w[..., :3, :]
+
+
+def undo_transform(poses: np.ndarray, transform: np.ndarray) -> np.ndarray:
+    """Maps poses from a transform_poses_pca/_focus frame back to the world.
+
+    The transforms include a uniform scale, which is removed from the rotation
+    again so the result has orthonormal axes.
+    """
+    poses = np.linalg.inv(transform) @ pad_poses(poses)
+    poses[..., :3, :3] /= np.linalg.norm(poses[..., :3, :3], axis=-2, keepdims=True)
+    return poses[..., :3, :]
@@ -0,0 +1,242 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Radial and tangential lens distortion and precomputed undistortion maps.
+
+The functions take xnp=np or xnp=torch. camera_utils_zipnerf uses them for
+pixels_to_rays. The undistortion solver only keeps iterating on points that
+have not converged yet.
+
+Undistorting needs an iterative solve per point. The result only depends on
+the intrinsics and distortion parameters, so UndistortionMap.cached solves
+it once on a grid of pixel coordinates and stores the grid on disk. Lookups
+interpolate the grid bilinearly. With step=1, the pixel centers and the +1
+pixel neighbours pixels_to_rays uses for ray radii land on grid points and
+are not interpolated at all. max_error is the largest deviation from the
+solver, measured at the cell midpoints where interpolation is worst.
+"""
+
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import *
+
+import numpy as np
+import torch
+
+DISTORTION_KEYS = ("k1", "k2", "k3", "k4", "p1", "p2")
+# Bump when the map layout or the solver changes, to invalidate cached maps.
+MAP_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ever", "undistort")
+
+
+def radial_and_tangential_distort(x, y, k1=0, k2=0, k3=0, k4=0, p1=0, p2=0):
+    """Computes the distorted pixel positions."""
+    r2 = x * x + y * y
+
+    radial_distortion = r2 * (k1 + r2 * (k2 + r2 * (k3 + r2 * k4)))
+    dx_radial = x * radial_distortion
+    dy_radial = y * radial_distortion
+
+    dx_tangential = 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+    dy_tangential = 2 * p2 * x * y + p1 * (r2 + 2 * y * y)
+
+    return x + dx_radial + dx_tangential, y + dy_radial + dy_tangential
+
+
+def compute_residual_and_jacobian(x, y, xd, yd, k1=0.0, k2=0.0, k3=0.0, k4=0.0, p1=0.0, p2=0.0):
+    """Residual of distort(x, y) - (xd, yd) and its Jacobian, see nerfies/camera.py."""
+    r = x * x + y * y
+    d = 1.0 + r * (k1 + r * (k2 + r * (k3 + r * k4)))
+
+    fx = d * x + 2 * p1 * x * y + p2 * (r + 2 * x * x) - xd
+    fy = d * y + 2 * p2 * x * y + p1 * (r + 2 * y * y) - yd
+
+    # Derivative of d over [x, y].
+    d_r = k1 + r * (2.0 * k2 + r * (3.0 * k3 + r * 4.0 * k4))
+    d_x = 2.0 * x * d_r
+    d_y = 2.0 * y * d_r
+
+    fx_x = d + d_x * x + 2.0 * p1 * y + 6.0 * p2 * x
+    fx_y = d_y * x + 2.0 * p1 * x + 2.0 * p2 * y
+
+    fy_x = d_x * y + 2.0 * p2 * y + 2.0 * p1 * x
+    fy_y = d + d_y * y + 2.0 * p2 * x + 6.0 * p1 * y
+
+    return fx, fy, fx_x, fx_y, fy_x, fy_y
+
+
+@dataclass
+class UndistortInfo:
+    iterations: Any  # Newton steps taken per point, shaped like xd.
+    residual: Any  # |distort(x, y) - (xd, yd)| per point after the last step.
+    num_active: List[int]  # Points still being solved in each iteration.
+
+
+def _arange(n, like, xnp):
+    return np.arange(n) if xnp is np else torch.arange(n, device=like.device)
+
+
+def radial_and_tangential_undistort(xd, yd, k1=0, k2=0, k3=0, k4=0, p1=0, p2=0,
+                                    eps=1e-9, max_iterations=10, xnp=np, tol=1e-12,
+                                    return_info=False):
+    """Computes undistorted (x, y) from (xd, yd) with Newton's method.
+
+    A point stops being updated once its Newton step is at most tol, or at
+    most a few ulps of the point in the input's dtype, which float32 inputs
+    reach long before tol; a negative tol runs all max_iterations. Each
+    iteration only evaluates the points that are still moving. Distortion
+    parameters may be scalars or arrays broadcastable to xd. With return_info
+    an UndistortInfo is returned as well.
+    """
+    shape = xd.shape
+    xd = xd.reshape(-1)
+    yd = yd.reshape(-1)
+    params = dict(k1=k1, k2=k2, k3=k3, k4=k4, p1=p1, p2=p2)
+    for k, v in params.items():
+        if getattr(v, "ndim", 0) > 0:
+            params[k] = xnp.broadcast_to(v, shape).reshape(-1)
+    # Initialize from the distorted point.
+    x = xd + 0
+    y = yd + 0
+    iterations = xnp.zeros_like(xd, dtype=xnp.int64)
+    # Steps below this many ulps of the point only reflect rounding.
+    ulps = 4 * (np.finfo(xd.dtype).eps if xnp is np else torch.finfo(xd.dtype).eps)
+    active = _arange(xd.shape[0], xd, xnp)
+    num_active = []
+
+    for _ in range(max_iterations):
+        if active.shape[0] == 0:
+            break
+        num_active.append(int(active.shape[0]))
+        xa, ya = x[active], y[active]
+        active_params = {k: v[active] if getattr(v, "ndim", 0) > 0 else v for k, v in params.items()}
+        fx, fy, fx_x, fx_y, fy_x, fy_y = compute_residual_and_jacobian(
+            x=xa, y=ya, xd=xd[active], yd=yd[active], **active_params
+        )
+        denominator = fy_x * fx_y - fx_x * fy_y
+        x_numerator = fx * fy_y - fy * fx_y
+        y_numerator = fy * fx_x - fx * fy_x
+        valid = xnp.abs(denominator) > eps
+        step_x = xnp.where(valid, x_numerator / denominator, xnp.zeros_like(denominator))
+        step_y = xnp.where(valid, y_numerator / denominator, xnp.zeros_like(denominator))
+
+        x[active] = xa + step_x
+        y[active] = ya + step_y
+        iterations[active] += 1
+        step = xnp.maximum(xnp.abs(step_x), xnp.abs(step_y))
+        moving = step > tol
+        if tol >= 0:
+            moving &= step > ulps * xnp.maximum(xnp.abs(x[active]), xnp.abs(y[active])).clip(min=1)
+        active = active[moving]
+
+    x = x.reshape(shape)
+    y = y.reshape(shape)
+    if not return_info:
+        return x, y
+    fx, fy = compute_residual_and_jacobian(
+        x=x, y=y, xd=xd.reshape(shape), yd=yd.reshape(shape),
+        **{k: v.reshape(shape) if getattr(v, "ndim", 0) > 0 else v for k, v in params.items()})[:2]
+    residual = xnp.sqrt(fx * fx + fy * fy)
+    return x, y, UndistortInfo(iterations.reshape(shape), residual, num_active)
+
+
+def map_key(width, height, fx, fy, cx, cy, distortion_params, step=1, max_iterations=10) -> str:
+    params = tuple(float(distortion_params.get(k, 0.0)) for k in DISTORTION_KEYS)
+    key = (MAP_VERSION, int(width), int(height), float(fx), float(fy), float(cx), float(cy),
+           params, int(step), int(max_iterations))
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+class UndistortionMap:
+    """Undistorted normalized (x, y) on a grid of pixel coordinates.
+
+    Grid point (i, j) holds pixel (0.5 + j * step, 0.5 + i * step), covering
+    the pixel centers of a width x height image plus one pixel to the right
+    and bottom.
+    """
+
+    def __init__(self, grid: np.ndarray, step: int, max_error: float):
+        self.grid = grid
+        self.step = step
+        self.max_error = max_error
+        self.device_grids = {}
+
+    @staticmethod
+    def solve(u, v, fx, fy, cx, cy, distortion_params, max_iterations=10):
+        """Undistorts pixel coordinates (u, v) with the solver, in float64."""
+        xd = (np.asarray(u, np.float64) - cx) / fx
+        yd = (np.asarray(v, np.float64) - cy) / fy
+        params = {k: float(v) for k, v in distortion_params.items()}
+        return radial_and_tangential_undistort(xd, yd, **params, max_iterations=max_iterations, xnp=np)
+
+    @classmethod
+    def build(cls, width, height, fx, fy, cx, cy, distortion_params, step=1, max_iterations=10):
+        cols = -(-width // step) + 1
+        rows = -(-height // step) + 1
+        u, v = np.meshgrid(0.5 + step * np.arange(cols), 0.5 + step * np.arange(rows), indexing="xy")
+        x, y = cls.solve(u, v, fx, fy, cx, cy, distortion_params, max_iterations)
+        grid = np.stack([x, y], axis=-1).astype(np.float32)
+        undistortion_map = cls(grid, step, 0.0)
+
+        # Bilinear interpolation is least accurate in the middle of a cell.
+        um, vm = u[:-1, :-1] + 0.5 * step, v[:-1, :-1] + 0.5 * step
+        xm, ym = cls.solve(um, vm, fx, fy, cx, cy, distortion_params, max_iterations)
+        xi, yi = undistortion_map.lookup(um, vm)
+        undistortion_map.max_error = float(max(np.abs(xi - xm).max(), np.abs(yi - ym).max()))
+        return undistortion_map
+
+    @classmethod
+    def cached(cls, width, height, fx, fy, cx, cy, distortion_params, step=1, max_iterations=10,
+               cache_dir: Optional[str] = None) -> "UndistortionMap":
+        """Loads the map from cache_dir, building and saving it on a miss."""
+        cache_dir = cache_dir or os.environ.get("EVER_CACHE_DIR") or DEFAULT_CACHE_DIR
+        key = map_key(width, height, fx, fy, cx, cy, distortion_params, step, max_iterations)
+        path = os.path.join(cache_dir, key + ".npz")
+        if os.path.exists(path):
+            with np.load(path) as data:
+                return cls(data["grid"], int(data["step"]), float(data["max_error"]))
+        undistortion_map = cls.build(width, height, fx, fy, cx, cy, distortion_params, step, max_iterations)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under a temporary name, so concurrent readers never see a partial file.
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, grid=undistortion_map.grid, step=undistortion_map.step,
+                 max_error=undistortion_map.max_error)
+        os.replace(tmp_path, path)
+        return undistortion_map
+
+    def grid_on(self, device):
+        device = torch.device(device)
+        if device not in self.device_grids:
+            self.device_grids[device] = torch.as_tensor(self.grid, device=device)
+        return self.device_grids[device]
+
+    def lookup(self, u, v, xnp=np):
+        """Bilinearly interpolated undistorted (x, y) at pixel coordinates (u, v)."""
+        grid = self.grid if xnp is np else self.grid_on(u.device)
+        rows, cols = grid.shape[:2]
+        gu = ((u - 0.5) / self.step).clip(0, cols - 1)
+        gv = ((v - 0.5) / self.step).clip(0, rows - 1)
+        j0 = xnp.floor(gu).clip(max=cols - 2)
+        i0 = xnp.floor(gv).clip(max=rows - 2)
+        wu = (gu - j0)[..., None]
+        wv = (gv - i0)[..., None]
+        if xnp is np:
+            j0, i0 = j0.astype(np.int64), i0.astype(np.int64)
+        else:
+            j0, i0 = j0.long(), i0.long()
+        top = grid[i0, j0] * (1 - wu) + grid[i0, j0 + 1] * wu
+        bottom = grid[i0 + 1, j0] * (1 - wu) + grid[i0 + 1, j0 + 1] * wu
+        xy = top * (1 - wv) + bottom * wv
+        return xy[..., 0], xy[..., 1]
@@ -0,0 +1,186 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writes rendered frames to disk on a thread pool.
+
+    with FrameWriter(output_dir, formats=("png", "exr"), video_path="path.mp4") as writer:
+        for i, view in enumerate(views):
+            writer.submit(i, render(view))  # HxWx3 float in [0, 1]
+
+submit returns as soon as the frame is queued, so the renderer keeps going
+while earlier frames are encoded. At most max_pending frames are queued; when
+the writer falls that far behind, submit blocks instead of holding every
+frame in memory. Image files are written in any order by num_threads workers,
+video frames are appended in submission order by a single worker.
+
+png is written with imageio when installed, otherwise with a built-in zlib
+encoder. exr and video need imageio (with its OpenEXR and ffmpeg plugins),
+npy only numpy.
+"""
+
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+import numpy as np
+
+try:
+    import imageio
+except ImportError:
+    imageio = None
+
+
+def to_uint8(image: np.ndarray) -> np.ndarray:
+    if image.dtype == np.uint8:
+        return image
+    return (np.clip(image, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+
+def encode_png(image: np.ndarray, level: int = 6) -> bytes:
+    """Encodes an HxW, HxWx3 or HxWx4 uint8 image as PNG without dependencies."""
+    image = np.ascontiguousarray(to_uint8(image))
+    if image.ndim == 2:
+        image = image[..., None]
+    h, w, c = image.shape
+    color_type = {1: 0, 3: 2, 4: 6}[c]
+    # Every row starts with filter type 0 (none).
+    rows = np.concatenate([np.zeros((h, 1), np.uint8), image.reshape(h, w * c)], axis=1)
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, color_type, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows.tobytes(), level))
+            + chunk(b"IEND", b""))
+
+
+def write_png(path: str, image: np.ndarray):
+    if imageio is not None:
+        imageio.imwrite(path, to_uint8(image))
+    else:
+        with open(path, "wb") as f:
+            f.write(encode_png(image))
+
+
+def write_exr(path: str, image: np.ndarray):
+    if imageio is None:
+        raise ImportError("Writing exr frames requires imageio")
+    imageio.imwrite(path, image.astype(np.float32))
+
+
+def write_npy(path: str, image: np.ndarray):
+    np.save(path, image)
+
+
+WRITERS = dict(png=write_png, exr=write_exr, npy=write_npy)
+
+
+def open_video(path: str, fps: float):
+    if imageio is None:
+        raise ImportError("Writing videos requires imageio")
+    return imageio.get_writer(path, fps=fps)
+
+
+class FrameWriter:
+    def __init__(self,
+                 output_dir: Optional[str],
+                 formats: Sequence[str] = ("png",),
+                 video_path: Optional[str] = None,
+                 fps: float = 30,
+                 num_threads: int = 4,
+                 max_pending: int = 8,
+                 name_format: str = "{:06d}",
+                 open_video: Callable[[str, float], Any] = open_video):
+        for fmt in formats:
+            if fmt not in WRITERS:
+                raise ValueError(f"Unknown frame format {fmt}, expected one of {list(WRITERS)}")
+        self.output_dir = output_dir
+        self.formats = tuple(formats) if output_dir is not None else ()
+        if self.formats:
+            os.makedirs(output_dir, exist_ok=True)
+        self.name_format = name_format
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        self.video = open_video(video_path, fps) if video_path is not None else None
+        # One thread, so frames are appended in the order they were submitted.
+        self.video_executor = ThreadPoolExecutor(max_workers=1) if self.video is not None else None
+        self.futures = []
+        self.num_finished = 0
+        self.lock = threading.Lock()
+
+    def frame_path(self, index: int, fmt: str) -> str:
+        return os.path.join(self.output_dir, self.name_format.format(index) + "." + fmt)
+
+    def write_files(self, index: int, image: np.ndarray):
+        for fmt in self.formats:
+            WRITERS[fmt](self.frame_path(index, fmt), image)
+
+    def append_video(self, image: np.ndarray):
+        self.video.append_data(to_uint8(image))
+
+    def release(self):
+        self.pending.release()
+        with self.lock:
+            self.num_finished += 1
+
+    def submit(self, index: int, image: np.ndarray):
+        """Queues an HxWx3 image (float in [0, 1] or uint8), blocking while max_pending are queued."""
+        self.pending.acquire()
+        image = np.asarray(image)
+        tasks = []
+        if self.formats:
+            tasks.append(self.executor.submit(self.write_files, index, image))
+        if self.video is not None:
+            tasks.append(self.video_executor.submit(self.append_video, image))
+        if not tasks:
+            self.release()
+            return
+        # The slot is freed once every task of the frame has finished.
+        remaining = [len(tasks)]
+        def done(future):
+            with self.lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self.release()
+        for task in tasks:
+            task.add_done_callback(done)
+        # Raise errors of finished frames now instead of only at close.
+        futures, self.futures = self.futures + tasks, []
+        for future in futures:
+            if future.done():
+                future.result()
+            else:
+                self.futures.append(future)
+
+    def close(self):
+        """Waits for all queued frames and re-raises the first write error."""
+        self.executor.shutdown(wait=True)
+        if self.video_executor is not None:
+            self.video_executor.shutdown(wait=True)
+            self.video.close()
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,112 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rays of many cameras in one contiguous buffer.
+
+    batch = build_ray_batch(grids, c2ws, pixel_inds)
+    batch.origins, batch.directions   # [R, 3], camera k owns rows offsets[k]:offsets[k + 1]
+
+grids[k] holds the camera space directions of every pixel of camera k, e.g.
+from ray_cache.direction_cache, where cameras with equal intrinsics share one
+tensor. Cameras passing the same grid form a group: the pixel subsets of a
+group are gathered from the grid at once, and each camera's segment of rays is
+rotated into world space with its own rotation (a single batched matmul when
+all cameras have as many rays), instead of building pixtocams and inverting a
+view matrix per camera.
+"""
+
+from dataclasses import dataclass
+from typing import *
+
+import torch
+
+
+@dataclass
+class RayBatch:
+    origins: torch.Tensor  # [R, 3]
+    directions: torch.Tensor  # [R, 3]
+    offsets: torch.Tensor  # [K + 1] int64 on the host, rays of camera k are offsets[k]:offsets[k + 1]
+    camera_ids: torch.Tensor  # [R] int64
+
+    @property
+    def num_cameras(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    def camera(self, k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        s, e = int(self.offsets[k]), int(self.offsets[k + 1])
+        return self.origins[s:e], self.directions[s:e]
+
+    def split(self, values: torch.Tensor) -> List[torch.Tensor]:
+        """Splits per ray values (e.g. the traced colors) into per camera views."""
+        return list(torch.split(values, torch.diff(self.offsets).tolist()))
+
+
+def c2ws_from_world_views(world_view_transforms: torch.Tensor) -> torch.Tensor:
+    """3DGS world_view_transforms [K, 4, 4] -> camera to world [K, 4, 4], in one inverse."""
+    return torch.linalg.inv(world_view_transforms.transpose(-1, -2))
+
+
+def build_ray_batch(grids: Sequence[torch.Tensor],
+                    c2ws: torch.Tensor,
+                    pixel_inds: Optional[Sequence[Optional[torch.Tensor]]] = None) -> RayBatch:
+    """Builds the rays of K cameras.
+
+    grids: K [num_pixels, 3] camera space directions; pass the same tensor for
+      cameras with the same intrinsics.
+    c2ws: [K, 3|4, 4] camera to world transforms.
+    pixel_inds: optional K flat pixel index tensors (None for all pixels).
+    """
+    num_cameras = len(grids)
+    assert c2ws.shape[0] == num_cameras
+    device = c2ws.device
+    if pixel_inds is None:
+        pixel_inds = [None] * num_cameras
+    counts = [grid.shape[0] if inds is None else inds.shape[0] for grid, inds in zip(grids, pixel_inds)]
+    offsets = torch.zeros(num_cameras + 1, dtype=torch.int64)
+    offsets[1:] = torch.cumsum(torch.tensor(counts, dtype=torch.int64), 0)
+    num_rays = int(offsets[-1])
+    camera_ids = torch.repeat_interleave(
+        torch.arange(num_cameras, device=device), torch.tensor(counts, device=device))
+
+    # Group cameras by shared grid and gather each group's pixels in one go.
+    groups = {}
+    for k, grid in enumerate(grids):
+        groups.setdefault(id(grid), []).append(k)
+    camera_dirs = torch.empty((num_rays, 3), dtype=grids[0].dtype, device=device)
+    for members in groups.values():
+        grid = grids[members[0]]
+        inds = []
+        dest = []
+        for k in members:
+            s, e = int(offsets[k]), int(offsets[k + 1])
+            inds.append(torch.arange(grid.shape[0], device=grid.device) if pixel_inds[k] is None
+                        else pixel_inds[k].to(grid.device))
+            dest.append(torch.arange(s, e, device=device))
+        camera_dirs[torch.cat(dest)] = grid[torch.cat(inds)].to(device)
+
+    # Each camera's rays are a contiguous segment, so its rotation is applied
+    # to the segment instead of gathering a [R, 3, 3] rotation per ray.
+    rotations = c2ws[:, :3, :3].to(camera_dirs.dtype).transpose(1, 2)
+    if num_cameras > 0 and all(c == counts[0] for c in counts):
+        directions = torch.bmm(camera_dirs.view(num_cameras, counts[0], 3), rotations).view(num_rays, 3)
+    elif torch.is_grad_enabled() and rotations.requires_grad:
+        directions = torch.cat([camera_dirs[int(offsets[k]):int(offsets[k + 1])] @ rotations[k]
+                                for k in range(num_cameras)])
+    else:
+        directions = torch.empty_like(camera_dirs)
+        for k in range(num_cameras):
+            s, e = int(offsets[k]), int(offsets[k + 1])
+            torch.matmul(camera_dirs[s:e], rotations[k], out=directions[s:e])
+    origins = c2ws[:, :3, 3].to(camera_dirs.dtype)[camera_ids]
+    return RayBatch(origins.contiguous(), directions.contiguous(), offsets, camera_ids)
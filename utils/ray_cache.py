@@ -0,0 +1,91 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Byte bounded LRU cache for camera space ray direction grids.
+
+The camera space directions of a camera only depend on its intrinsics,
+projection model and distortion, so they are built once and each frame only
+rotates them into world space. direction_cache is shared by everything in
+the process that generates rays.
+"""
+
+import collections
+from typing import *
+
+import torch
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+
+def tensor_bytes(t: torch.Tensor) -> int:
+    return t.numel() * t.element_size()
+
+
+def camera_key(width: int, height: int, fx: float, fy: float, cx: float, cy: float,
+               model=None, distortion_params: Optional[Dict[str, float]] = None,
+               device=None) -> Tuple:
+    distortion = None if distortion_params is None else tuple(
+        sorted((k, float(v)) for k, v in distortion_params.items()))
+    return (int(width), int(height), float(fx), float(fy), float(cx), float(cy),
+            model, distortion, None if device is None else str(torch.device(device)))
+
+
+class ByteLRUCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key: Hashable, build: Callable[[], torch.Tensor]) -> torch.Tensor:
+        """Returns the cached tensor for key, calling build() on a miss.
+
+        Tensors larger than max_bytes are returned without being cached.
+        """
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = build()
+        size = tensor_bytes(value)
+        if size > self.max_bytes:
+            return value
+        self.entries[key] = value
+        self.nbytes += size
+        self.evict()
+        return value
+
+    def evict(self):
+        while self.nbytes > self.max_bytes:
+            _, value = self.entries.popitem(last=False)
+            self.nbytes -= tensor_bytes(value)
+
+    def resize(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+direction_cache = ByteLRUCache()
@@ -0,0 +1,113 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per ray near/far bounds from a scene bounding box or sphere.
+
+    bounds = SceneBounds.from_ellipsoids(mean, scale)
+    tmin, tmax = bounds.clip(rayo, rayd, tmin=0.2, tmax=1e7)
+    trace_rays(..., rayo, rayd, tmin, tmax, ...)
+
+The returned bounds follow trace_rays: a ray starts at rayo + tmin * rayd and
+is traced for a distance of tmax along its normalized direction. Rays that
+miss the bounds get tmax = 0, which trace_rays skips (see
+splinetracers/ray_bounds.py). The intersection functions take xnp=np, jnp
+or torch; camera_utils_zipnerf uses them as well.
+"""
+
+from dataclasses import dataclass
+from typing import *
+
+import numpy as np
+import torch
+
+
+def ray_box_intersection(ray_o, ray_d, corners, xnp=np):
+    """Returns enter/exit distances along the ray for box defined by `corners`."""
+    t1 = (corners[0] - ray_o) / ray_d
+    t2 = (corners[1] - ray_o) / ray_d
+    t_min = xnp.amax(xnp.minimum(t1, t2), axis=-1)
+    t_max = xnp.amin(xnp.maximum(t1, t2), axis=-1)
+    return t_min, t_max
+
+
+def ray_sphere_intersection(ray_o, ray_d, center, radius, xnp=np):
+    """Calculates distance to hit a sphere for a ray.
+
+    Args:
+      ray_o: Ray origin (..., 3)
+      ray_d: Ray direction (..., 3)
+      center: Sphere center (..., 3)
+      radius: Sphere radius (..., 1)
+      xnp: Numpy, Jax or torch module
+
+    Returns:
+      t_min, t_max, hit. When no hit is found, t_min = t_max = 0.
+    """
+    oc = ray_o - center
+
+    a = (ray_d**2).sum(axis=-1)
+    b = 2 * (oc * ray_d).sum(axis=-1)
+    c = (oc * oc).sum(axis=-1) - radius**2
+
+    det = b**2 - 4.0 * a * c
+
+    hit = (det >= 0) * (a > 0)
+
+    # Nb: Results are 'wrong' if valid = false, this is just to make jax
+    # not freak out.
+    det = xnp.where(hit, det, 0.0)
+    a = xnp.where(hit, a, 1.0)
+    t_min = xnp.where(hit, (-b - xnp.sqrt(det)) / (2.0 * a), 0.0)
+    t_max = xnp.where(hit, (-b + xnp.sqrt(det)) / (2.0 * a), 0.0)
+    return t_min, t_max, hit
+
+
+@dataclass
+class SceneBounds:
+    """An axis aligned box (aabb, [2, 3] min and max corner) or a sphere."""
+    aabb: Optional[torch.Tensor] = None
+    center: Optional[torch.Tensor] = None
+    radius: Optional[float] = None
+
+    def __post_init__(self):
+        if (self.aabb is None) == (self.center is None or self.radius is None):
+            raise ValueError("SceneBounds needs either aabb or center and radius.")
+
+    @classmethod
+    def from_ellipsoids(cls, mean: torch.Tensor, scale: torch.Tensor, padding: float = 0.0) -> "SceneBounds":
+        """The box around ellipsoids with the given means and scales (radii)."""
+        extent = scale.amax(dim=-1, keepdim=True) + padding
+        return cls(aabb=torch.stack([(mean - extent).amin(dim=0), (mean + extent).amax(dim=0)]))
+
+    def intersect(self, rayo: torch.Tensor, rayd: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Enter and exit parameters along rayd and whether the ray hits."""
+        if self.aabb is not None:
+            aabb = self.aabb.to(rayo)
+            # Axis parallel rays give +-inf slabs, or nan on a face, which makes hit False.
+            t_enter, t_exit = ray_box_intersection(rayo, rayd, aabb, xnp=torch)
+            hit = t_enter <= t_exit
+            return t_enter, t_exit, hit
+        center = torch.as_tensor(self.center).to(rayo)
+        return ray_sphere_intersection(rayo, rayd, center, self.radius, xnp=torch)
+
+    def clip(self, rayo: torch.Tensor, rayd: torch.Tensor,
+             tmin: float = 0.0, tmax: float = 1e7) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Per ray trace_rays bounds [R] restricted to the part of [tmin, tmax] inside the bounds."""
+        norm = rayd.norm(dim=-1)
+        t_enter, t_exit, hit = self.intersect(rayo, rayd)
+        start = t_enter.clamp(min=tmin)
+        end = torch.minimum(t_exit, tmin + tmax / norm)
+        length = ((end - start) * norm).nan_to_num(nan=0.0)
+        length = torch.where(hit & (length > 0), length, torch.zeros_like(length))
+        return start.nan_to_num(nan=tmin), length
@@ -0,0 +1,126 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reader and writer for SIBR viewer camera paths (.path files).
+
+A .path file is a big endian int32 camera count N followed by N records of
+11 big endian float32s:
+
+  position (3), rotation quaternion x, y, z, w (4), fovy, fovx, znear, zfar
+
+The rotation and position form an OpenGL camera to world pose. Records are
+read with one numpy.frombuffer (or a memory map for large files) and
+converted to poses for all cameras at once.
+"""
+
+import os
+from typing import *
+
+import numpy as np
+
+from . import camera_path
+
+RECORD_FLOATS = 11
+RECORD_DTYPE = np.dtype(">f4")
+HEADER_DTYPE = np.dtype(">i4")
+# Files larger than this are memory mapped instead of read.
+MMAP_BYTES = 64 * 2**20
+
+
+def read(path: str, mmap: Optional[bool] = None) -> np.ndarray:
+    """Returns the [N, 11] big endian float32 records of a .path file.
+
+    With mmap (default: for files over MMAP_BYTES) the records are a
+    read-only memory map and only the pages that are used get loaded.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        n = int(np.frombuffer(f.read(HEADER_DTYPE.itemsize), HEADER_DTYPE)[0])
+        expected = HEADER_DTYPE.itemsize + n * RECORD_FLOATS * RECORD_DTYPE.itemsize
+        if size < expected:
+            raise ValueError(f"{path} holds {size} bytes, {n} cameras need {expected}")
+        if mmap is None:
+            mmap = size > MMAP_BYTES
+        if not mmap:
+            return np.frombuffer(f.read(expected - HEADER_DTYPE.itemsize), RECORD_DTYPE).reshape(n, RECORD_FLOATS)
+    return np.memmap(path, RECORD_DTYPE, mode="r", offset=HEADER_DTYPE.itemsize, shape=(n, RECORD_FLOATS))
+
+
+def write(path: str, records: np.ndarray):
+    records = np.asarray(records).reshape(-1, RECORD_FLOATS)
+    with open(path, "wb") as f:
+        f.write(np.array([records.shape[0]], HEADER_DTYPE).tobytes())
+        f.write(records.astype(RECORD_DTYPE).tobytes())
+
+
+def quaternion_to_matrix(quat: np.ndarray) -> np.ndarray:
+    """[N, 4] x, y, z, w quaternions (normalized here) -> [N, 3, 3] rotations."""
+    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    x, y, z, w = np.moveaxis(quat, -1, 0)
+    return np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+        2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+        2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y),
+    ], axis=-1).reshape(quat.shape[:-1] + (3, 3))
+
+
+def matrix_to_quaternion(rot: np.ndarray) -> np.ndarray:
+    """[N, 3, 3] rotations -> [N, 4] x, y, z, w quaternions with w >= 0."""
+    m = rot
+    # Squared magnitudes of the components; take the largest one for stability.
+    sq = 0.25 * np.stack([
+        1 + m[..., 0, 0] - m[..., 1, 1] - m[..., 2, 2],
+        1 - m[..., 0, 0] + m[..., 1, 1] - m[..., 2, 2],
+        1 - m[..., 0, 0] - m[..., 1, 1] + m[..., 2, 2],
+        1 + m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2],
+    ], axis=-1)
+    largest = np.argmax(sq, axis=-1)
+    big = np.sqrt(np.take_along_axis(sq, largest[..., None], -1))[..., 0]
+    # 4 * big * (x, y, z, w) from the row of the largest component.
+    sxy = m[..., 0, 1] + m[..., 1, 0]
+    sxz = m[..., 0, 2] + m[..., 2, 0]
+    syz = m[..., 1, 2] + m[..., 2, 1]
+    dx = m[..., 2, 1] - m[..., 1, 2]
+    dy = m[..., 0, 2] - m[..., 2, 0]
+    dz = m[..., 1, 0] - m[..., 0, 1]
+    rows = np.stack([
+        np.stack([4 * sq[..., 0], sxy, sxz, dx], -1),
+        np.stack([sxy, 4 * sq[..., 1], syz, dy], -1),
+        np.stack([sxz, syz, 4 * sq[..., 2], dz], -1),
+        np.stack([dx, dy, dz, 4 * sq[..., 3]], -1),
+    ], axis=-2)
+    quat = np.take_along_axis(rows, largest[..., None, None], -2)[..., 0, :] / (4 * big[..., None])
+    return quat * np.where(quat[..., 3:] < 0, -1, 1)
+
+
+def records_to_c2w(records: np.ndarray) -> np.ndarray:
+    """[N, 11] records -> OpenGL camera to world poses [N, 3, 4]."""
+    records = np.asarray(records, dtype=np.float64)
+    return np.concatenate([quaternion_to_matrix(records[:, 3:7]), records[:, :3, None]], axis=-1)
+
+
+def records_to_world_view(records: np.ndarray) -> np.ndarray:
+    """[N, 11] records -> 3DGS world_view_transforms [N, 4, 4]."""
+    return camera_path.world_view_from_c2w(records_to_c2w(records))
+
+
+def c2w_to_records(c2w: np.ndarray, fovy: float, fovx: float, znear: float = 0.01, zfar: float = 1000) -> np.ndarray:
+    """OpenGL camera to world poses [N, 3|4, 4] -> [N, 11] float32 records."""
+    c2w = np.asarray(c2w, dtype=np.float64)
+    n = c2w.shape[0]
+    records = np.empty((n, RECORD_FLOATS), np.float32)
+    records[:, :3] = c2w[:, :3, 3]
+    records[:, 3:7] = matrix_to_quaternion(c2w[:, :3, :3])
+    records[:, 7:] = np.broadcast_to(np.array([fovy, fovx, znear, zfar]), (n, 4))
+    return records
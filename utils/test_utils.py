@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from splinetracers import fast_ellipsoid_splinetracer
+from splinetracers import cpu_ellipsoid_splinetracer
 from splinetracers import quad
 
 METHODS = [
@@ -24,11 +25,12 @@ SYM_METHODS = [
 ]
 
 ALL_QUAD_PAIRS = [
-    (fast_ellipsoid_splinetracer, quad.query_ellipsoid),
+    (fast_ellipsoid_splinetracer, None),
+    (cpu_ellipsoid_splinetracer, None),
 ]
 
 QUAD_PAIRS = [
-    (fast_ellipsoid_splinetracer, quad.query_ellipsoid),
+    (fast_ellipsoid_splinetracer, None),
 ]
 
 ALPHA_QUAD_PAIRS = [
@@ -0,0 +1,125 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Wall clock benchmarking helpers: synchronized stage timers and summaries.
+
+Every stage boundary calls sync (e.g. torch.cuda.synchronize), so a stage's
+time covers the device work it launched and not just the launch.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import time
+from collections import defaultdict
+from typing import *
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """Summary statistics of durations in seconds, reported in milliseconds."""
+    ms = 1000 * np.asarray(samples, dtype=np.float64)
+    if ms.size == 0:
+        return dict(n=0)
+    summary = dict(
+        n=int(ms.size),
+        mean_ms=float(ms.mean()),
+        std_ms=float(ms.std()),
+        min_ms=float(ms.min()),
+        max_ms=float(ms.max()),
+    )
+    for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+        summary[f"p{p}_ms"] = float(v)
+    summary["fps"] = float(1000 / summary["mean_ms"]) if summary["mean_ms"] > 0 else float("inf")
+    return summary
+
+
+class StageTimer:
+    def __init__(self, sync: Optional[Callable[[], None]] = None, enabled: bool = True):
+        self.sync = sync if sync is not None else (lambda: None)
+        self.enabled = enabled
+        self.samples = defaultdict(list)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        self.sync()
+        start = time.perf_counter()
+        yield
+        self.sync()
+        self.samples[name].append(time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {name: summarize(samples) for name, samples in self.samples.items()}
+
+
+def run_benchmark(render: Callable[[Any, StageTimer], Any],
+                  items: Sequence[Any],
+                  warmup: int = 1,
+                  repeats: int = 3,
+                  sync: Optional[Callable[[], None]] = None) -> StageTimer:
+    """Renders every item warmup + repeats times, timing the repeats.
+
+    render(item, timer) should wrap its stages in timer.stage(name); the
+    whole call is recorded as the "frame" stage.
+    """
+    timer = StageTimer(sync)
+    untimed = StageTimer(enabled=False)
+    for _ in range(warmup):
+        for item in items:
+            render(item, untimed)
+    for _ in range(repeats):
+        for item in items:
+            with timer.stage("frame"):
+                render(item, timer)
+    return timer
+
+
+def git_commit(path: str = ".") -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=path, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(path: str = ".") -> Dict[str, Any]:
+    env = dict(
+        host=platform.node(),
+        python=platform.python_version(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        git_commit=git_commit(path),
+    )
+    try:
+        import torch
+        env["torch"] = torch.__version__
+        if torch.cuda.is_available():
+            env["device"] = torch.cuda.get_device_name()
+    except ImportError:
+        pass
+    return env
+
+
+def write_json(path: str, results: Dict[str, Any]):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)